@@ -32,19 +32,6 @@
           };
           doCheck = false;
         };
-        treelib = pythonPackages.buildPythonPackage rec {
-          pname = "treelib";
-          version = "1.6.1";
-          name = "${pname}-${version}";
-          src = builtins.fetchurl {
-            url = "https://files.pythonhosted.org/packages/04/b0/2269c328abffbb63979f7143351a24a066776b87526d79956aea5018b80a/treelib-1.6.1.tar.gz";
-            sha256 = "1247rv9fbb8pw3xbkbz04q3vnvvva3hcw002gp1clp5psargzgqw";
-          };
-          propagatedBuildInputs = [
-            pythonPackages.future
-          ];
-          doCheck = false;
-        };
 
       in {
         packages.nix-gui = pkgs.callPackage
@@ -57,7 +44,6 @@
                 pythonPackages.pyqt5
                 pythonPackages.pypandoc
                 pylspclient
-                treelib
                 rnix-lsp.defaultPackage."${system}"
               ];
               makeWrapperArgs = [
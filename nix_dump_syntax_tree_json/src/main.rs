@@ -1,9 +1,81 @@
+use std::io::{self, BufRead, BufWriter, Read, Write};
 use std::{env, fs};
 
+// Write the "errors" and "tree" fields of a parse result object
+fn write_parse_result<W: Write>(out: &mut W, content: &str) -> io::Result<()> {
+    let ast = rnix::parse(content);
+    let errors: Vec<String> = ast.errors().into_iter().map(|error| error.to_string()).collect();
+    write!(out, "\"errors\":{},\"tree\":", serde_json::to_string(&errors)?)?;
+    serde_json::to_writer(&mut *out, &ast.node())?;
+    Ok(())
+}
+
+fn write_error_result<W: Write>(out: &mut W, error: String) -> io::Result<()> {
+    write!(out, "\"errors\":{},\"tree\":null", serde_json::to_string(&vec![error])?)
+}
+
+// Write one line of JSON per file: {"path": <file>, "errors": [<error>, ...], "tree": <syntax tree or null>}
+// The tree is null if the file couldn't be read, a file with parse errors still has a (partial) tree
+fn dump_ndjson<I: Iterator<Item = String>>(files: I) -> io::Result<()> {
+    let stdout = io::stdout();
+    let mut out = BufWriter::new(stdout.lock());
+    for file in files {
+        write!(out, "{{\"path\":{},", serde_json::to_string(&file)?)?;
+        match fs::read_to_string(&file) {
+            Ok(content) => write_parse_result(&mut out, &content)?,
+            Err(err) => write_error_result(&mut out, format!("error reading file: {}", err))?,
+        }
+        writeln!(out, "}}")?;
+    }
+    out.flush()
+}
+
+// Read requests from stdin until it's closed, each is the length of the source in bytes on its own line
+// followed by the UTF-8 source. Respond to each with a line of JSON: {"errors": [<error>, ...], "tree": <syntax tree>}
+fn serve() -> io::Result<()> {
+    let stdin = io::stdin();
+    let mut input = stdin.lock();
+    let stdout = io::stdout();
+    let mut out = BufWriter::new(stdout.lock());
+    let mut header = String::new();
+    loop {
+        header.clear();
+        if input.read_line(&mut header)? == 0 {
+            return Ok(());
+        }
+        let length: usize = header
+            .trim()
+            .parse()
+            .map_err(|err| io::Error::new(io::ErrorKind::InvalidData, err))?;
+        let mut content = vec![0; length];
+        input.read_exact(&mut content)?;
+
+        write!(out, "{{")?;
+        match String::from_utf8(content) {
+            Ok(content) => write_parse_result(&mut out, &content)?,
+            Err(err) => write_error_result(&mut out, format!("error decoding source: {}", err))?,
+        }
+        writeln!(out, "}}")?;
+        out.flush()?;
+    }
+}
+
 fn main() {
     let mut iter = env::args().skip(1).peekable();
+    if iter.peek().map_or(false, |arg| arg == "--server") {
+        serve().unwrap();
+        return;
+    }
+    let ndjson = iter.peek().map_or(false, |arg| arg == "--ndjson");
+    if ndjson {
+        iter.next();
+    }
     if iter.peek().is_none() {
-        eprintln!("Usage: nix_dump_syntax_tree_json <file>");
+        eprintln!("Usage: nix_dump_syntax_tree_json [--ndjson] <file>... | --server");
+        return;
+    }
+    if ndjson {
+        dump_ndjson(iter).unwrap();
         return;
     }
     for file in iter {
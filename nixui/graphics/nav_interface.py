@@ -86,7 +86,9 @@ class OptionNavigationInterface(QtWidgets.QWidget):
         self.uri_stack.append(f'options:{option_path}')
 
         self.nav_bar.replace_widget(
-            navbar.NavBar.as_option_tree(option_path, self.set_lookup_key, back_enabled=len(self.uri_stack) > 1)
+            navbar.NavBar.as_option_tree(
+                option_path, self.set_lookup_key, back_enabled=len(self.uri_stack) > 1, search_fn=self.update_search_query
+            )
         )
         num_children = len(api.get_option_tree().children(option_path, mode="leaves"))
 
@@ -141,10 +143,14 @@ class OptionNavigationInterface(QtWidgets.QWidget):
             )
 
     def set_search_query(self, search_str):
-        self.uri_stack.append(f'search:{search_str}')
+        # the query may already be displayed by update_search_query
+        if not self.uri_stack or self.uri_stack[-1] != f'search:{search_str}':
+            self.uri_stack.append(f'search:{search_str}')
 
         self.nav_bar.replace_widget(
-            navbar.NavBar.as_search_query(search_str, self.set_lookup_key, back_enabled=len(self.uri_stack) > 1)
+            navbar.NavBar.as_search_query(
+                search_str, self.set_lookup_key, back_enabled=len(self.uri_stack) > 1, search_fn=self.update_search_query
+            )
         )
 
         self.nav_list.replace_widget(
@@ -154,3 +160,26 @@ class OptionNavigationInterface(QtWidgets.QWidget):
             )
         )
         self.fields_view.replace_widget(QtWidgets.QLabel(''))
+
+    def update_search_query(self, search_str):
+        """
+        Update the search results while the search query is typed. Unlike set_search_query the nav bar, which
+        is being typed in, isn't replaced, and consecutive updates share one entry in the lookup key history.
+        """
+        if not search_str.strip():
+            return
+        if self.uri_stack and self.uri_stack[-1].startswith('search:'):
+            self.uri_stack[-1] = f'search:{search_str}'
+        else:
+            self.uri_stack.append(f'search:{search_str}')
+
+        if isinstance(self.nav_list.current_widget, navlist.SearchResultListDisplay):
+            self.nav_list.current_widget.set_search_str(search_str)
+        else:
+            self.nav_list.replace_widget(
+                navlist.SearchResultListDisplay(
+                    search_str,
+                    self.set_option_path,
+                )
+            )
+            self.fields_view.replace_widget(QtWidgets.QLabel(''))
@@ -1,6 +1,6 @@
 from functools import partial
 
-from PyQt5 import QtWidgets, QtGui
+from PyQt5 import QtWidgets, QtCore, QtGui
 
 from nixui.options.attribute import Attribute
 
@@ -8,6 +8,9 @@ from nixui.options.attribute import Attribute
 MAGNIFYING_GLASS_UNICODE = "🔍"
 TREE_UNICODE = "🌲"
 
+# time after the last edit of the searchbox before searching
+SEARCH_DEBOUNCE_MSECS = 250
+
 
 class FocusChangeTextLineEdit(QtWidgets.QLineEdit):
     def __init__(self, unfocused_text, focused_text, *args, **kwargs):
@@ -41,7 +44,10 @@ class NavBar(QtWidgets.QWidget):
     - move undo toolbar item here
     - delete search toolbar item
     """
-    def __init__(self, set_lookup_key_fn, unfocused_text, focused_text, search_str=None, up_fn=None, back_enabled=True):
+    def __init__(self, set_lookup_key_fn, unfocused_text, focused_text, search_str=None, up_fn=None, back_enabled=True, search_fn=None):
+        """
+        search_fn: if passed, called with the search string while it's typed, once typing pauses
+        """
         super().__init__()
 
         # create widgets and define behavior
@@ -69,9 +75,17 @@ class NavBar(QtWidgets.QWidget):
         searchbox.setPlaceholderText('Search...')
         if search_str:
             searchbox.setText(search_str)
-        searchbox.returnPressed.connect(
-            lambda: set_lookup_key_fn(f'search:{searchbox.text()}')
-        )
+        search_timer = QtCore.QTimer(self)
+        search_timer.setSingleShot(True)
+        search_timer.setInterval(SEARCH_DEBOUNCE_MSECS)
+        if search_fn is not None:
+            search_timer.timeout.connect(lambda: search_fn(searchbox.text()))
+            searchbox.textEdited.connect(search_timer.start)
+
+        def search():
+            search_timer.stop()
+            set_lookup_key_fn(f'search:{searchbox.text()}')
+        searchbox.returnPressed.connect(search)
 
         # setup shortcuts
         search_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Ctrl+F'), self)
@@ -90,9 +104,10 @@ class NavBar(QtWidgets.QWidget):
         self.setLayout(hbox)
 
     @classmethod
-    def as_option_tree(cls, option_path, set_lookup_key_fn, back_enabled=True):
+    def as_option_tree(cls, option_path, set_lookup_key_fn, back_enabled=True, search_fn=None):
         kwargs = dict(
             set_lookup_key_fn=set_lookup_key_fn,
+            search_fn=search_fn,
             unfocused_text=' » '.join([TREE_UNICODE] + list(option_path)),
             focused_text=f'options:{str(option_path)}',
             back_enabled=back_enabled,
@@ -102,9 +117,10 @@ class NavBar(QtWidgets.QWidget):
         return cls(**kwargs)
 
     @classmethod
-    def as_search_query(cls, search_str, set_lookup_key_fn, back_enabled=True):
+    def as_search_query(cls, search_str, set_lookup_key_fn, back_enabled=True, search_fn=None):
         return cls(
             set_lookup_key_fn=set_lookup_key_fn,
+            search_fn=search_fn,
             unfocused_text=f'{MAGNIFYING_GLASS_UNICODE} » {search_str}',
             focused_text=f'search:{search_str}',
             search_str=search_str,
@@ -1,11 +1,11 @@
 import collections
-import csv
+import itertools
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 
 from nixui.graphics import icon, richtext, color_indicator
 from nixui.options.attribute import Attribute
-from nixui.options import api, option_definition, types
+from nixui.options import api, search, types
 from nixui.utils.logger import logger
 
 
@@ -17,7 +17,7 @@ class GenericNavListDisplay:
         elif isinstance(option_type, types.ListOfType):
             return DynamicListOf(statemodel, option_path, set_option_path_fn, selected)
         else:
-            return StaticAttrsOf(option_path, set_option_path_fn, selected)
+            return StaticAttrsOf(option_path, set_option_path_fn, selected, statemodel=statemodel)
 
 
 class OptionListItemDelegate(QtWidgets.QStyledItemDelegate):
@@ -112,7 +112,7 @@ class OptionListItem(QtWidgets.QListWidgetItem):
         self.icon_path = icon_path
 
         if use_child_count:
-            num_direct_children = len(self.option_tree.children(self.option))
+            num_direct_children = self.option_tree.count_children(self.option)
             num_descendants = self.option_tree.count_leaves(self.option)
             self.child_count = f'{num_direct_children}/{num_descendants}'
         else:
@@ -148,22 +148,164 @@ class OptionListItem(QtWidgets.QListWidgetItem):
         return color
 
 
-class OptionScrollListSelector(QtWidgets.QListWidget):
-    def __init__(self, base_option_path, set_option_path_fn=None):
+class OptionListModel(QtCore.QAbstractListModel):
+    """
+    Options listed by a navlist. The data of a row (label, child count, status color) is only calculated once
+    the row is displayed, and is cached for the most recently displayed rows. If a statemodel is passed, the
+    cache is cleared whenever it records or undoes a change.
+    """
+    OptionRole = QtCore.Qt.UserRole
+
+    option_renamed = QtCore.pyqtSignal(Attribute, Attribute)  # old option, new option
+
+    row_data_cache_size = 256
+
+    def __init__(self, options, use_full_option_path=False, use_child_count=True, editable=False, statemodel=None):
+        super().__init__()
+        self.option_tree = api.get_option_tree()
+        self.options = list(options)
+        self.use_full_option_path = use_full_option_path
+        self.use_child_count = use_child_count
+        self.editable = editable
+        self._row_data_cache = collections.OrderedDict()  # option -> row data, least recently used first
+        if statemodel is not None:
+            # navlists are replaced on navigation, don't keep them alive
+            statemodel.slotmapper.add_slot('update_recorded', self.reload_row_data, weak=True)
+            statemodel.slotmapper.add_slot('undo_performed', self.reload_row_data, weak=True)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.options)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        option = self.options[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return self.get_row_data(option)
+        elif role == QtCore.Qt.EditRole:
+            return option.get_end()
+        elif role == self.OptionRole:
+            return option
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if self.editable:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if role != QtCore.Qt.EditRole or not index.isValid():
+            return False
+        old_option = self.options[index.row()]
+        if value == old_option.get_end():
+            return False
+        option = Attribute.from_insertion(old_option.get_set(), value)
+        self.options[index.row()] = option
+        self._row_data_cache.pop(old_option, None)
+        self.dataChanged.emit(index, index)
+        self.option_renamed.emit(old_option, option)
+        return True
+
+    def reload_row_data(self, *args, **kwargs):
+        """
+        Clear the row data after an edit, which may have changed the status color and child count of any row.
+        Views only request the data of rows they display again.
+        """
+        self._row_data_cache.clear()
+        if self.options:
+            self.dataChanged.emit(self.index(0), self.index(len(self.options) - 1))
+
+    def get_row_data(self, option):
+        if option in self._row_data_cache:
+            self._row_data_cache.move_to_end(option)
+            return self._row_data_cache[option]
+
+        if self.use_child_count:
+            try:
+                num_direct_children = self.option_tree.count_children(option)
+                num_descendants = self.option_tree.count_leaves(option)
+                child_count = f'{num_direct_children}/{num_descendants}'
+            except ValueError:
+                child_count = None  # not yet in the option tree
+        else:
+            child_count = None
+        row_data = {
+            'text': str(option) if self.use_full_option_path else str(option[-1]),
+            'child_count': child_count,
+            'extra_text': None,
+            'icon_path': None,
+            'status_circle_color': color_indicator.get_edit_state_color_indicator(self.option_tree, option),
+        }
+
+        self._row_data_cache[option] = row_data
+        if len(self._row_data_cache) > self.row_data_cache_size:
+            self._row_data_cache.popitem(last=False)
+        return row_data
+
+    def get_widest_row(self, font_metrics):
+        """
+        Row with the widest label, found without calculating the status colors of every row
+        """
+        def label_width(option):
+            text = str(option) if self.use_full_option_path else str(option[-1])
+            if self.use_child_count:
+                try:
+                    text += f' ({self.option_tree.count_children(option)}/{self.option_tree.count_leaves(option)})'
+                except ValueError:
+                    pass  # not yet in the option tree
+            return font_metrics.width(text)
+        return max(range(len(self.options)), key=lambda row: label_width(self.options[row]))
+
+    def row_of(self, option_key):
+        for row, option in enumerate(self.options):
+            if option.get_end() == option_key:
+                return row
+        raise KeyError(option_key)
+
+    def insert_option(self, row, option):
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.options.insert(row, option)
+        self.endInsertRows()
+
+    def remove_option(self, row):
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        option = self.options.pop(row)
+        self.endRemoveRows()
+        self._row_data_cache.pop(option, None)
+        return option
+
+    def move_option(self, row, new_row):
+        # beginMoveRows' destination is the row the option is inserted before, prior to removal
+        destination = new_row + 1 if new_row > row else new_row
+        if not self.beginMoveRows(QtCore.QModelIndex(), row, row, QtCore.QModelIndex(), destination):
+            return False
+        self.options.insert(new_row, self.options.pop(row))
+        self.endMoveRows()
+        return True
+
+
+class OptionScrollListSelector(QtWidgets.QListView):
+    def __init__(self, base_option_path, set_option_path_fn=None, editable=False, statemodel=None):
         super().__init__()
 
         # change selected callback
         self.base_option_path = base_option_path
         self.set_option_path_fn = set_option_path_fn
-        self.itemClicked.connect(self.set_option_path_callback)
-
-        # load options
-        options = api.get_option_tree().children(base_option_path)
-        self.option_item_map = {}
-        for option in options:
-            item = OptionListItem(option)
-            self.addItem(item)
-            self.option_item_map[option.get_end()] = item
+        self.clicked.connect(self.set_option_path_callback)
+
+        # load options, their data is loaded once displayed
+        self.setModel(OptionListModel(
+            api.get_option_tree().children(base_option_path),
+            editable=editable,
+            statemodel=statemodel,
+        ))
+        # rows have equal heights, only the first row's size is needed to lay out the rows
+        self.setUniformItemSizes(True)
+        # only edit on double click, as with the QListWidget this replaced
+        self.setEditTriggers(QtWidgets.QAbstractItemView.DoubleClicked)
 
         self._setup_scroll_list_selector_theme()  # form look and feel
 
@@ -172,25 +314,32 @@ class OptionScrollListSelector(QtWidgets.QListWidget):
         self.setSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.MinimumExpanding)
         self.setItemDelegate(OptionListItemDelegate())
         self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
-        self.setMinimumWidth(self.sizeHintForColumn(0))
-
-    def set_current_option(self, option_path):
-        self.setCurrentItem(
-            self.option_item_map[option_path]
+        if self.model().rowCount():
+            # wide enough for the widest row, sizeHintForColumn would calculate the data of every row
+            widest_row = self.model().get_widest_row(self.fontMetrics())
+            self.setMinimumWidth(self.sizeHintForIndex(self.model().index(widest_row)).width())
+
+    def set_current_option(self, option_key):
+        self.setCurrentIndex(
+            self.model().index(self.model().row_of(option_key))
         )
 
+    def current_option(self):
+        index = self.currentIndex()
+        return index.data(OptionListModel.OptionRole) if index.isValid() else None
+
     def set_option_path_callback(self, *args, **kwargs):
         if self.set_option_path_fn:
             attr = Attribute.from_insertion(
                 self.base_option_path,
-                self.currentItem().option.get_end()
+                self.current_option().get_end()
             )
             self.set_option_path_fn(attr)
 
 
 class StaticAttrsOf(OptionScrollListSelector):
-    def __init__(self, option_path, set_option_path_fn, selected=None, *args, **kwargs):
-        super().__init__(option_path, set_option_path_fn)
+    def __init__(self, option_path, set_option_path_fn, selected=None, statemodel=None, *args, **kwargs):
+        super().__init__(option_path, set_option_path_fn, statemodel=statemodel)
         if selected:
             self.set_current_option(selected)
 
@@ -202,7 +351,9 @@ class DynamicAttrsOf(QtWidgets.QWidget):
         self.statemodel = statemodel
         self.option_path = option_path
 
-        self.list_widget = OptionScrollListSelector(option_path, set_option_path_fn)
+        self.list_widget = OptionScrollListSelector(
+            option_path, set_option_path_fn, editable=True, statemodel=statemodel
+        )
         if selected:
             self.list_widget.set_current_option(selected)
 
@@ -220,37 +371,28 @@ class DynamicAttrsOf(QtWidgets.QWidget):
         btn_hbox.addWidget(self.add_btn)
         btn_hbox.addWidget(self.remove_btn)
 
-        self.list_widget.itemDoubleClicked.connect(self.list_widget.editItem)
-        self.list_widget.itemChanged.connect(self.rename_item)
-        self.list_widget.model().rowsRemoved.connect(lambda: self.remove_item)
+        self.list_widget.model().option_renamed.connect(self.rename_item)
 
         layout = QtWidgets.QVBoxLayout()
         layout.addLayout(btn_hbox)
         layout.addWidget(self.list_widget)
         self.setLayout(layout)
 
-    def remove_item(self, item):
-        print('not implemented')
-
-    def rename_item(self, item):
-        self.statemodel.rename_option(item.previous_option, item.option)
+    def rename_item(self, old_option, option):
+        self.statemodel.rename_option(old_option, option)
 
     def add_clicked(self):
-        item = OptionListItem(
-            Attribute.from_insertion(self.option_path, 'newAttribute'),
-            editable=True
-        )
-        self.list_widget.addItem(item)
-        self.statemodel.add_new_option(item.option)
-        self.list_widget.editItem(item)
+        option = Attribute.from_insertion(self.option_path, 'newAttribute')
+        self.statemodel.add_new_option(option)
+        model = self.list_widget.model()
+        model.insert_option(model.rowCount(), option)
+        index = model.index(model.rowCount() - 1)
+        self.list_widget.setCurrentIndex(index)
+        self.list_widget.edit(index)
 
     def remove_clicked(self):
-        self.list_widget.takeItem(self.list_widget.currentItem())
-
-    def insert_items(self):
-        for option in api.get_option_tree().children(self.option_path):
-            it = self.ItemCls(option)
-            self.list_widget.addItem(it)
+        if self.list_widget.currentIndex().isValid():
+            self.list_widget.model().remove_option(self.list_widget.currentIndex().row())
 
 
 class DynamicListOf(QtWidgets.QWidget):
@@ -260,7 +402,9 @@ class DynamicListOf(QtWidgets.QWidget):
         self.statemodel = statemodel
         self.option_path = option_path
 
-        self.list_widget = OptionScrollListSelector(option_path, set_option_path_fn)
+        self.list_widget = OptionScrollListSelector(
+            option_path, set_option_path_fn, editable=True, statemodel=statemodel
+        )
         if selected:
             self.list_widget.set_current_option(selected)
 
@@ -286,66 +430,131 @@ class DynamicListOf(QtWidgets.QWidget):
         btn_hbox.addWidget(self.up_btn)
         btn_hbox.addWidget(self.down_btn)
 
-        self.list_widget.itemDoubleClicked.connect(self.list_widget.editItem)
-        self.list_widget.itemChanged.connect(self.rename_item)
-        self.list_widget.model().rowsRemoved.connect(lambda: self.remove_item)
+        self.list_widget.model().option_renamed.connect(self.rename_item)
 
         layout = QtWidgets.QVBoxLayout()
         layout.addLayout(btn_hbox)
         layout.addWidget(self.list_widget)
         self.setLayout(layout)
 
-    def remove_item(self, item):
-        print('not implemented')
-
-    def rename_item(self, item):
-        self.statemodel.rename_option(item.previous_option, item.option)
+    def rename_item(self, old_option, option):
+        self.statemodel.rename_option(old_option, option)
 
     def add_clicked(self):
-        item = OptionListItem(
-            Attribute.from_insertion(self.option_path, 'newAttribute'),  # TODO: fix this
-            editable=True
-        )
-        self.list_widget.addItem(item)
-        self.statemodel.add_new_option(item.option)
-        self.list_widget.editItem(item)
+        option = Attribute.from_insertion(self.option_path, 'newAttribute')  # TODO: fix this
+        self.statemodel.add_new_option(option)
+        model = self.list_widget.model()
+        model.insert_option(model.rowCount(), option)
+        index = model.index(model.rowCount() - 1)
+        self.list_widget.setCurrentIndex(index)
+        self.list_widget.edit(index)
 
     def remove_clicked(self):
-        self.list_widget.takeItem(self.list_widget.currentItem())
+        if self.list_widget.currentIndex().isValid():
+            self.list_widget.model().remove_option(self.list_widget.currentIndex().row())
 
     def up_clicked(self):
-        current_row = self.list_widget.currentRow()
+        current_row = self.list_widget.currentIndex().row()
         if current_row == 0:
             logger.info('Cannot move item up, current index is 0')
-        current_item = self.list_widget.takeItem(current_row)
-        self.list_widget.insertItem(current_row - 1, current_item)
+            return
+        self.list_widget.model().move_option(current_row, current_row - 1)
 
     def down_clicked(self):
-        last_item_idx = self.list_widget.count() - 1
-        current_row = self.list_widget.currentRow()
+        last_item_idx = self.list_widget.model().rowCount() - 1
+        current_row = self.list_widget.currentIndex().row()
         if current_row == last_item_idx:
             logger.info('Cannot move item up, current index is end of list')
-        current_item = self.list_widget.takeItem(current_row)
-        self.list_widget.addItem(current_item)
+            return
+        self.list_widget.model().move_option(current_row, current_row + 1)
 
-    def insert_items(self):
-        for option in api.get_option_tree().children(self.option_path):
-            it = self.ItemCls(option)
-            self.list_widget.addItem(it)
+
+class SearchWorker(QtCore.QRunnable):
+    """
+    Runs a search of an IncrementalSearch off the GUI thread
+    """
+    class Signals(QtCore.QObject):
+        results_ready = QtCore.pyqtSignal(int, list)
+
+    def __init__(self, incremental_search, search_str, generation, min_exact_results=0):
+        """
+        min_exact_results: if fewer options match exactly, fuzzy search results are appended
+        """
+        super().__init__()
+        self.signals = self.Signals()
+        self.incremental_search = incremental_search
+        # the option tree's value index is updated by edits on the GUI thread, search a snapshot
+        self.value_index = incremental_search.value_index.copy()
+        self.search_str = search_str
+        self.generation = generation
+        self.min_exact_results = min_exact_results
+
+    def run(self):
+        try:
+            results = self.incremental_search.search(self.search_str, self.value_index)
+            if len(results) < self.min_exact_results:
+                exact_matches = set(option_path for option_path, _ in results)
+                results += [
+                    result for result in self.incremental_search.fuzzy_search(self.search_str)
+                    if result[0] not in exact_matches
+                ]
+        except Exception:
+            logger.exception(f'Search for "{self.search_str}" failed')
+            results = []
+        self.signals.results_ready.emit(self.generation, results)
 
 
 class SearchResultListDisplay(QtWidgets.QListWidget):
     _setup_scroll_list_selector_theme = OptionScrollListSelector._setup_scroll_list_selector_theme
 
+    # results are added in ranked batches, the first batch fills the visible list
+    result_batch_size = 50
+    # fewer exact matches than this are followed by fuzzy matches
+    min_exact_results = 10
+
     def __init__(self, search_str, set_option_path_fn=None):
         super().__init__()
 
         self.set_option_path_fn = set_option_path_fn
         self.itemClicked.connect(self.set_option_path_callback)
 
-        # load options
-        tree = api.get_option_tree()
-        for option_path, matched_operations in self.search_tree_for_options(tree, search_str):
+        # searches run on a single background thread, in order
+        self.incremental_search = search.IncrementalSearch(api.get_option_tree())
+        self.search_thread_pool = QtCore.QThreadPool(self)
+        self.search_thread_pool.setMaxThreadCount(1)
+        self.search_generation = 0  # results of all but the latest search are discarded
+
+        self.pending_results = iter(())
+        self.result_batch_timer = QtCore.QTimer(self)
+        self.result_batch_timer.setSingleShot(True)
+        self.result_batch_timer.timeout.connect(self.add_result_batch)
+
+        self._setup_scroll_list_selector_theme()  # same look and feel as basic nav displays
+
+        self.set_search_str(search_str)
+
+    def set_search_str(self, search_str):
+        """
+        Search in the background and replace the results once done. Searching as the search string grows only
+        searches the previous results.
+        """
+        self.search_generation += 1
+        self.search_thread_pool.clear()  # discard queued searches which haven't started
+        worker = SearchWorker(self.incremental_search, search_str, self.search_generation, self.min_exact_results)
+        worker.signals.results_ready.connect(self.set_results)
+        self.search_thread_pool.start(worker)
+
+    def set_results(self, generation, results):
+        if generation != self.search_generation:
+            return
+        self.result_batch_timer.stop()
+        self.clear()
+        self.pending_results = iter(results)
+        self.add_result_batch()
+
+    def add_result_batch(self):
+        batch = list(itertools.islice(self.pending_results, self.result_batch_size))
+        for option_path, matched_operations in batch:
             item = OptionListItem(
                 option_path,
                 use_full_option_path=True,
@@ -353,68 +562,29 @@ class SearchResultListDisplay(QtWidgets.QListWidget):
                 extra_text='Matched ' + ', '.join(matched_operations)
             )
             self.addItem(item)
-
-        self._setup_scroll_list_selector_theme()  # same look and feel as basic nav displays
+        # yield to the event loop between batches
+        if len(batch) == self.result_batch_size:
+            self.result_batch_timer.start(0)
 
     def search_tree_for_options(self, tree, search_str):
-        # TODO: consider offloading this to nixui/options/search.py
         """
         1) search_str is tokenized
         Example: A search string of
             "foo bar" baz bif
         results in three search tokens
 
-        2) The data of all optionis iterated over, with each token being checked for matches.
+        2) Options are looked up in the index of nixui/options/search.py, with each token being checked for matches.
         For a given options inclusion, each tokens must match at least one search function.
 
         Match operations are prioritized in the following order:
         - token is a substring of the attribute path
-        - token exactly matches the option type
+        - token is a substring of the option type
         - token is in the option description
-        - prioritizing in memory definition, then configured definition, then system default definition
-          (TODO, awaiting https://github.com/nix-gui/nix-gui/issues/9)
-          - token partially matches the unevaluated definition
-          - token exactly matches the string form of the evaluated definition
+        - prioritizing in memory definition, then configured definition, token is in the expression string or
+          the string form of the evaluated definition, if already evaluated (see OptionTree.value_index)
+          - system default definitions aren't searched (TODO, awaiting https://github.com/nix-gui/nix-gui/issues/9)
         """
-        tokens = set([
-            t.lower() for t in
-            next(csv.reader([search_str], delimiter=' ', quotechar='"'))
-        ])
-        attribute_path_score_map = {}
-        for attribute_path, data in tree.iter_attribute_data():
-            matched_tokens = set()
-            matched_operations = collections.OrderedDict([
-                ('Attribute Path', 0), ('Type', 0), ('Description', 0),
-                ('In Memory Value', 0), ('Configured Value', 0),
-                ('System Default Value', 0)
-            ])
-            for token in tokens:
-                if token in str(attribute_path).lower():
-                    matched_tokens.add(token)
-                    matched_operations['Attribute Path'] += 1
-                if data is not None:
-                    if data._type_string != option_definition.Undefined and token in data._type_string.lower():
-                        matched_tokens.add(token)
-                        matched_operations['Type'] += 1
-                    if data.description != option_definition.Undefined and token in data.description.lower():
-                        matched_tokens.add(token)
-                        matched_operations['Description'] += 1
-
-            if matched_tokens == tokens:
-                attribute_path_score_map[attribute_path] = (
-                    tuple(matched_operations.values()),
-                    tuple(k for k, v in matched_operations.items() if v > 0)
-                )
-
-        return [
-            (attribute_path, matched_operations) for
-            attribute_path, (score, matched_operations) in
-            sorted(
-                attribute_path_score_map.items(),
-                key=lambda item: item[1][0],
-                reverse=True
-            )
-        ]
+        return search.search_options(tree, search_str)
 
     def set_option_path_callback(self, *args, **kwargs):
         if self.set_option_path_fn:
@@ -1,3 +1,5 @@
+import time
+
 from nixui.options import api, types, option_definition
 from nixui.graphics import color_indicator, richtext, generic_widgets, field_widgets, toggle_switch
 
@@ -49,6 +51,10 @@ def get_field_widget_classes(option_type):
     )
 
 
+# instrumentation hook, called with (option display, seconds spent painting) after each paint
+paint_hook = None
+
+
 class GenericOptionDisplay(QtWidgets.QWidget):
     def __init__(self, statemodel, set_option_path_fn, option, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -56,6 +62,9 @@ class GenericOptionDisplay(QtWidgets.QWidget):
         self.set_option_path_fn = set_option_path_fn
         self.option = option
 
+        # number of times the display was painted
+        self.paint_count = 0
+
         # make selectable for focus
         self.setFocusPolicy(QtCore.Qt.ClickFocus)
 
@@ -86,6 +95,10 @@ class GenericOptionDisplay(QtWidgets.QWidget):
 
         self._load_definition()
 
+        # the focus highlight is only repainted when the focus of a widget checked by contains_focus changes
+        for w in self.field_widgets + self.field_selector.btn_group.buttons():
+            w.installEventFilter(self)
+
     @staticmethod
     def _get_option_details_layout(option, set_option_path_fn):
         # title and description
@@ -218,10 +231,26 @@ class GenericOptionDisplay(QtWidgets.QWidget):
         qp.fillRect(r, bg_color)
         qp.end()
 
+    def eventFilter(self, obj, event):
+        if event.type() in (QtCore.QEvent.FocusIn, QtCore.QEvent.FocusOut):
+            self.update()
+        return super().eventFilter(obj, event)
+
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        self.update()
+
+    def focusOutEvent(self, event):
+        super().focusOutEvent(event)
+        self.update()
+
     def paintEvent(self, ev):
+        start_time = time.perf_counter()
         super().paintEvent(ev)
         if self.contains_focus():
             self.paint_background_color(
                 QtGui.QPalette().color(QtGui.QPalette().Highlight)
             )
-        self.update()
+        self.paint_count += 1
+        if paint_hook is not None:
+            paint_hook(self, time.perf_counter() - start_time)
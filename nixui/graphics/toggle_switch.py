@@ -48,8 +48,8 @@ class ToggleSwitch(QtWidgets.QWidget):
         self.__background.resize(self.widget_width - 4, self.widget_height - 4)
         self.__background.move(2, 2)
         self.__circle.move(2, 2)
-        self.__labelon.move(self.widget_height / 2, 2)
-        self.__labeloff.move(self.widget_width - off_text_width - self.widget_height / 2, 2)
+        self.__labelon.move(self.widget_height // 2, 2)
+        self.__labeloff.move(self.widget_width - off_text_width - self.widget_height // 2, 2)
 
         self.setChecked(starting_value)
 
@@ -75,7 +75,7 @@ class ToggleSwitch(QtWidgets.QWidget):
         xf = self.width() - self.widget_height + 4
         hback = self.widget_height
         isize = QtCore.QSize(hback, hback)
-        bsize = QtCore.QSize(self.width() - self.widget_height / 2, hback)
+        bsize = QtCore.QSize(self.width() - self.widget_height // 2, hback)
         if old_value:
             xf = 2
             xs = self.width() - 22
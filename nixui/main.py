@@ -10,6 +10,7 @@ from PyQt5 import QtWidgets
 from nixui.options import environment
 from nixui.graphics import main_window
 from nixui import state_model
+from nixui.utils import cache
 
 
 
@@ -33,6 +34,28 @@ def handle_args():
         help="Cache the return values of expensive funtions on disk for use in later sessions.",
         action='store_true',
     )
+    optional.add_argument(
+        "--cache-backend",
+        choices=['sqlite', 'file'],
+        help="Store the disk cache in a single SQLite database or in one file per cached result (default sqlite).",
+        default=None,
+    )
+    optional.add_argument(
+        "--cache-max-size",
+        type=float,
+        help=f"Maximum size of the disk cache in megabytes, least recently used results are evicted (default {cache.DEFAULT_MAX_SIZE_MB}).",
+        default=None,
+    )
+    optional.add_argument(
+        "--cache-stats",
+        help="Print the number and size of disk cache records per cached function and exit.",
+        action='store_true',
+    )
+    optional.add_argument(
+        "--cache-prune",
+        help="Remove stale disk cache records, evict records exceeding the maximum cache size, and exit.",
+        action='store_true',
+    )
     optional.add_argument(
         "-p",
         "--profile",
@@ -52,11 +75,31 @@ def run_program():
     app.exec()
 
 
+def print_cache_stats():
+    stats = cache.get_stats()
+    for (version, module, function), function_stats in sorted(stats.items()):
+        print(f"{version} {module}.{function}: {function_stats['count']} records, {function_stats['size'] / 1024 / 1024:.2f} MB")
+    total_size = sum(function_stats['size'] for function_stats in stats.values())
+    print(f"total: {sum(function_stats['count'] for function_stats in stats.values())} records, {total_size / 1024 / 1024:.2f} MB")
+
+
 def main():
     args = handle_args()
 
     os.environ['CONFIGURATION_PATH'] = args.config_path
     os.environ['USE_DISKCACHE'] = json.dumps(not args.no_diskcache)
+    if args.cache_backend is not None:
+        os.environ['NIXGUI_CACHE_BACKEND'] = args.cache_backend
+    if args.cache_max_size is not None:
+        os.environ['NIXGUI_CACHE_MAX_SIZE_MB'] = str(args.cache_max_size)
+
+    if args.cache_stats or args.cache_prune:
+        if args.cache_prune:
+            removed_count, removed_size = cache.prune()
+            print(f"removed {removed_count} records, {removed_size / 1024 / 1024:.2f} MB")
+        if args.cache_stats:
+            print_cache_stats()
+        return
 
     if args.profile:
         with cProfile.Profile() as profile:
@@ -65,6 +108,8 @@ def main():
         p.strip_dirs()
         p.sort_stats('cumtime')
         p.print_stats(50)
+        for (module, function), cache_info in sorted(cache.get_cache_infos().items()):
+            print(f'{module}.{function}: {cache_info}')
     else:
         run_program()
 
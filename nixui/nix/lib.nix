@@ -51,18 +51,74 @@ in lib.makeExtensible (self: {
         }
       else m;
 
+  /* Get the paths imported by an evaluated module, ignoring inline (non-path) modules
+  */
+  importPathsOf = module_config:
+    /* Converting paths to strings is a hack required by https://github.com/NixOS/nix/issues/5612 */
+    map builtins.toString (
+      builtins.filter
+        (i: builtins.isPath i || builtins.isString i)
+        (module_config.imports or [])
+    );
+
+  /* Extract all positions of the declarations in an evaluated module
+  */
+  definedAttrsOf = module_config: let
+    inherit (self) collectDeclarationPositions;
+
+    declarations = builtins.removeAttrs module_config ["imports"];
+    attr_names = builtins.attrNames declarations;
+
+    # TODO: find a better way of getting module path
+    hacked_module_path = (builtins.unsafeGetAttrPos (builtins.elemAt attr_names 0) declarations).file;
+  in
+    if attr_names == []
+    then []
+    else collectDeclarationPositions {module_path = hacked_module_path; inherit declarations;};
+
   /*Evaluate the imports of a given module*/
   get_modules_evaluated_import_paths = module_path:
-    let
-      inherit (self) evalModuleStub;
-      module_config = evalModuleStub module_path;
+    self.importPathsOf (self.evalModuleStub module_path);
+
+  /* Evaluate a module and its transitive imports, returning for each module
+     its path, the paths it imports, the positions of its defined attributes and
+     the position of its `imports` attribute. The root module is first.
+
+     Type:
+       get_module_graph :: Path -> [{
+         path = String;
+         imports = [String];
+         defined_attrs = [{ loc = [String]; position = Position; }];
+         imports_position = Position | null;
+       }]
+  */
+  get_module_graph = root_path: let
+    inherit (self) evalModuleStub importPathsOf definedAttrsOf;
+
+    # `import` of a directory imports its default.nix
+    expandPath = p: let
+      s = builtins.toString p;
     in
-      /* Converting paths to strings is a hack required by https://github.com/NixOS/nix/issues/5612 */
-      map builtins.toString (
-        if builtins.hasAttr "imports" module_config
-        then module_config.imports
-        else []
-      );
+      if builtins.pathExists (s + "/default.nix") then s + "/default.nix" else s;
+
+    evalModuleItem = module_path: {
+      key = expandPath module_path;
+      module_config = evalModuleStub (expandPath module_path);
+    };
+
+    modules = builtins.genericClosure {
+      startSet = [ (evalModuleItem root_path) ];
+      operator = item: map evalModuleItem (importPathsOf item.module_config);
+    };
+  in
+    map
+      (item: {
+        path = item.key;
+        imports = map expandPath (importPathsOf item.module_config);
+        defined_attrs = definedAttrsOf item.module_config;
+        imports_position = builtins.unsafeGetAttrPos "imports" item.module_config;
+      })
+      modules;
 
 
   /* Get all NixOS options as a list of options with the following schema:
@@ -85,14 +141,7 @@ in lib.makeExtensible (self: {
 
   /* Extract all positions of the declarations in a module
   */
-  get_modules_defined_attrs = module_path: let
-    inherit (self) collectDeclarationPositions evalModuleStub;
-
-    module_config = builtins.removeAttrs (evalModuleStub module_path) ["imports"];
-
-    # TODO: find a better way of getting module path
-    hacked_module_path = (builtins.unsafeGetAttrPos (builtins.elemAt (builtins.attrNames module_config) 0) module_config).file;
-  in
-    collectDeclarationPositions {module_path = hacked_module_path; declarations = module_config;};
+  get_modules_defined_attrs = module_path:
+    self.definedAttrsOf (self.evalModuleStub module_path);
 
 })
@@ -7,11 +7,38 @@ from nixui.utils import cache, store, remap_dict
 #############################
 # utility functions / caching
 ############################
-@cache.cache(cache.first_arg_path_hash_fn, diskcache=False)
+# configuration path -> OptionTree, updated in place when the configuration or one of its imports changes
+_option_trees = {}
+
+
+@cache.cache(cache.first_arg_import_closure_hash_fn, diskcache=False)
 def get_option_tree(configuration_path=None):
+    """
+    OptionTree of the configuration. Once built, the same tree is returned and updated in place when the
+    configuration or one of its imports changes: configured definitions are replaced, in memory definitions
+    (unsaved edits) are kept, unless they are identical to the new configured definition.
+    """
     if configuration_path is None:
         configuration_path = os.environ['CONFIGURATION_PATH']
 
+    config_options = parser.get_all_option_values(configuration_path)
+    if configuration_path in _option_trees:
+        # only modules which changed are re-parsed, only their definitions are updated
+        tree = _option_trees[configuration_path]
+        tree.update_configured_definitions(config_options)
+        return tree
+
+    tree = get_system_option_tree().with_configured(config_options)
+    _option_trees[configuration_path] = tree
+    return tree
+
+
+@cache.cache(lambda: nix_eval.get_installed_nixos_nixpkgs_version(), return_copy=False, diskcache=False)
+def get_system_option_tree():
+    """
+    OptionTree of the system options without any configuration, built once per nixpkgs version.
+    Configurations are applied with `OptionTree.with_configured`, which leaves this tree unmodified.
+    """
     system_option_data_dict = {
         option_path: remap_dict.key_remapper(
             option_data_dict,
@@ -19,10 +46,7 @@ def get_option_tree(configuration_path=None):
         )
         for option_path, option_data_dict in nix_eval.get_all_nixos_options().items()
     }
-    return option_tree.OptionTree(
-        system_option_data_dict,
-        parser.get_all_option_values(configuration_path)
-    )
+    return option_tree.OptionTree(system_option_data_dict, {})
 
 
 ###############
@@ -1,37 +1,63 @@
-from dataclasses import dataclass, field
+import csv
 import functools
 import re
-from typing import List
-import csv
+import sys
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_attribute_string(path):
+    if not path:
+        return ()
+    if '"' not in path:
+        # fast path, unquoted dotted path
+        return tuple(map(sys.intern, path.split('.')))
+    return tuple(map(sys.intern, next(csv.reader([path], delimiter='.', quotechar='"'))))
 
 
-@dataclass(frozen=True)
 class Attribute:
-    loc: List[str] = field(default_factory=list)
+    """
+    Immutable attribute path, e.g. `Attribute('services.foo.enable')` or `Attribute(['services', 'foo', 'enable'])`
+
+    loc is a tuple of interned strings, the hash and string form are calculated at most once.
+    """
+    __slots__ = ('loc', '_hash', '_str')
 
     def __init__(self, path):
-        if isinstance(path, list):
-            object.__setattr__(self, 'loc', path)
-        elif isinstance(path, str):
-            object.__setattr__(self, 'loc', next(csv.reader([path], delimiter='.', quotechar='"')))
+        if isinstance(path, str):
+            loc = _parse_attribute_string(path)
+        elif isinstance(path, (list, tuple)):
+            loc = tuple(map(sys.intern, path))
         else:
             raise TypeError(str(type(path)), path)
+        object.__setattr__(self, 'loc', loc)
+        object.__setattr__(self, '_hash', None)
+        object.__setattr__(self, '_str', None)
+
+    @classmethod
+    def _from_interned_loc(cls, loc):
+        # skip interning segments which are already interned
+        attribute = cls.__new__(cls)
+        object.__setattr__(attribute, 'loc', loc)
+        object.__setattr__(attribute, '_hash', None)
+        object.__setattr__(attribute, '_str', None)
+        return attribute
 
     @classmethod
     def from_insertion(cls, attribute_set, attribute):
-        return cls(attribute_set.loc + [attribute])
+        return cls._from_interned_loc(attribute_set.loc + (sys.intern(attribute),))
 
     def get_set(self):
-        return Attribute(self.loc[:-1])
+        return Attribute._from_interned_loc(self.loc[:-1])
 
     def get_end(self):
         return self.loc[-1]
 
     def startswith(self, attribute_set):
-        if len(attribute_set) > len(self):
+        prefix = attribute_set.loc
+        if len(prefix) > len(self.loc):
             return False
-        for i, key in enumerate(attribute_set):
-            if self[i] != key:
+        for i, key in enumerate(prefix):
+            if self.loc[i] is not key and self.loc[i] != key:
                 return False
         return True
 
@@ -58,38 +84,66 @@ class Attribute:
                 return None
         return None
 
+    def __setattr__(self, name, value):
+        raise AttributeError(f'cannot assign to field {name!r}')
+
+    def __reduce__(self):
+        return (Attribute, (self.loc,))
+
+    def __setstate__(self, state):
+        # Attributes pickled when Attribute was a dataclass wrapping a list
+        if isinstance(state, tuple):
+            state = state[-1]
+        object.__setattr__(self, 'loc', tuple(map(sys.intern, state['loc'])))
+        object.__setattr__(self, '_hash', None)
+        object.__setattr__(self, '_str', None)
+
     def __bool__(self):
         return bool(self.loc)
 
     def __getitem__(self, subscript):
         if isinstance(subscript, slice):
-            return Attribute(self.loc[subscript])
+            return Attribute._from_interned_loc(self.loc[subscript])
         else:
             return self.loc[subscript]
 
     def __iter__(self):
         return iter(self.loc)
 
+    def __contains__(self, key):
+        return key in self.loc
+
     def __len__(self):
         return len(self.loc)
 
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Attribute):
+            return NotImplemented
+        return hash(self) == hash(other) and self.loc == other.loc
+
     def __lt__(self, other):
         # defined such that iterating over sorted attributes is a bredth first search
         return (-len(self), str(self)) < (-len(other), str(other))
 
     def __str__(self):
-        return '.'.join([
-            attribute
-            if attribute_key_neednt_be_quoted(attribute)
-            else f'"{attribute}"'
-            for attribute in self.loc
-        ])
+        if self._str is None:
+            object.__setattr__(self, '_str', '.'.join(map(_format_key, self.loc)))
+        return self._str
 
     def __repr__(self):
         return f"Attribute('{str(self)}')"
 
     def __hash__(self):
-        return hash(tuple(self.loc))
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(self.loc))
+        return self._hash
+
+
+@functools.lru_cache(maxsize=65536)
+def _format_key(key):
+    return key if attribute_key_neednt_be_quoted(key) else f'"{key}"'
 
 
 """
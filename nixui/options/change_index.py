@@ -0,0 +1,29 @@
+class ChangeIndex:
+    """
+    Reference counted index of the ancestors of changed attributes.
+    ancestor_counts maps each attribute to the number of changed attributes it is a strict ancestor of, so
+    whether an attribute has a changed descendent is a single dict lookup and a change is recorded in O(depth).
+    """
+    def __init__(self):
+        self.changed_attributes = set()
+        self.ancestor_counts = {}  # attribute -> number of changed descendents
+
+    def set_changed(self, attribute, is_changed):
+        if is_changed == (attribute in self.changed_attributes):
+            return
+        if is_changed:
+            self.changed_attributes.add(attribute)
+            delta = 1
+        else:
+            self.changed_attributes.discard(attribute)
+            delta = -1
+        for i in range(len(attribute)):
+            ancestor = attribute[:i]
+            count = self.ancestor_counts.get(ancestor, 0) + delta
+            if count:
+                self.ancestor_counts[ancestor] = count
+            else:
+                del self.ancestor_counts[ancestor]
+
+    def __contains__(self, attribute):
+        return attribute in self.ancestor_counts
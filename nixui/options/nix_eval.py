@@ -5,10 +5,13 @@ import importlib.resources
 from contextlib import contextmanager
 from string import Template
 import os
+import re
 import sys
+import threading
 
 from nixui.utils.logger import logger
-from nixui.utils import cache
+from nixui.utils import cache, file_fingerprint
+from nixui.options import nix_repl
 from nixui.options.attribute import Attribute
 
 env_nix_instantiate = os.environ.copy()
@@ -16,8 +19,12 @@ env_nix_instantiate["NIXPKGS_ALLOW_UNFREE"] = "1"
 # note: we dont install unfree pkgs, just get the metadata
 # fix parse error when NIXPKGS_ALLOW_UNFREE=0
 
+def get_installed_nixos_nixpkgs_version():
+    return nix_instantiate_eval("with import <nixpkgs/nixos> { configuration = {}; }; pkgs.lib.version")
+
+
 cache_by_unique_installed_nixos_nixpkgs_version = cache.cache(
-    lambda *a, **k: nix_instantiate_eval("with import <nixpkgs/nixos> { configuration = {}; }; pkgs.lib.version")
+    lambda *a, **k: get_installed_nixos_nixpkgs_version()
 )
 
 
@@ -41,8 +48,85 @@ def nix_instantiate(*args):
     return p.stdout.decode('utf-8')
 
 
+# nix_instantiate_eval may be called concurrently, the pool and the module stats are guarded by _repl_pool_lock
+_repl_pool_lock = threading.Lock()
+_repl_pool = None
+_repl_pool_failed = False  # the pool couldn't be created or a worker failed, nix-instantiate is used instead
+_module_stats = {}
+
+
+def _get_repl_pool():
+    """
+    The pool of `nix repl` workers, created on first use, or None if it's unavailable
+    """
+    global _repl_pool, _repl_pool_failed
+    with _repl_pool_lock:
+        if _repl_pool is None and not _repl_pool_failed:
+            _repl_pool = nix_repl.create_pool(env_nix_instantiate)
+            _repl_pool_failed = _repl_pool is None
+        return _repl_pool
+
+
+def _invalidate_repl_pool_if_modified(*module_paths):
+    """
+    Workers cache every file they import, if any of module_paths changed since last seen, restart them
+    Returns whether any of them changed
+    """
+    is_modified = False
+    for module_path in module_paths:
+        try:
+            st = os.stat(module_path)
+        except OSError:
+            continue
+        stat_tuple = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with _repl_pool_lock:
+            previous_stat_tuple = _module_stats.get(module_path)
+            _module_stats[module_path] = stat_tuple
+        is_modified |= previous_stat_tuple is not None and previous_stat_tuple != stat_tuple
+    if is_modified:
+        pool = _get_repl_pool()
+        if pool is not None:
+            pool.invalidate()
+    return is_modified
+
+
+def _repl_eval(expr):
+    """
+    Evaluate expr with a warm `nix repl` worker
+    Raises nix_repl.ReplUnavailable if no worker could evaluate expr
+    """
+    global _repl_pool, _repl_pool_failed
+    pool = _get_repl_pool()
+    if pool is None:
+        raise nix_repl.ReplUnavailable('nix evaluator pool is disabled')
+    try:
+        return pool.eval_json(expr)
+    except nix_repl.ReplUnavailable as e:
+        with _repl_pool_lock:
+            if _repl_pool is not pool:
+                raise  # already shut down by another thread
+            logger.warning(f'nix evaluator pool failed, falling back to nix-instantiate:\n{e}')
+            _repl_pool, _repl_pool_failed = None, True
+        pool.shutdown()
+        raise
+
+
 def nix_instantiate_eval(expr, strict=False, show_trace=False, retry_show_trace_on_error=True):
+    """
+    Evaluate expr and return its JSON-decoded value. Unless show_trace is set, a `nix repl` worker is used if
+    available, see nix_repl.ReplWorker.eval_json for how that differs from `nix-instantiate --eval`:
+    `strict` has no effect and relative paths in expr don't resolve against the working directory.
+    """
     logger.debug(expr)
+    if not show_trace:
+        try:
+            return _repl_eval(expr)
+        except nix_repl.ReplUnavailable:
+            pass
+        except nix_repl.ReplEvalError:
+            # re-run with nix-instantiate to raise the same NixEvalError as without the pool
+            show_trace = retry_show_trace_on_error
+
     command_args = [
         '--eval',
         '-E',
@@ -73,6 +157,59 @@ def nix_instantiate_eval(expr, strict=False, show_trace=False, retry_show_trace_
         raise e
 
 
+NIX_IDENTIFIER_REGEXP = re.compile(r"[a-zA-Z_][a-zA-Z0-9_'-]*")
+
+
+def nix_instantiate_eval_many(exprs):
+    """
+    Evaluate many expressions in a single evaluation
+    Returns a list containing either the JSON-decoded value or a NixEvalError for each expression
+
+    Each expression is wrapped in `builtins.tryEval` so a `throw` or failed `assert` doesn't fail the batch.
+    Variables which aren't defined, e.g. `pkgs`, `lib` or `config` of the module an expression is from, would
+    fail the whole batch with "undefined variable", so every identifier in the batch is bound to a `throw` with
+    `with`, which never shadows variables which are defined. Other errors (e.g. syntax errors or values which
+    can't be converted to JSON) fail the whole batch, in which case it is split in half and each half is
+    evaluated separately.
+    """
+    exprs = list(exprs)
+    if not exprs:
+        return []
+    if len(exprs) == 1:
+        try:
+            return [nix_instantiate_eval(exprs[0], retry_show_trace_on_error=False)]
+        except NixEvalError as e:
+            return [e]
+
+    # identifiers also match keywords and words in strings or comments, binding them too is harmless
+    identifiers = sorted(set(
+        identifier
+        for expr in exprs
+        for identifier in NIX_IDENTIFIER_REGEXP.findall(expr)
+    ))
+    undefined_bindings = ' '.join(f'"{identifier}" = __nixgui_undefined;' for identifier in identifiers)
+    # newline before closing paren so a trailing comment can't swallow it
+    batch_expr = (
+        'let __nixgui_undefined = throw "undefined variable"; in\n'
+        f'with {{ {undefined_bindings} }};\n'
+        '[\n' + '\n'.join(
+            f'(builtins.tryEval (builtins.toJSON (\n{expr}\n)))'
+            for expr in exprs
+        ) + '\n]'
+    )
+    try:
+        results = nix_instantiate_eval(batch_expr, strict=True, retry_show_trace_on_error=False)
+    except NixEvalError:
+        split_idx = len(exprs) // 2
+        return nix_instantiate_eval_many(exprs[:split_idx]) + nix_instantiate_eval_many(exprs[split_idx:])
+
+    return [
+        json.loads(result['value']) if result['success']
+        else NixEvalError(f'Failed to evaluate (caught by builtins.tryEval):\n{expr}')
+        for expr, result in zip(exprs, results)
+    ]
+
+
 @contextmanager
 def find_library(name):
     with importlib.resources.path('nixui.nix', 'lib.nix') as f:
@@ -111,6 +248,7 @@ def get_modules_evaluated_import_paths(module_path):
     Get the evaluated `imports` attribute of a module
     returns a list of full-path strings
     """
+    _invalidate_repl_pool_if_modified(module_path)
     with find_library('get_modules_evaluated_import_paths') as fn:
         return list(map(_expand_directory, nix_instantiate_eval(f'{fn} {module_path}', strict=True)))
         
@@ -125,9 +263,13 @@ def get_modules_defined_attrs(module_path):
     - "loc": [ String ]  # the path of the option e.g.: [ "services" "foo" "enable" ]
     - "position" :       # dict containing "column", "line" and "file" (path) of option (see `unsafeGetAttrPos`)
     """
+    _invalidate_repl_pool_if_modified(module_path)
     with find_library('get_modules_defined_attrs') as fn:
         leaves = nix_instantiate_eval(f'{fn} {module_path}', strict=True)
+    return _get_defined_attrs_from_leaves(leaves)
+
 
+def _get_defined_attrs_from_leaves(leaves):
     # if descendant and ancestor have same position (e.g. `boot.initrd` and `boot`) only keep the child
     position_loc_map = {}
     for leaf in leaves:
@@ -153,10 +295,38 @@ def get_modules_defined_attrs(module_path):
 
 @cache.cache(return_copy=True, retain_hash_fn=cache.first_arg_path_hash_fn)
 def get_modules_import_position(module_path):
+    _invalidate_repl_pool_if_modified(module_path)
     with find_library('evalModuleStub') as fn:
         return nix_instantiate_eval(f'builtins.unsafeGetAttrPos "imports" ({fn} {module_path})', strict=True)
 
 
+@cache.cache(return_copy=True, retain_hash_fn=cache.first_arg_import_closure_hash_fn)
+def get_module_graph(module_path):
+    """
+    Evaluate a module and all modules it transitively imports in a single evaluation.
+    Returns a dict, whose first key is the root module, mapping each module path to a dict containing
+    - "imports": [ String ]          # full paths of imported modules, see `get_modules_evaluated_import_paths`
+    - "defined_attrs":               # see `get_modules_defined_attrs`
+    - "imports_position":            # position of the `imports` attribute, see `get_modules_import_position`
+    """
+    # the imports of the previous evaluation may have changed without the root module changing
+    _invalidate_repl_pool_if_modified(module_path, *file_fingerprint.get_dependencies(module_path))
+    with find_library('get_module_graph') as fn:
+        modules = nix_instantiate_eval(f'{fn} {module_path}', strict=True)
+        # record every imported module, if one changed since a worker last read it the graph may be stale
+        if _invalidate_repl_pool_if_modified(*[module['path'] for module in modules]):
+            modules = nix_instantiate_eval(f'{fn} {module_path}', strict=True)
+    file_fingerprint.set_dependencies(module_path, [module['path'] for module in modules])
+    return {
+        module['path']: {
+            'imports': module['imports'],
+            'defined_attrs': _get_defined_attrs_from_leaves(module['defined_attrs']),
+            'imports_position': module['imports_position'],
+        }
+        for module in modules
+    }
+
+
 @cache_by_unique_installed_nixos_nixpkgs_version
 def resolve_nix_search_path(search_path):
     """
@@ -0,0 +1,183 @@
+"""
+Pool of long-lived `nix repl` processes used to evaluate expressions without paying
+for a process spawn and a cold `<nixpkgs>` import on every evaluation.
+
+Each worker keeps its evaluator state between expressions, so files imported by
+one evaluation (`<nixpkgs>`, `lib.nix`, modules) are parsed and evaluated once per worker.
+"""
+import atexit
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from nixui.utils.logger import logger
+
+
+SENTINEL = '__nixgui_eval_done__'
+REPL_PROMPT = 'nix-repl> '
+ANSI_ESCAPE_REGEXP = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+NIX_STRING_ESCAPE_REGEXP = re.compile(r'\\(.)')
+NIX_STRING_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class ReplUnavailable(Exception):
+    """The worker couldn't produce a result, the caller should evaluate another way"""
+
+
+class ReplEvalError(Exception):
+    """The expression failed to evaluate"""
+
+
+def parse_nix_string_literal(literal):
+    """
+    Convert a string printed by `nix repl`, e.g. "{\"foo\":\"\${bar}\"}", back into a python string
+    """
+    if len(literal) < 2 or literal[0] != '"' or literal[-1] != '"':
+        raise ValueError(literal)
+    return NIX_STRING_ESCAPE_REGEXP.sub(
+        lambda m: NIX_STRING_ESCAPES.get(m.group(1), m.group(1)),
+        literal[1:-1]
+    )
+
+
+class ReplWorker:
+    def __init__(self, env, expression_dir):
+        self.env = env
+        self.expression_dir = expression_dir
+        self.process = None
+        self.generation = None
+        self.expression_counter = itertools.count()
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            ['nix', 'repl'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=self.env,
+            encoding='utf-8',
+            bufsize=1,
+        )
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def eval_json(self, expr, generation):
+        """
+        Evaluate expr and return its JSON-decoded value.
+        The expression is written to a file and imported so that incomplete input can't hang the repl. Unlike
+        `nix-instantiate --expr`, relative paths in expr therefore resolve against the pool's temporary directory,
+        not the working directory, callers use absolute paths.
+        Evaluation is always strict, builtins.toJSON forces the whole value as `nix-instantiate --strict` does.
+        """
+        if generation != self.generation:
+            # files read by the evaluator may have changed, drop all evaluator state
+            self.stop()
+            self.generation = generation
+        if not self.is_alive():
+            self._start()
+
+        expression_path = os.path.join(self.expression_dir, f'{id(self)}_{next(self.expression_counter)}.nix')
+        with open(expression_path, 'w') as f:
+            f.write(expr)
+        try:
+            self.process.stdin.write(f'builtins.toJSON (import {expression_path})\n"{SENTINEL}"\n')
+            self.process.stdin.flush()
+            result, error_lines = self._read_response()
+        except (OSError, ValueError) as e:
+            self.stop()
+            raise ReplUnavailable(str(e))
+        finally:
+            os.remove(expression_path)
+
+        if error_lines:
+            raise ReplEvalError('\n'.join(error_lines))
+        if result is None:
+            raise ReplUnavailable(f'no result returned for expression:\n{expr}')
+        return json.loads(parse_nix_string_literal(result))
+
+    def _read_response(self):
+        result = None
+        error_lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise ValueError('nix repl exited unexpectedly')
+            line = ANSI_ESCAPE_REGEXP.sub('', line).strip()
+            while line.startswith(REPL_PROMPT.strip()):
+                line = line[len(REPL_PROMPT.strip()):].strip()
+            if line == f'"{SENTINEL}"':
+                return result, error_lines
+            elif line.startswith('error'):
+                error_lines.append(line)
+            elif error_lines:
+                error_lines.append(line)
+            elif result is None and line.startswith('"'):
+                result = line
+
+
+class ReplPool:
+    """
+    Thread safe pool of `ReplWorker`s
+
+    invalidate() drops the state of every worker before its next evaluation, it must be called
+    when a file which may have been imported by a worker has changed.
+    """
+    def __init__(self, num_workers, env):
+        self.expression_dir = tempfile.mkdtemp(prefix='nixgui_eval_')
+        self.workers = [ReplWorker(env, self.expression_dir) for _ in range(num_workers)]
+        self.idle_workers = queue.Queue()
+        for worker in self.workers:
+            self.idle_workers.put(worker)
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def eval_json(self, expr):
+        worker = self.idle_workers.get()
+        try:
+            return worker.eval_json(expr, self.generation)
+        finally:
+            self.idle_workers.put(worker)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        shutil.rmtree(self.expression_dir, ignore_errors=True)
+
+
+def _num_workers():
+    return int(os.environ.get('NIXGUI_EVAL_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+def create_pool(env):
+    """
+    Create a pool whose workers run with the environment variables `env`
+    Returns None if evaluating via `nix repl` isn't possible or is disabled with NIXGUI_EVAL_WORKERS=0
+    """
+    num_workers = _num_workers()
+    if num_workers <= 0 or shutil.which('nix') is None:
+        return None
+    env = dict(env)
+    env['TERM'] = 'dumb'  # disable colors and line editing
+    env['NIX_CONFIG'] = env.get('NIX_CONFIG', '') + '\nextra-experimental-features = nix-command'
+    pool = ReplPool(num_workers, env)
+    atexit.register(pool.shutdown)
+    logger.info(f'Created nix evaluator pool with {num_workers} workers')
+    return pool
@@ -12,6 +12,15 @@ from nixui.utils.logger import logger
 
 Unresolvable = Singleton('Unresolvable')
 Undefined = Singleton('Undefined')
+Unevaluated = Singleton('Unevaluated')
+
+
+@dataclasses.dataclass(frozen=True)
+class PendingEvaluation:
+    """
+    Placeholder for an expression which must be evaluated by nix, resolved in bulk by `resolve_pending_evaluations`
+    """
+    expression_string: str
 
 
 @dataclasses.dataclass(frozen=True, unsafe_hash=True)
@@ -50,6 +59,9 @@ class OptionDefinition:
     - cwd: Used to get the absolute path from a relative path
     - todo: ???
     """
+    _resolved_obj = Unevaluated  # set by from_expression_nodes, survives pickling unlike the lru_cache
+    _ast_node = None  # set by from_expression_nodes, not pickled as it's a view of the whole module's syntax tree
+
     def __init__(self, context=None, **kwargs):
         assert kwargs != {}
         self.passed = kwargs
@@ -66,6 +78,27 @@ class OptionDefinition:
     def from_ast_node(cls, ast_node, context=None):
         return cls(ast_node=ast_node, context=context)
 
+    @classmethod
+    def from_expression_nodes(cls, ast_nodes, context=None):
+        """
+        Construct a definition for each ast node with their objects resolved up front.
+        All expressions requiring nix evaluation are evaluated in a single round-trip.
+        """
+        definitions = []
+        objs = []
+        for ast_node in ast_nodes:
+            definitions.append(cls.from_expression_string(ast_node.to_string(), context))
+            definitions[-1]._ast_node = ast_node
+            try:
+                objs.append(
+                    expression_node_to_python_object(ast_node, definitions[-1].context, evaluate=PendingEvaluation)
+                )
+            except (ValueError, KeyError):
+                objs.append(Unevaluated)  # resolve lazily, raising the same error when accessed
+        for definition, obj in zip(definitions, resolve_pending_evaluations(objs)):
+            definition._resolved_obj = obj
+        return definitions
+
     @classmethod
     def undefined(cls):
         return cls(expression_string='')
@@ -77,6 +110,8 @@ class OptionDefinition:
             return self.passed['obj']
         elif not self.expression_string:
             return Undefined
+        elif self._resolved_obj != Unevaluated:
+            return self._resolved_obj
         else:
             return expression_node_to_python_object(
                 self._get_ast_node(),
@@ -147,15 +182,36 @@ class OptionDefinition:
     def _get_ast_node(self):
         if 'ast_node' in self.passed:
             return self.passed['ast_node']
+        if self._ast_node is not None:
+            return self._ast_node
         tree = syntax_tree.SyntaxTree.from_string(self.passed['expression_string'])
-        root_node = tree.elem_ids[tree.root_id]
+        root_node = tree.tree
         assert len(root_node.elems) == 1
         return root_node.elems[0]
 
+    def get_known_forms(self):
+        """
+        (expression string, object) forms of the definition which are already known, neither is evaluated or
+        formatted. The expression string is None and the object is Unevaluated if not yet known.
+        """
+        if self.passed.get('expression_string'):
+            expression_string = self.passed['expression_string']
+        elif 'ast_node' in self.passed:
+            expression_string = self.passed['ast_node'].to_string()
+        else:
+            expression_string = None
+        obj = self.passed['obj'] if 'obj' in self.passed else self._resolved_obj
+        return expression_string, obj
+
     @property
     def is_undefined(self):
         return self.expression_string == ''
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_ast_node', None)  # re-parsed from the expression string if needed
+        return state
+
     def __repr__(self):
         return f"OptionDefinition(obj={repr(self.obj)}, expression_string={self.expression_string})"
 
@@ -224,11 +280,57 @@ def get_expression(obj):
 ################################################
 # Syntax tree (from expression string) to object
 ################################################
-def expression_node_to_python_object(value_node, context):
+def evaluate_expression_string(expression_string):
+    try:
+        return nix_eval.nix_instantiate_eval(expression_string)
+    except (nix_eval.NixEvalError, json.decoder.JSONDecodeError) as e:
+        logger.error(f'Error evaluating {expression_string}:\nerror={e}')
+        return Unresolvable
+
+
+def _iter_pending_evaluations(obj):
+    if isinstance(obj, PendingEvaluation):
+        yield obj
+    elif isinstance(obj, list):
+        for elem in obj:
+            yield from _iter_pending_evaluations(elem)
+
+
+def _substitute_pending_evaluations(obj, evaluated):
+    if isinstance(obj, PendingEvaluation):
+        return evaluated[obj]
+    elif isinstance(obj, list):
+        return [_substitute_pending_evaluations(elem, evaluated) for elem in obj]
+    return obj
+
+
+def resolve_pending_evaluations(objs):
+    """
+    Replace each PendingEvaluation within objs with its evaluated value, evaluating all of them in one nix call
+    """
+    pending = list(dict.fromkeys(
+        pending_evaluation
+        for obj in objs
+        for pending_evaluation in _iter_pending_evaluations(obj)
+    ))
+    evaluated = {}
+    results = nix_eval.nix_instantiate_eval_many([p.expression_string for p in pending])
+    for pending_evaluation, result in zip(pending, results):
+        if isinstance(result, nix_eval.NixEvalError):
+            logger.error(f'Error evaluating {pending_evaluation.expression_string}:\nerror={result}')
+            result = Unresolvable
+        evaluated[pending_evaluation] = result
+    return [_substitute_pending_evaluations(obj, evaluated) for obj in objs]
+
+
+def expression_node_to_python_object(value_node, context, evaluate=evaluate_expression_string):
+    """
+    evaluate: called with the expression string of nodes which can't be converted without nix evaluation
+    """
     if value_node.name == 'NODE_LIST':
         # recursively generate list object
         return [
-            expression_node_to_python_object(child_node, context)
+            expression_node_to_python_object(child_node, context, evaluate)
             for child_node in value_node.elems
             if isinstance(child_node, syntax_tree.Node)
         ]
@@ -283,10 +385,6 @@ def expression_node_to_python_object(value_node, context):
         return Unresolvable
 
     else:
-        try:
-            return nix_eval.nix_instantiate_eval(value_node.to_string())
-        except (nix_eval.NixEvalError, json.decoder.JSONDecodeError) as e:
-            logger.error(f'Error evaluating {value_node.to_string()}:\nerror={e}')
-            return Unresolvable
+        return evaluate(value_node.to_string())
 
     raise ValueError(value_node.to_string())
@@ -1,13 +1,13 @@
 import dataclasses
-import functools
-
-from treelib import Tree, Node
-import treelib.exceptions
+import itertools
 
 from nixui.utils.cached_hash_dict import CachedHashDict
 from nixui.options import types
 from nixui.options.attribute import Attribute
+from nixui.options.change_index import ChangeIndex
+from nixui.options.option_trie import OptionTrie, OptionTrieNode
 from nixui.options.option_definition import OptionDefinition, Undefined
+from nixui.options.value_index import ValueIndex
 
 
 @dataclasses.dataclass
@@ -54,13 +54,17 @@ class OptionTree:
     the OptionTree trivial. Note that a value of `None` indicates deletion of the definition.
     """
     def __init__(self, system_option_data, config_options):
-        # load data into Tree with OptionData leaves
-        self.tree = Tree()
-        self.tree.create_node(identifier=Attribute([]), data=OptionData(_type=types.AttrsType()))
+        # load data into trie with OptionData leaves
+        self.tree = OptionTrie(OptionData(_type=types.AttrsType()))
 
         # cache for faster lookup of changed nodes
         self.in_memory_diff = CachedHashDict()
         self.configured_change_cache = {}
+        # searchable text of the definitions in in_memory_diff and configured_change_cache
+        self.value_index = ValueIndex()
+        # ancestors of the attributes returned by get_changes
+        self.in_memory_change_index = ChangeIndex()
+        self.configured_change_index = ChangeIndex()
 
         # insert option data with parent option data inserted first via `sorted`
         sort_key = lambda s: str(s[0]).replace('"<name>"', '')  # todo, clean up this hack
@@ -72,9 +76,9 @@ class OptionTree:
                     **option_data_dict,
                 }
             )
-        for option_path, option_definition in config_options.items():
-            self._upsert_node_data(option_path, {'configured_definition': option_definition})
-            self.configured_change_cache[option_path] = option_definition
+        # attributes which exist regardless of the configuration
+        self.system_attributes = frozenset(attribute for attribute, _ in self.tree.iter_nodes())
+        self._insert_configured_definitions(config_options)
 
     def __hash__(self):
         return hash(self.in_memory_diff)
@@ -89,36 +93,137 @@ class OptionTree:
         insert branch if it doesn't exist
         clone attribute-set-of branch for new upsertions
         """
-        if not self.tree.get_node(option_path):
+        node = self.tree.get_node(option_path)
+        if node is None:
             # Insert Attribute([]), then Attribute('foo'), then Attribute('foo.bar') into tree
-            parent_option_path = Attribute([])
-            for option_path_key in option_path:
-                child_option_path = Attribute.from_insertion(parent_option_path, option_path_key)
-                if child_option_path not in self.tree:
+            node = self.tree.root
+            for depth, option_path_key in enumerate(option_path):
+                child_node = node.children.get(option_path_key)
+                if child_node is None:
                     # copy attribute-set-of spec to new branch if branch doesn't yet exist
-                    if self._is_attribute_set(parent_option_path) and child_option_path.get_end() != '<name>':
-                        new_branch = self._get_attribute_set_template_branch(child_option_path)
-                        self.tree.paste(parent_option_path, new_branch)
+                    parent_type = node.data.get_type()
+                    if isinstance(parent_type, types.AttrsOfType) and option_path_key != '<name>':
+                        child_node = self._get_attribute_set_template_branch(option_path[:depth + 1])
                     else:
-                        self.tree.create_node(
-                            child_option_path,
-                            child_option_path,
-                            parent=parent_option_path,
-                            data=OptionData(
-                                _type=self.get_type(parent_option_path).child_type or Undefined
-                            )
+                        child_node = OptionTrieNode(
+                            option_path_key,
+                            OptionData(_type=parent_type.child_type or Undefined)
                         )
-                parent_option_path = child_option_path
+                    node.add_child(child_node)
+                node = child_node
 
-        option_data = self.tree.get_node(option_path).data or OptionData()
+        option_data = node.data or OptionData()
+        if node.data_is_shared:
+            option_data = option_data.copy()
+            node.data_is_shared = False
         option_data.update(option_data_dict)
-        self.tree.update_node(option_path, data=option_data)
+        node.data = option_data
+
+    def _insert_configured_definitions(self, config_options):
+        for option_path, option_definition in config_options.items():
+            self._upsert_node_data(option_path, {'configured_definition': option_definition})
+            self.configured_change_cache[option_path] = option_definition
+            self.value_index.set_configured_definition(option_path, option_definition)
+            self._update_configured_change_index(option_path)
+
+    def with_configured(self, config_options):
+        """
+        Create an OptionTree with the system options of this tree and config_options as configured definitions.
+        Rather than re-inserting every system option, the system option branches are copied and their OptionData
+        is shared until modified, so the system option tree only needs to be built once per nixpkgs version.
+        Sharing is flagged on the nodes of both trees, so the data is still copied after its node is moved.
+        """
+        def without_definitions(data):
+            if data.configured_definition == data.in_memory_definition == OptionDefinition.undefined():
+                return data
+            return dataclasses.replace(
+                data,
+                configured_definition=OptionDefinition.undefined(),
+                in_memory_definition=OptionDefinition.undefined(),
+            )
 
-    def _is_attribute_set(self, attribute):
-        data = self.tree.get_node(attribute).data
-        if data:
-            return isinstance(data.get_type(), types.AttrsOfType)
-        return False
+        option_tree = OptionTree.__new__(OptionTree)
+        option_tree.tree = OptionTrie(without_definitions(self.tree.root.data))
+        stack = [(self.tree.root, option_tree.tree.root, Attribute([]))]
+        while stack:
+            node, new_node, attribute = stack.pop()
+            # neither tree may modify the shared OptionData in place
+            node.data_is_shared = new_node.data_is_shared = True
+            for key, child in node.children.items():
+                child_attribute = Attribute.from_insertion(attribute, key)
+                if child_attribute in self.system_attributes:
+                    new_child = OptionTrieNode(key, without_definitions(child.data))
+                    new_node.add_child(new_child)
+                    stack.append((child, new_child, child_attribute))
+        option_tree.in_memory_diff = CachedHashDict()
+        option_tree.configured_change_cache = {}
+        option_tree.value_index = ValueIndex()
+        option_tree.in_memory_change_index = ChangeIndex()
+        option_tree.configured_change_index = ChangeIndex()
+        option_tree.system_attributes = self.system_attributes
+
+        option_tree._insert_configured_definitions(config_options)
+        return option_tree
+
+    def update_configured_definitions(self, config_options):
+        """
+        Replace the configured definitions with config_options, e.g. after a module was modified.
+        Only attributes whose configured definition changed are updated, branches which only existed
+        for configured definitions which no longer exist are removed.
+        """
+        old_config_options = dict(self.configured_change_cache)
+        self.configured_change_cache.clear()
+        self.configured_change_cache.update(config_options)
+        for option_path, option_definition in config_options.items():
+            if old_config_options.get(option_path) != option_definition:
+                self._upsert_node_data(option_path, {'configured_definition': option_definition})
+                self.value_index.set_configured_definition(option_path, option_definition)
+                self._update_configured_change_index(option_path)
+                self._reconcile_in_memory_diff(option_path)
+        for option_path in old_config_options.keys() - config_options.keys():
+            self.value_index.set_configured_definition(option_path, None)
+            self.configured_change_index.set_changed(option_path, False)
+        removed_option_paths = [
+            option_path for option_path in old_config_options.keys() - config_options.keys()
+            if option_path in self.tree
+        ]
+        for option_path in removed_option_paths:
+            self._upsert_node_data(option_path, {'configured_definition': OptionDefinition.undefined()})
+            self._reconcile_in_memory_diff(option_path)
+        for option_path in removed_option_paths:
+            self._remove_unused_branch(option_path)
+
+    def _reconcile_in_memory_diff(self, option_path):
+        # an in memory definition identical to the new configured definition is no longer a change
+        if option_path in self.in_memory_diff:
+            if self.in_memory_diff[option_path] == self.get_configured_definition(option_path):
+                self._del_in_memory_diff(option_path)
+            else:
+                self._update_in_memory_change_index(option_path)
+
+    def _remove_unused_branch(self, option_path):
+        """
+        Remove the highest ancestor of option_path which isn't a system attribute,
+        unless an attribute within it is defined in the configuration or in memory
+        """
+        branch_root = self._get_non_system_branch_root(option_path)
+        if branch_root is None or branch_root not in self.tree:
+            return
+        for attribute, node in self.tree.iter_nodes(branch_root):
+            if attribute in self.in_memory_diff:
+                return
+            if node.data.configured_definition != OptionDefinition.undefined():
+                return
+        self.tree.remove_subtree(branch_root)
+
+    def _get_non_system_branch_root(self, option_path):
+        """
+        The highest ancestor of option_path (or option_path itself) which isn't a system attribute
+        """
+        return next(
+            (option_path[:i] for i in range(1, len(option_path) + 1) if option_path[:i] not in self.system_attributes),
+            None
+        )
 
     def _get_attribute_set_template_branch(self, attribute):
         """
@@ -129,23 +234,16 @@ class OptionTree:
         data = self.tree.get_node(parent_attribute).data  # get spec of parent attribute
         if data.get_type() == types.AttrsOfType(types.SubmoduleType()):
             submodule_spec_attribute = Attribute.from_insertion(parent_attribute, '<name>')
-            tree = Tree(self.tree.subtree(submodule_spec_attribute), deep=True)
             # <name> -> actual attribute
-            for node in tree.all_nodes():
-                attr = node.identifier
-                loc = list(attr.loc)
-                loc[loc.index('<name>')] = attribute.loc[-1]
-                new_attr = Attribute(loc)
-                tree.update_node(attr, identifier=new_attr, tag=new_attr)
-            return tree
+            return self.tree.get_node(submodule_spec_attribute).copy(
+                copy_data=lambda data: data.copy() if data else data,
+                key=attribute.get_end()
+            )
         else:
             option_data_spec = data.copy()
             # TODO https://github.com/nix-gui/nix-gui/issues/65
             option_data_spec._type = data.get_type().child_type
-            tree = Tree()
-            node = Node(attribute, attribute, data=option_data_spec)
-            tree.add_node(node)
-            return tree
+            return OptionTrieNode(attribute.get_end(), option_data_spec)
 
     def _get_data(self, attribute):
         result = self.tree.get_node(attribute).data
@@ -178,18 +276,52 @@ class OptionTree:
                 result[attr] = new_definition
         return result
 
-    @functools.lru_cache()
     def get_change_set_with_ancestors(self, get_configured_changes=False):
-        attributes_with_mutated_descendents = set()
-        for attr, new_definition in self.get_changes(get_configured_changes).items():
-            for i in range(len(attr)):
-                attributes_with_mutated_descendents.add(attr[:i])
-        return attributes_with_mutated_descendents
+        """
+        Set-like view of the attributes which are strict ancestors of an attribute in get_changes()
+        """
+        if get_configured_changes:
+            return self.configured_change_index.ancestor_counts.keys()
+        else:
+            return self.in_memory_change_index.ancestor_counts.keys()
+
+    def _update_in_memory_change_index(self, attribute):
+        # mirrors the comparison in get_changes, an attribute which was moved or removed from the tree is a change
+        if attribute not in self.in_memory_diff:
+            is_changed = False
+        elif attribute not in self.tree:
+            is_changed = True
+        else:
+            is_changed = self.in_memory_diff[attribute] != self.get_definition(
+                attribute, include_in_memory_definition=False
+            )
+        self.in_memory_change_index.set_changed(attribute, is_changed)
+
+    def _update_configured_change_index(self, attribute):
+        self.configured_change_index.set_changed(
+            attribute,
+            attribute in self.configured_change_cache and
+            self.configured_change_cache[attribute] != self.get_system_default_definition(attribute)
+        )
 
     def iter_attribute_data(self):
-        for node in self.tree.all_nodes():
-            if '<name>' not in node.tag:
-                yield (node.identifier, node.data)
+        for attribute, node in self.tree.iter_nodes():
+            if '<name>' not in attribute:
+                yield (attribute, node.data)
+
+    def iter_non_system_attribute_data(self):
+        """
+        iter_attribute_data() restricted to the attributes which aren't system attributes, i.e. those in branches
+        created for configured or in memory definitions. Only visits those branches.
+        """
+        branch_roots = set()
+        for attribute in itertools.chain(self.configured_change_cache, self.in_memory_diff):
+            branch_root = self._get_non_system_branch_root(attribute)
+            if branch_root is not None and branch_root not in branch_roots and branch_root in self.tree:
+                branch_roots.add(branch_root)
+                for attr, node in self.tree.iter_nodes(branch_root):
+                    if '<name>' not in attr:
+                        yield (attr, node.data)
 
     def iter_attributes(self):
         for attr, _ in self.iter_attribute_data():
@@ -199,50 +331,70 @@ class OptionTree:
         # update tree
         self._upsert_node_data(attribute, {})
         # update in_memory_diff
-        self.in_memory_diff[attribute] = OptionDefinition.undefined()
+        self._set_in_memory_diff(attribute, OptionDefinition.undefined())
+
+    def _set_in_memory_diff(self, attribute, option_definition):
+        self.in_memory_diff[attribute] = option_definition
+        self.value_index.set_in_memory_definition(attribute, option_definition)
+        self._update_in_memory_change_index(attribute)
+
+    def _del_in_memory_diff(self, attribute):
+        del self.in_memory_diff[attribute]
+        self.value_index.set_in_memory_definition(attribute, None)
+        self.in_memory_change_index.set_changed(attribute, False)
 
     def rename_attribute(self, old_attribute, new_attribute):
-        # update in_memory_diff
-        if old_attribute in self.in_memory_diff:
-            self.in_memory_diff[new_attribute] = self.in_memory_diff[old_attribute]
+        changed_nodes = [
+            (old_node_attribute, node)
+            for old_node_attribute, node in self.tree.iter_nodes(old_attribute)
+            if old_node_attribute in self.in_memory_diff
+        ]
+        # update tree, before in_memory_diff so the change index sees the renamed nodes
+        self.tree.move(old_attribute, new_attribute)
+        # update in_memory_diff of the attribute and its descendents
+        for old_node_attribute, node in changed_nodes:
+            new_node_attribute = Attribute(new_attribute.loc + old_node_attribute.loc[len(old_attribute):])
+            self._set_in_memory_diff(new_node_attribute, self.in_memory_diff[old_node_attribute])
             # if its not defined in configuration, deletion results in no diff recorded
-            if self.get_configured_definition(old_attribute) == OptionDefinition.undefined():
-                del self.in_memory_diff[old_attribute]
+            if node.data.configured_definition == OptionDefinition.undefined():
+                self._del_in_memory_diff(old_node_attribute)
             # if defined in configuration, record None to indicate deletion
             else:
-                self.in_memory_diff[old_attribute] = None
-        # update tree
-        self.tree.update_node(old_attribute, identifier=new_attribute, tag=new_attribute)
-        for node in self.tree.children(new_attribute):
-            old_child_attribute = node.identifier
-            new_child_attribute = Attribute.from_insertion(new_attribute, old_child_attribute.get_end())
-            self.rename_attribute(old_child_attribute, new_child_attribute)
+                self._set_in_memory_diff(old_node_attribute, None)
 
     def remove_attribute(self, attribute):
         # update in memory change cache
         old_in_memory_definitions = {}
-        for node in self.tree.subtree(attribute).all_nodes():
-            if node.identifier in self.in_memory_diff:
-                old_in_memory_definitions[node.identifier] = self.in_memory_diff[node.identifier]
+        for node_attribute, _ in self.tree.iter_nodes(attribute):
+            if node_attribute in self.in_memory_diff:
+                old_in_memory_definitions[node_attribute] = self.in_memory_diff[node_attribute]
             # if its not defined in configuration, deletion results in no diff recorded
             if self.get_configured_definition(attribute) == OptionDefinition.undefined():
-                del self.in_memory_diff[attribute]
+                self._del_in_memory_diff(attribute)
             # if defined in configuration, record None to indicate deletion
             else:
-                self.in_memory_diff[attribute] = None
+                self._set_in_memory_diff(attribute, None)
         # update tree
         deleted_subtree = self.tree.remove_subtree(attribute)
         return old_in_memory_definitions, deleted_subtree
 
+    def restore_attribute(self, attribute, deleted_subtree, old_in_memory_definitions):
+        """
+        Revert remove_attribute given its return values
+        """
+        self.tree.paste(attribute.get_set(), deleted_subtree)
+        for node_attribute, option_definition in old_in_memory_definitions.items():
+            self._set_in_memory_diff(node_attribute, option_definition)
+
     def set_definition(self, option_path, option_definition):
         # update tree
         self._upsert_node_data(option_path, {'in_memory_definition': option_definition})
         # update in memory change cache
-        if option_definition == self.tree.get_node(option_path).data.configured_definition:
+        if option_definition == self.get_configured_definition(option_path):
             if option_path in self.in_memory_diff:
-                del self.in_memory_diff[option_path]
+                self._del_in_memory_diff(option_path)
         else:
-            self.in_memory_diff[option_path] = option_definition
+            self._set_in_memory_diff(option_path, option_definition)
 
     def get_definition(self, attribute, include_in_memory_definition=True, include_configured_change=True):
         if include_in_memory_definition:
@@ -300,20 +452,28 @@ class OptionTree:
                 children = self.tree.leaves(attribute)
             else:
                 raise ValueError()
-        except treelib.exceptions.NodeIDAbsentError:
+        except KeyError:
             raise ValueError()
         return {
-            node.tag: node.data
-            for node in children
-            if '"<name>"' not in node.tag
+            child_attribute: node.data
+            for child_attribute, node in children
+            if '"<name>"' not in child_attribute
         }
 
-    @functools.lru_cache(100000)  # this breaks when nixos has 100,000 attributes
+    def _get_node(self, attribute):
+        node = self.tree.get_node(attribute)
+        if node is None:
+            raise ValueError(attribute)
+        return node
+
     def count_leaves(self, attribute):
-        child_ids = self.tree.is_branch(attribute)
-        if child_ids:
-            return sum(map(self.count_leaves, child_ids))
-        return 1
+        return self._get_node(attribute).leaf_count
+
+    def count_children(self, attribute):
+        """
+        Number of direct children of attribute, equal to len(self.children(attribute))
+        """
+        return len(self._get_node(attribute).children)
 
     def get_next_branching_option(self, attribute):
         while len(self.children(attribute)) == 1:
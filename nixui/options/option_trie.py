@@ -0,0 +1,135 @@
+import sys
+
+from nixui.options.attribute import Attribute
+
+
+class OptionTrieNode:
+    """
+    Node of an OptionTrie. A node doesn't store its Attribute, only its key within its parent.
+
+    leaf_count is the number of descendents without children, or 1 if the node has no children. It's updated
+    for the node and its ancestors whenever a child is added or removed, in O(depth).
+
+    data_is_shared is set if data is also referenced by a node of another trie, the data must then be copied
+    before it's modified in place. It stays with the node when the node is moved.
+    """
+    __slots__ = ('key', 'parent', 'children', 'data', 'leaf_count', 'data_is_shared')
+
+    def __init__(self, key, data=None):
+        self.key = sys.intern(key) if key is not None else None
+        self.parent = None
+        self.children = {}  # key -> OptionTrieNode, in insertion order
+        self.data = data
+        self.leaf_count = 1
+        self.data_is_shared = False
+
+    def iter_nodes(self, attribute):
+        """
+        Iterate over (attribute, node) for this node, labelled attribute, and its descendents, depth first
+        """
+        stack = [(attribute, self)]
+        while stack:
+            attribute, node = stack.pop()
+            yield attribute, node
+            stack.extend(
+                (Attribute.from_insertion(attribute, key), child)
+                for key, child in reversed(node.children.items())
+            )
+
+    def copy(self, copy_data, key=None):
+        """
+        Copy the branch rooted at this node, the data of each node is replaced with copy_data(data)
+        """
+        new_node = OptionTrieNode(self.key if key is None else key, copy_data(self.data))
+        for child_key, child in self.children.items():
+            new_node.add_child(child.copy(copy_data))
+        return new_node
+
+    def add_child(self, child):
+        if child.key in self.children:
+            self.remove_child(child.key)
+        delta = child.leaf_count - (0 if self.children else 1)
+        child.parent = self
+        self.children[child.key] = child
+        self._update_leaf_counts(delta)
+
+    def remove_child(self, key):
+        child = self.children.pop(key)
+        child.parent = None
+        self._update_leaf_counts((0 if self.children else 1) - child.leaf_count)
+        return child
+
+    def _update_leaf_counts(self, delta):
+        node = self
+        while node is not None and delta:
+            node.leaf_count += delta
+            node = node.parent
+
+
+class OptionTrie:
+    """
+    Trie of OptionTrieNodes keyed by the segments of an Attribute.
+
+    Replaces a tree keyed by full Attributes: lookups only hash the (interned) segment strings and
+    nodes don't hold a copy of their path.
+    """
+    def __init__(self, root_data=None):
+        self.root = OptionTrieNode(None, root_data)
+
+    def get_node(self, attribute):
+        node = self.root
+        for key in attribute.loc:
+            node = node.children.get(key)
+            if node is None:
+                return None
+        return node
+
+    def _get_existing_node(self, attribute):
+        node = self.get_node(attribute)
+        if node is None:
+            raise KeyError(attribute)
+        return node
+
+    def __contains__(self, attribute):
+        return self.get_node(attribute) is not None
+
+    def paste(self, parent_attribute, node):
+        """
+        Insert the branch rooted at node as a child of parent_attribute
+        """
+        self._get_existing_node(parent_attribute).add_child(node)
+
+    def remove_subtree(self, attribute):
+        """
+        Detach and return the branch rooted at attribute
+        """
+        node = self._get_existing_node(attribute)
+        return node.parent.remove_child(node.key)
+
+    def move(self, old_attribute, new_attribute):
+        node = self.remove_subtree(old_attribute)
+        node.key = sys.intern(new_attribute.get_end())
+        self.paste(new_attribute.get_set(), node)
+
+    def children(self, attribute):
+        """
+        List of (child attribute, child node) of attribute
+        """
+        node = self._get_existing_node(attribute)
+        return [
+            (Attribute.from_insertion(attribute, key), child)
+            for key, child in node.children.items()
+        ]
+
+    def leaves(self, attribute):
+        """
+        List of (attribute, node) of the descendents of attribute without children, or attribute if it has none
+        """
+        return [
+            (attr, node)
+            for attr, node in self._get_existing_node(attribute).iter_nodes(attribute)
+            if not node.children
+        ]
+
+    def iter_nodes(self, attribute=Attribute([])):
+        return self._get_existing_node(attribute).iter_nodes(attribute)
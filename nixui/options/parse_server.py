@@ -0,0 +1,78 @@
+"""
+Client of a long-lived `nix_dump_syntax_tree_json --server` process used to parse expressions without
+paying for a process spawn and a temporary file on every parse, e.g. on each keystroke in an expression field.
+"""
+import atexit
+import json
+import shutil
+import subprocess
+import threading
+
+from nixui.utils.logger import logger
+
+
+class ParseServerUnavailable(Exception):
+    """The server couldn't produce a result, the caller should parse another way"""
+
+
+class ParseServer:
+    """
+    Thread safe, requests are sent one at a time to a single process which is started on first use
+    """
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            ['nix_dump_syntax_tree_json', '--server'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def parse(self, source):
+        """
+        Parse the nix expression source
+        Returns (parse errors, syntax tree dict)
+        """
+        data = source.encode('utf-8')
+        with self.lock:
+            if not self.is_alive():
+                self._start()
+            try:
+                self.process.stdin.write(f'{len(data)}\n'.encode() + data)
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+                if not line:
+                    raise ValueError('nix_dump_syntax_tree_json exited unexpectedly')
+                result = json.loads(line)
+            except (OSError, ValueError) as e:
+                self.stop()
+                raise ParseServerUnavailable(str(e))
+        return result['errors'], result['tree']
+
+    def shutdown(self):
+        with self.lock:
+            self.stop()
+
+
+def create_server():
+    """
+    Create a server, returns None if nix_dump_syntax_tree_json isn't available
+    """
+    if shutil.which('nix_dump_syntax_tree_json') is None:
+        return None
+    server = ParseServer()
+    atexit.register(server.shutdown)
+    logger.info('Created nix syntax tree parse server')
+    return server
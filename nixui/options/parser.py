@@ -1,8 +1,12 @@
 # TODO: reorganize this isto parser/parser.py, parser/apply_changes.py, and move syntax_tree.py parser/syntax_tree.py
+import collections
+import concurrent.futures
 import datetime as dt
+import os
+import threading
 
 from nixui.utils.logger import logger
-from nixui.utils import cache
+from nixui.utils import cache, file_fingerprint
 from nixui.options import syntax_tree, nix_eval
 from nixui.options.attribute import Attribute
 from nixui.options.option_definition import OptionDefinition
@@ -244,30 +248,148 @@ def apply_indentation(string, num_spaces):
     ])
 
 
-@cache.cache(return_copy=True, retain_hash_fn=cache.first_arg_path_hash_fn)
+@cache.cache(return_copy=True, retain_hash_fn=cache.first_arg_import_closure_hash_fn)
 def get_all_option_values(module_path, allow_errors=True):
     logger.info(f'Retrieving option values for module "{module_path}"')
-    # get option_expr_map for module_path
-    option_expr_map = {}
-    tree = syntax_tree.SyntaxTree(module_path)
-    for attr_loc, value_node in get_key_value_nodes(tree).items():
-        option_expr_map[attr_loc] = OptionDefinition.from_expression_string(
-            value_node.to_string()
-        )
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        try:
+            module_graph = nix_eval.get_module_graph(module_path)
+        except nix_eval.NixEvalError as e:
+            if not allow_errors:
+                raise e
+            logger.error(f'Failed to evaluate module graph, evaluating modules individually:\n{e}')
+            module_graph = discover_module_graph(module_path, executor)
+        file_fingerprint.set_dependencies(module_path, module_graph)
+        return get_merged_option_values(module_graph, executor, allow_errors)
+
+
+def get_all_option_values_by_module(module_path, allow_errors=True):
+    """
+    Slower alternative to get_all_option_values which evaluates each module separately.
+    Used if the module graph can't be evaluated as a whole.
+    """
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        module_graph = discover_module_graph(module_path, executor)
+        return get_merged_option_values(module_graph, executor, allow_errors)
 
-    # for each import, recurse
-    for import_path in nix_eval.get_modules_evaluated_import_paths(module_path):
+
+def discover_module_graph(module_path, executor):
+    """
+    Construct a module graph of the same form as nix_eval.get_module_graph, evaluating the imports
+    of each module separately. The modules of each breadth-first level are evaluated concurrently.
+    Modules whose imports can't be evaluated have an "imports_error" which is raised when merging.
+    """
+    def get_import_paths(path):
         try:
-            # TODO: this isn't the correct way to merge attributes between module imports, it needs to be implemented correctly
-            option_expr_map.update(get_all_option_values(import_path))
+            return nix_eval.get_modules_evaluated_import_paths(path), None
         except (nix_eval.NixEvalError, FileNotFoundError) as e:
-            if allow_errors:
-                logger.error(e)  # TODO: ensure all legal import elements are resolved and don't `continue`
-                continue
-            else:
-                raise e
+            return [], e
+
+    module_graph = {}
+    frontier = [module_path]
+    while frontier:
+        next_frontier = []
+        for path, (import_paths, error) in zip(frontier, executor.map(get_import_paths, frontier)):
+            module_graph[path] = {
+                'imports': import_paths,
+                'defined_attrs': None,
+                'imports_error': error,
+            }
+            next_frontier += import_paths
+        frontier = [
+            path for path in dict.fromkeys(next_frontier)
+            if path not in module_graph
+        ]
+    return module_graph
+
+
+def get_merged_option_values(module_graph, executor, allow_errors=True):
+    """
+    Get the option definitions of the root (first) module of module_graph merged with those of its imports.
+    Modules are parsed concurrently, but merged in depth-first import order so later imports take precedence.
+    """
+    # parse every module with one process rather than one per module
+    syntax_tree.preload_syntax_trees(list(module_graph))
+    # the cached values of a module are invalidated by changes to any module of its import closure
+    for path in module_graph:
+        file_fingerprint.set_dependencies(path, get_import_closure(module_graph, path))
+    module_option_values = {
+        path: executor.submit(get_module_option_values, path, module['defined_attrs'])
+        for path, module in module_graph.items()
+    }
+
+    def merge(path, ancestors, allow_errors):
+        option_expr_map = dict(module_option_values[path].result())
+        if module_graph[path].get('imports_error'):
+            raise module_graph[path]['imports_error']
+        for import_path in module_graph[path]['imports']:
+            if import_path in ancestors:
+                continue  # import cycle
+            try:
+                # TODO: this isn't the correct way to merge attributes between module imports, it needs to be implemented correctly
+                option_expr_map.update(merge(import_path, ancestors | {import_path}, True))
+            except (nix_eval.NixEvalError, FileNotFoundError) as e:
+                if allow_errors:
+                    logger.error(e)  # TODO: ensure all legal import elements are resolved and don't `continue`
+                    continue
+                else:
+                    raise e
+        return option_expr_map
+
+    root_module_path = next(iter(module_graph))
+    return merge(root_module_path, {root_module_path}, allow_errors)
+
+
+def get_import_closure(module_graph, module_path):
+    """
+    Paths of the modules of module_graph which module_path transitively imports, including itself
+    """
+    closure = {module_path}
+    stack = [module_path]
+    while stack:
+        for import_path in module_graph[stack.pop()]['imports']:
+            if import_path not in closure and import_path in module_graph:
+                closure.add(import_path)
+                stack.append(import_path)
+    return closure
 
-    return option_expr_map
+
+MODULE_OPTION_VALUES_CACHE_SIZE = 256
+
+# module path -> (import closure fingerprint, defined attrs, option values), least recently used first
+# modules are only re-parsed if a module of their import closure or their defined attrs changed
+_module_option_values_cache = collections.OrderedDict()
+_module_option_values_cache_lock = threading.Lock()  # modules are parsed concurrently
+
+
+def get_module_option_values(module_path, defined_attrs=None):
+    """
+    Get the option definitions of a single module, ignoring its imports
+    """
+    fingerprint = file_fingerprint.FileSetFingerprint(module_path)
+    with _module_option_values_cache_lock:
+        cached = _module_option_values_cache.get(module_path)
+        if cached is not None:
+            _module_option_values_cache.move_to_end(module_path)
+    if cached is not None and cached[0] == fingerprint and cached[1] == defined_attrs:
+        return dict(cached[2])
+
+    tree = syntax_tree.SyntaxTree(module_path)
+    key_value_nodes = get_key_value_nodes(tree, defined_attrs)
+    # resolve all definitions in the module with one evaluation
+    option_values = dict(zip(
+        key_value_nodes,
+        OptionDefinition.from_expression_nodes(
+            key_value_nodes.values(),
+            context={'module_dir': os.path.dirname(module_path)}
+        )
+    ))
+    with _module_option_values_cache_lock:
+        _module_option_values_cache[module_path] = (fingerprint, defined_attrs, option_values)
+        _module_option_values_cache.move_to_end(module_path)
+        if len(_module_option_values_cache) > MODULE_OPTION_VALUES_CACHE_SIZE:
+            _module_option_values_cache.popitem(last=False)
+    return dict(option_values)
 
 
 def get_imports_node(tree):
@@ -319,9 +441,14 @@ def recursively_get_node_attr_set_data(parent_attribute, node):
             yield from recursively_get_node_list_data(full_attribute_path, value_node)
 
 
-def get_key_value_nodes(tree):
+def get_key_value_nodes(tree, defined_attrs=None):
+    """
+    defined_attrs: result of nix_eval.get_modules_defined_attrs for the trees module, evaluated if not passed
+    """
+    if defined_attrs is None:
+        defined_attrs = nix_eval.get_modules_defined_attrs(tree.module_path)
     mapping = {}
-    for attr, attr_data in nix_eval.get_modules_defined_attrs(tree.module_path).items():
+    for attr, attr_data in defined_attrs.items():
         definition_node = tree.get_node_at_line_column(
             attr_data['position']['line'],
             attr_data['position']['column'],
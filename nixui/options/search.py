@@ -0,0 +1,376 @@
+"""
+Search of option paths, types and descriptions
+
+The index of the system options is built once per nixpkgs version and persisted. Attributes which only exist
+in the configuration (e.g. `users.users.alice`) are few and indexed when searched.
+"""
+import array
+import bisect
+import collections
+import csv
+import re
+
+from nixui.options import api, nix_eval
+from nixui.options.option_definition import Undefined
+
+
+# match operations in order of priority
+MATCH_OPERATIONS = (
+    'Attribute Path', 'Type', 'Description',
+    'In Memory Value', 'Configured Value', 'System Default Value',
+)
+# fields indexed by SearchIndex, in the same order as their match operation
+INDEXED_FIELDS = MATCH_OPERATIONS[:3]
+# definitions searched via OptionTree.value_index. System default definitions aren't loaded, so aren't searched.
+VALUE_FIELDS = MATCH_OPERATIONS[3:5]
+SEARCHED_FIELDS = INDEXED_FIELDS + VALUE_FIELDS
+
+WORD_REGEXP = re.compile(r'\w+')
+
+# indexes of the fields searched by fuzzy search, path and description, and their match operations
+FUZZY_FIELD_INDEXES = (0, 2)
+FUZZY_MATCH_OPERATIONS = ('Attribute Path (Fuzzy)', 'Description (Fuzzy)')
+# number of words found via trigrams whose edit distance is calculated, per word searched
+MAX_FUZZY_CANDIDATE_WORDS = 256
+
+
+def get_trigrams(word):
+    return set(word[i:i + 3] for i in range(len(word) - 2))
+
+
+def get_max_edit_distance(word):
+    """
+    Typos tolerated by fuzzy search: none for words shorter than 4 characters, then 1, then 2 from 8 characters
+    """
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def substring_edit_distance(pattern, text, max_distance):
+    """
+    Least Levenshtein distance between pattern and any substring of text, or None if it's above max_distance
+    """
+    previous_row = [0] * (len(text) + 1)  # a match may start anywhere in text
+    for i, pattern_char in enumerate(pattern, 1):
+        row = [i]
+        for j, text_char in enumerate(text, 1):
+            row.append(min(
+                previous_row[j] + 1,
+                row[j - 1] + 1,
+                previous_row[j - 1] + (pattern_char != text_char),
+            ))
+        if min(row) > max_distance:
+            return None
+        previous_row = row
+    distance = min(previous_row)  # a match may end anywhere in text
+    return distance if distance <= max_distance else None
+
+
+def tokenize_search_str(search_str):
+    """
+    Lowercase search tokens. Double quotes group words into one token, e.g. `"foo bar" baz` has two tokens.
+    """
+    return set(
+        token.lower() for token in
+        next(csv.reader([search_str], delimiter=' ', quotechar='"'), [])
+        if token
+    )
+
+
+class SearchIndex:
+    """
+    Inverted index of the lowercased attribute path, type string and description of options.
+
+    Maps each word (see WORD_REGEXP) of each field to the documents containing it. A token matches a field
+    if it's a substring of the field. A token without non-word characters can only be a substring of a field
+    if it's a substring of one of the field's words, so its matches are found by searching the vocabulary
+    rather than the documents. Tokens which match too many words, and tokens with non-word characters, are
+    checked against the precomputed lowercased fields of the candidates.
+    """
+    def __init__(self, attribute_data):
+        self.attributes = []
+        self.field_texts = tuple([] for _ in INDEXED_FIELDS)  # field -> document id -> lowercased text
+        self.postings = tuple({} for _ in INDEXED_FIELDS)  # field -> word -> array of document ids
+        for attribute, data in attribute_data:
+            self._add(attribute, data)
+        self.document_ids = {attribute: document_id for document_id, attribute in enumerate(self.attributes)}
+
+        # all words separated by newlines, searched with str.find, and the offset of each word within it
+        self.vocabulary = sorted(set().union(*self.postings))
+        self.vocabulary_str = '\n'.join(self.vocabulary)
+        self.vocabulary_offsets = array.array('I', [0])
+        for word in self.vocabulary:
+            self.vocabulary_offsets.append(self.vocabulary_offsets[-1] + len(word) + 1)
+
+        # trigram -> array of indices of the path and description words containing it, for fuzzy search
+        self.trigram_postings = {}
+        fuzzy_words = set().union(*(self.postings[i] for i in FUZZY_FIELD_INDEXES))
+        for idx, word in enumerate(self.vocabulary):
+            if word in fuzzy_words:
+                for trigram in get_trigrams(word):
+                    self.trigram_postings.setdefault(trigram, array.array('I')).append(idx)
+
+    def _add(self, attribute, data):
+        document_id = len(self.attributes)
+        self.attributes.append(attribute)
+        texts = (
+            str(attribute).lower(),
+            data._type_string.lower() if data is not None and data._type_string != Undefined else '',
+            data.description.lower() if data is not None and data.description != Undefined else '',
+        )
+        for field_texts, postings, text in zip(self.field_texts, self.postings, texts):
+            field_texts.append(text)
+            for word in set(WORD_REGEXP.findall(text)):
+                postings.setdefault(word, array.array('I')).append(document_id)
+
+    def _get_matched_words(self, word, limit):
+        """
+        Words in the vocabulary which word is a substring of, or None if there are more than limit
+        """
+        matched_words = []
+        position = self.vocabulary_str.find(word)
+        while position != -1:
+            idx = bisect.bisect_right(self.vocabulary_offsets, position) - 1
+            matched_words.append(self.vocabulary[idx])
+            if len(matched_words) > limit:
+                return None
+            position = self.vocabulary_str.find(word, self.vocabulary_offsets[idx + 1])
+        return matched_words
+
+    def _get_candidate_matches(self, token, candidates):
+        return [
+            set(document_id for document_id in candidates if token in field_texts[document_id])
+            for field_texts in self.field_texts
+        ]
+
+    def get_token_matches(self, token):
+        """
+        Set of document ids per field where token is a substring of the field
+        """
+        num_documents = len(self.attributes)
+        if WORD_REGEXP.fullmatch(token):
+            matched_words = self._get_matched_words(token, limit=num_documents // 8)
+            if matched_words is not None:
+                field_postings = [
+                    [postings[w] for w in matched_words if w in postings]
+                    for postings in self.postings
+                ]
+                if sum(len(p) for postings in field_postings for p in postings) < num_documents:
+                    return [set().union(*postings) for postings in field_postings]
+        # too many matched words or postings, the token is likely in most fields
+        return [
+            set(document_id for document_id, text in enumerate(field_texts) if token in text)
+            for field_texts in self.field_texts
+        ]
+
+    def search(self, tokens, candidates=None, value_matches=None):
+        """
+        Get a list of (document id, score) of the documents matched by all tokens, where score is
+        the number of tokens matched by each of SEARCHED_FIELDS. If candidates is passed, only its document ids
+        are searched.
+
+        value_matches: maps each token to the sets of attributes whose definitions match it, per VALUE_FIELDS
+        """
+        if not tokens:
+            document_ids = range(len(self.attributes)) if candidates is None else candidates
+            return [(document_id, (0,) * len(SEARCHED_FIELDS)) for document_id in document_ids]
+
+        # the longest tokens are usually the most selective, the remaining tokens only need to be checked
+        # against the documents matched so far once there are few of them
+        field_counts = [collections.Counter() for _ in SEARCHED_FIELDS]
+        for token in sorted(tokens, key=len, reverse=True):
+            if candidates is not None and len(candidates) < len(self.attributes) // 16:
+                field_matches = self._get_candidate_matches(token, candidates)
+            else:
+                field_matches = self.get_token_matches(token)
+            for attributes in (value_matches or {}).get(token, [set()] * len(VALUE_FIELDS)):
+                field_matches.append(set(
+                    self.document_ids[attribute] for attribute in attributes if attribute in self.document_ids
+                ))
+            for counts, matches in zip(field_counts, field_matches):
+                counts.update(matches)
+            matched_document_ids = set().union(*field_matches)
+            candidates = matched_document_ids if candidates is None else candidates & matched_document_ids
+            if not candidates:
+                return []
+
+        field_counts = [counts.get for counts in field_counts]
+        return [
+            (document_id, tuple(counts(document_id, 0) for counts in field_counts))
+            for document_id in candidates
+        ]
+
+    def _get_fuzzy_matched_words(self, word):
+        """
+        Dict mapping path and description words within get_max_edit_distance(word) of containing word to the
+        edit distance
+        """
+        max_distance = get_max_edit_distance(word)
+        if max_distance == 0:
+            matched_words = self._get_matched_words(word, limit=MAX_FUZZY_CANDIDATE_WORDS) or []
+            return {w: 0 for w in matched_words}
+
+        # q-gram lemma: each edit changes at most 3 trigrams of word
+        trigrams = get_trigrams(word)
+        min_shared_trigrams = max(1, len(trigrams) - 3 * max_distance)
+        shared_trigram_counts = collections.Counter()
+        for trigram in trigrams:
+            shared_trigram_counts.update(self.trigram_postings.get(trigram, ()))
+
+        matched_words = {}
+        for idx, count in shared_trigram_counts.most_common(MAX_FUZZY_CANDIDATE_WORDS):
+            if count < min_shared_trigrams:
+                break
+            candidate_word = self.vocabulary[idx]
+            distance = substring_edit_distance(word, candidate_word, max_distance)
+            if distance is not None:
+                matched_words[candidate_word] = distance
+        return matched_words
+
+    def fuzzy_search(self, words):
+        """
+        Get a list of (document id, edit distance, number of words matched by each fuzzy field) of documents
+        where each word is within a few edits of a substring of a path or description word.
+        """
+        if not words:
+            return []
+        total_distances = None
+        field_counts = [collections.Counter() for _ in FUZZY_FIELD_INDEXES]
+        for word in words:
+            # least edit distance of word to each document, per field
+            field_distances = [{} for _ in FUZZY_FIELD_INDEXES]
+            for matched_word, distance in self._get_fuzzy_matched_words(word).items():
+                for field_index, distances in zip(FUZZY_FIELD_INDEXES, field_distances):
+                    for document_id in self.postings[field_index].get(matched_word, ()):
+                        if distances.get(document_id, distance + 1) > distance:
+                            distances[document_id] = distance
+            path_distances, description_distances = field_distances
+            word_distances = dict(description_distances)
+            for document_id, distance in path_distances.items():
+                word_distances[document_id] = min(distance, word_distances.get(document_id, distance))
+
+            for counts, distances in zip(field_counts, field_distances):
+                counts.update(distances.keys())
+            if total_distances is None:
+                total_distances = word_distances
+            else:
+                total_distances = {
+                    document_id: distance + word_distances[document_id]
+                    for document_id, distance in total_distances.items()
+                    if document_id in word_distances
+                }
+            if not total_distances:
+                return []
+
+        return [
+            (document_id, distance, tuple(counts[document_id] for counts in field_counts))
+            for document_id, distance in total_distances.items()
+        ]
+
+
+@nix_eval.cache_by_unique_installed_nixos_nixpkgs_version
+def get_system_search_index():
+    return SearchIndex(api.get_system_option_tree().iter_attribute_data())
+
+
+# (system attributes of the OptionTree the index was loaded for, index), avoids a disk cache lookup per search
+_system_search_index = (None, None)
+
+
+def _get_system_search_index(system_attributes):
+    global _system_search_index
+    loaded_system_attributes, index = _system_search_index
+    if loaded_system_attributes is not system_attributes:
+        index = get_system_search_index()
+        _system_search_index = (system_attributes, index)
+    return index
+
+
+class IncrementalSearch:
+    """
+    Repeated searches of an OptionTree as a search string is typed.
+
+    If each token of the previous search string is a substring of a token of the new search string, the new
+    search string can only match options matched by the previous one, so only those are searched.
+
+    Construct on the GUI thread, searches may then run on another thread. The tree is only read when
+    constructing, searches read the system search index and the ValueIndex they're passed.
+    """
+    def __init__(self, tree):
+        self.system_attributes = tree.system_attributes
+        self.value_index = tree.value_index
+        self.non_system_attribute_data = list(tree.iter_non_system_attribute_data())
+        self.indexes = None  # loaded by the first search, which may run off the GUI thread
+        self.previous_tokens = None
+        self.previous_matches = None  # document ids matched by each index
+
+    def load_indexes(self):
+        if self.indexes is None:
+            self.indexes = (
+                _get_system_search_index(self.system_attributes),
+                SearchIndex(self.non_system_attribute_data),
+            )
+
+    def is_refinement(self, tokens):
+        return self.previous_tokens is not None and all(
+            any(previous_token in token for token in tokens)
+            for previous_token in self.previous_tokens
+        )
+
+    def search(self, search_str, value_index=None):
+        """
+        Returns a list of (attribute, matched operations) ordered by the number of tokens matched by each
+        operation in order of priority.
+
+        value_index: ValueIndex searched for definition values, the tree's by default. Searches off the GUI thread
+                     must pass a ValueIndex.copy() taken on the GUI thread.
+        """
+        self.load_indexes()
+        if value_index is None:
+            value_index = self.value_index
+        tokens = tokenize_search_str(search_str)
+        candidates = self.previous_matches if self.is_refinement(tokens) else (None,) * len(self.indexes)
+
+        value_matches = {token: value_index.get_token_matches(token) for token in tokens}
+
+        results = []
+        matches = []
+        for index, index_candidates in zip(self.indexes, candidates):
+            index_results = index.search(tokens, index_candidates, value_matches)
+            matches.append(set(document_id for document_id, _ in index_results))
+            results += [(index.attributes[document_id], score) for document_id, score in index_results]
+        self.previous_tokens, self.previous_matches = tokens, tuple(matches)
+
+        results.sort(key=lambda result: (tuple(-count for count in result[1]), str(result[0])))
+        return [
+            (attribute, tuple(operation for operation, count in zip(SEARCHED_FIELDS, score) if count))
+            for attribute, score in results
+        ]
+
+    def fuzzy_search(self, search_str):
+        """
+        Typo tolerant search of the words of search_str in paths and descriptions, see SearchIndex.fuzzy_search.
+        Returns a list of (attribute, matched operations) ordered by total edit distance, then by the number of
+        words matched by each field in order of priority.
+        """
+        self.load_indexes()
+        words = set(WORD_REGEXP.findall(' '.join(tokenize_search_str(search_str))))
+        results = []
+        for index in self.indexes:
+            results += [
+                (index.attributes[document_id], distance, field_counts)
+                for document_id, distance, field_counts in index.fuzzy_search(words)
+            ]
+        results.sort(key=lambda result: (result[1], tuple(-count for count in result[2]), str(result[0])))
+        return [
+            (attribute, tuple(operation for operation, count in zip(FUZZY_MATCH_OPERATIONS, field_counts) if count))
+            for attribute, _, field_counts in results
+        ]
+
+
+def search_options(tree, search_str):
+    """
+    Search the options of tree, see `SearchResultListDisplay.search_tree_for_options`.
+    """
+    return IncrementalSearch(tree).search(search_str)
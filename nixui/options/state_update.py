@@ -2,10 +2,9 @@ import abc
 import dataclasses
 import uuid
 
-from treelib import Tree
-
 from nixui.options import option_definition
 from nixui.options.attribute import Attribute
+from nixui.options.option_trie import OptionTrieNode
 
 
 class Update(abc.ABC):
@@ -107,7 +106,7 @@ class SwapNamesUpdate(Update):
     attribute1: Attribute
 
     def revert(self, option_tree):
-        placeholder = str(uuid.uuid4())
+        placeholder = Attribute.from_insertion(self.attribute0.get_set(), str(uuid.uuid4()))
         option_tree.rename_attribute(self.attribute0, placeholder)
         option_tree.rename_attribute(self.attribute1, self.attribute0)
         option_tree.rename_attribute(placeholder, self.attribute1)
@@ -122,13 +121,11 @@ class SwapNamesUpdate(Update):
 @dataclasses.dataclass(frozen=True, unsafe_hash=True)
 class RemoveUpdate(Update):
     attribute: Attribute
-    deleted_subtree: Tree
+    deleted_subtree: OptionTrieNode
     old_in_memory_definitions: dict
 
     def revert(self, option_tree):
-        parent_nid = self.attribute[:-1]
-        option_tree.tree.paste(parent_nid, self.deleted_subtree)
-        option_tree.in_memory_diff.update(self.old_in_memory_definitions)
+        option_tree.restore_attribute(self.attribute, self.deleted_subtree, self.old_in_memory_definitions)
 
     def details_string(self):
         return f'Removed attribute {self.attribute}'
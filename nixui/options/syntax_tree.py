@@ -1,150 +1,318 @@
-import dataclasses
+import array
 import collections
 import functools
+import os
 import subprocess
 import json
 import tempfile
-import uuid
+import threading
+import weakref
 
+from nixui.options import parse_server
 from nixui.utils import cache
+from nixui.utils.logger import logger
 
 NumRange = collections.namedtuple('NumRange', ['start', 'end'])
 
+# number of integers describing each element in a FlatSyntaxTree's records
+FLAT_RECORD_SIZE = 4
 
-@dataclasses.dataclass
-class Token:
-    id: uuid.UUID = dataclasses.field(default_factory=uuid.uuid4)
-    name: str = 'MODIFIED_IN_NIX_GUI'
-    position: NumRange = None
-    quoted: str = ''
+# Compact form of a parsed syntax tree, cached by the content of the parsed source
+# kinds: the distinct element kinds, e.g. 'NODE_ATTR_SET' and 'TOKEN_WHITESPACE'
+# records: elements in pre-order, FLAT_RECORD_SIZE integers each:
+#          index into kinds, start, end, and the number of children of a node or index into texts of a token
+# texts: the text of each token
+FlatSyntaxTree = collections.namedtuple('FlatSyntaxTree', ['kinds', 'records', 'texts'])
+
+
+# name of the elements inserted by nix-gui
+MODIFIED_NAME = 'MODIFIED_IN_NIX_GUI'
+
+
+class Elem:
+    """
+    An element of a SyntaxTree, a view of its entry in the tree's arrays. Elements constructed directly, e.g.
+    Token(quoted='...') are detached, holding their own data until they're inserted into a tree.
+    """
+    __slots__ = ('_tree', 'id', '_name', '_position')
+
+    def __init__(self, name=MODIFIED_NAME, position=None):
+        self._tree = None
+        self.id = None
+        self._name = name
+        self._position = position
+
+    @classmethod
+    def _view(cls, tree, elem_id):
+        elem = cls.__new__(cls)
+        elem._tree = tree
+        elem.id = elem_id
+        return elem
+
+    def _bind(self, tree, elem_id):
+        self._tree = tree
+        self.id = elem_id
+        self._name = self._position = None
+
+    @property
+    def name(self):
+        if self._tree is None:
+            return self._name
+        return self._tree.kind_names[self._tree.kinds[self.id]]
+
+    @name.setter
+    def name(self, name):
+        if self._tree is None:
+            self._name = name
+        else:
+            self._tree.kinds[self.id] = self._tree._get_kind(name)
+
+    @property
+    def position(self):
+        if self._tree is None:
+            return self._position
+        start = self._tree.starts[self.id]
+        return None if start < 0 else NumRange(start, self._tree.ends[self.id])
+
+    def __eq__(self, other):
+        if self._tree is None or not isinstance(other, Elem):
+            return self is other
+        return self._tree is other._tree and self.id == other.id
+
+    def __hash__(self):
+        return id(self) if self._tree is None else hash((id(self._tree), self.id))
+
+    def __repr__(self):
+        return f'{type(self).__name__}(id={self.id}, name={self.name}, position={self.position})'
+
+
+class Token(Elem):
+    __slots__ = ('_quoted',)
+
+    def __init__(self, name=MODIFIED_NAME, position=None, quoted=''):
+        super().__init__(name, position)
+        self._quoted = quoted
+
+    def _bind(self, tree, elem_id):
+        super()._bind(tree, elem_id)
+        self._quoted = None
+
+    @property
+    def quoted(self):
+        if self._tree is None:
+            return self._quoted
+        return self._tree.texts[self.id]
+
+    @quoted.setter
+    def quoted(self, quoted):
+        if self._tree is None:
+            self._quoted = quoted
+        else:
+            self._tree.texts[self.id] = quoted
 
     def to_string(self):
         return self.quoted
 
 
-@dataclasses.dataclass
-class Node:
-    id: uuid.UUID = dataclasses.field(default_factory=uuid.uuid4)
-    name: str = 'MODIFIED_IN_NIX_GUI'
-    position: NumRange = None
-    elems: list = dataclasses.field(default_factory=list)
+class Node(Elem):
+    __slots__ = ('_elems',)
+
+    def __init__(self, name=MODIFIED_NAME, position=None, elems=None):
+        super().__init__(name, position)
+        self._elems = list(elems) if elems is not None else []
+
+    def _bind(self, tree, elem_id):
+        super()._bind(tree, elem_id)
+        self._elems = None
+
+    @property
+    def elems(self):
+        """
+        The children of the node, a new list which isn't updated when the tree is modified
+        """
+        if self._tree is None:
+            return self._elems
+        return [self._tree.get_elem(child_id) for child_id in self._tree.children[self.id]]
 
     def to_string(self):
-        return ''.join(elem.to_string() for elem in self.elems)
+        if self._tree is None:
+            return ''.join(elem.to_string() for elem in self._elems)
+        return self._tree.to_string(self)
 
 
 class SyntaxTree:
-    def __init__(self, module_path):
-        self.module_path = module_path  # static
-        self.tree = self._get_tree(self.module_path)  # mutable, with call to self._load_structures()
-        self._load_structures()
+    """
+    Arena of the elements of a parsed module, stored in parallel arrays indexed by element id.
+    Elements are accessed through lightweight Node and Token views. Element ids are stable, modifications
+    only append elements to the arrays, the elements a modification removes from the tree are left unreferenced.
+    """
+    def __init__(self, module_path, source=None):
+        """
+        Parse the module at module_path, or source if passed, in which case module_path may be None
+        """
+        self._module_path = module_path  # static
+        self._source = source
+        if source is None:
+            flat_tree = get_module_flat_syntax_tree(module_path)
+            source = ''.join(flat_tree.texts)  # the syntax tree is lossless, its tokens are the source
+        else:
+            flat_tree = get_flat_syntax_tree(source)
+        self._load_flat_syntax_tree(flat_tree)
+        # positions are those of the parsed source, they aren't updated when the tree is modified
+        self.column_line_index_mapper = self._get_column_line_index_map(source)
 
-    # TODO: use hash and get rid of _load_structures
+    @property
+    def module_path(self):
+        # a tree parsed from a string is only written to a file once a path is needed, e.g. for nix evaluation
+        # the file is removed once the tree is garbage collected, or at exit
+        if self._module_path is None:
+            with tempfile.NamedTemporaryFile(mode='w', newline='', delete=False) as temp:
+                temp.write(self._source)
+            self._module_path = temp.name
+            weakref.finalize(self, _remove_temp_file, temp.name)
+        return self._module_path
+
+    @classmethod
+    def load_many(cls, module_paths):
+        """
+        Parse several modules, e.g. an import closure, with one nix_dump_syntax_tree_json process
+        Returns a mapping from module path to SyntaxTree
+        """
+        preload_syntax_trees(module_paths)
+        return {module_path: cls(module_path) for module_path in module_paths}
 
     @classmethod
     @functools.lru_cache()
     def from_string(cls, expression_string):
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp:
-            temp.write(expression_string)
-            temp.flush()
-            return cls(temp.name)
+        return cls(None, expression_string)
 
-    def _load_structures(self):
-        self.flattened_nodes = self._get_flattened_nodes(self.tree)
-        self.elem_ids = {elem.id: elem for elem in self.flattened_nodes}
-        self.elem_parent_map = self._get_elem_parent_map(self.flattened_nodes)
-        self.column_line_index_mapper = self._get_column_line_index_map(self.module_path)
-        self.root_id = self._get_root_id(self.elem_parent_map)
+    def _load_flat_syntax_tree(self, flat_tree):
+        """
+        Load the elements of a FlatSyntaxTree into the arrays, the root is element 0
+        kind_names: distinct element names, kinds: element id -> index into kind_names
+        starts, ends: element id -> position, -1 if the element has no position
+        parents: element id -> parent element id, -1 for the root and elements removed from the tree
+        children: element id -> array of the node's child element ids, None for a token
+        texts: element id -> text of the token, None for a node
+        """
+        kind_names, records, flat_texts = flat_tree
+        self.kind_names = list(kind_names)
+        self._kind_indexes = {name: i for i, name in enumerate(self.kind_names)}
+        self.kinds = array.array('H', records[0::FLAT_RECORD_SIZE])
+        self.starts = records[1::FLAT_RECORD_SIZE]
+        self.ends = records[2::FLAT_RECORD_SIZE]
+        values = records[3::FLAT_RECORD_SIZE]
 
-    @classmethod
-    def _get_tree(cls, module_path):
-        p = subprocess.Popen(["nix_dump_syntax_tree_json", module_path], stdout=subprocess.PIPE)
-        x = json.load(p.stdout)
-        p.wait()
-        return cls._parse_syntax_tree_dict_node_or_token(x)
+        num_elems = len(self.kinds)
+        is_node_kind = [name.startswith('NODE_') for name in self.kind_names]
+        self.parents = array.array('i', [-1]) * num_elems
+        self.children = [None] * num_elems
+        self.texts = [None] * num_elems
+        stack = []  # [node id, number of children remaining]
+        for elem_id in range(num_elems):
+            if stack:
+                parent = stack[-1]
+                self.parents[elem_id] = parent[0]
+                self.children[parent[0]].append(elem_id)
+                parent[1] -= 1
+                if not parent[1]:
+                    stack.pop()
+            if is_node_kind[self.kinds[elem_id]]:
+                self.children[elem_id] = array.array('i')
+                if values[elem_id]:
+                    stack.append([elem_id, values[elem_id]])
+            else:
+                self.texts[elem_id] = flat_texts[values[elem_id]]
+        self.root_id = 0
 
-    @classmethod
-    def _parse_syntax_tree_dict_node_or_token(cls, d):
-        start, end = d['text_range']
-        if d['kind'].startswith('NODE_'):
-            children = [
-                cls._parse_syntax_tree_dict_node_or_token(child)
-                for child in d['children']
-            ]
-            return Node(uuid.uuid4(), d['kind'], NumRange(start, end), children)
+    def _get_kind(self, name):
+        kind = self._kind_indexes.get(name)
+        if kind is None:
+            kind = self._kind_indexes[name] = len(self.kind_names)
+            self.kind_names.append(name)
+        return kind
+
+    def _add_elem(self, elem, parent_id):
+        """
+        Append elem and its descendents to the arrays and return its id. A detached elem becomes a view of this tree,
+        an elem of another tree is copied. The caller adds the id to the children of parent_id.
+        """
+        position = elem.position
+        elem_id = len(self.kinds)
+        self.kinds.append(self._get_kind(elem.name))
+        self.starts.append(-1 if position is None else position.start)
+        self.ends.append(-1 if position is None else position.end)
+        self.parents.append(parent_id)
+        if isinstance(elem, Node):
+            self.children.append(array.array('i'))
+            self.texts.append(None)
+            for child in elem.elems:
+                self.children[elem_id].append(self._add_elem(child, elem_id))
         else:
-            return Token(uuid.uuid4(), d['kind'], NumRange(start, end), d['text'])
+            self.children.append(None)
+            self.texts.append(elem.quoted)
+        if elem._tree is None:
+            elem._bind(self, elem_id)
+        return elem_id
 
-    @classmethod
-    def _get_flattened_nodes(cls, node):
-        res = []
-        for elem in node.elems:
-            if isinstance(elem, Node):
-                res += cls._get_flattened_nodes(elem)
-        return res + [node]
+    def get_elem(self, elem_id):
+        if self.children[elem_id] is None:
+            return Token._view(self, elem_id)
+        return Node._view(self, elem_id)
 
-    @staticmethod
-    def _get_elem_parent_map(flattened_nodes):
-        res = {}
-        for node in flattened_nodes:
-            for elem in node.elems:
-                res[elem.id] = node.id
-        return res
+    @property
+    def tree(self):
+        """
+        The root Node
+        """
+        return self.get_elem(self.root_id)
 
     @staticmethod
-    def _get_column_line_index_map(module_path):
+    def _get_column_line_index_map(source):
         line_index_map = {}
         index = 0
-        with open(module_path) as f:
-            for i, line in enumerate(f.readlines()):
-                line_index_map[i] = index
-                index += len(line.encode())
+        for i, line in enumerate(source.split('\n')):
+            line_index_map[i] = index
+            index += len(line.encode()) + 1
 
         mapper = lambda line, col: line_index_map[line] + col
         return mapper
 
-    @staticmethod
-    def _get_root_id(elem_parent_map):
-        node = next(iter(elem_parent_map.values()))
-        while True:
-            new_node = elem_parent_map.get(node)
-            if new_node is None:
-                return node
-            node = new_node
-        return node
+    def _iter_token_ids(self, node_id):
+        stack = [node_id]
+        while stack:
+            elem_id = stack.pop()
+            child_ids = self.children[elem_id]
+            if child_ids is None:
+                yield elem_id
+            else:
+                stack.extend(reversed(child_ids))
 
     def _iter_tokens(self, node=None):
-        node = node or self.tree
-        for elem in node.elems:
-            if isinstance(elem, Token):
-                yield elem
-            else:
-                yield from self._iter_tokens(elem)
+        node_id = self.root_id if node is None else node.id
+        for token_id in self._iter_token_ids(node_id):
+            if token_id != node_id:
+                yield Token._view(self, token_id)
 
     def to_string(self, node=None):
         """
         Get code string from AST
         """
-        node = node or self.tree
-        s = ''
-        for elem in node.elems:
-            if isinstance(elem, Node):
-                s += self.to_string(elem)
-            else:
-                s += elem.quoted
-        return s
+        node_id = self.root_id if node is None else node.id
+        return ''.join(self.texts[token_id] for token_id in self._iter_token_ids(node_id))
 
     def get_node_at_position(self, pos, legal_type=None, node=None):
         """
         Get the first node of legal_type at character-offset pos
         """
-        node = node or self.tree
-        if node.position.start == pos:
-            return node
-        for elem in node.elems:
-            if isinstance(elem, Node):
-                if elem.position.start <= pos < elem.position.end:
-                    new_node = self.get_node_at_position(pos=pos, legal_type=legal_type, node=elem)  # none or list
+        node_id = self.root_id if node is None else node.id
+        if self.starts[node_id] == pos:
+            return self.get_elem(node_id)
+        for child_id in self.children[node_id]:
+            if self.children[child_id] is not None:
+                if self.starts[child_id] <= pos < self.ends[child_id]:
+                    child_node = Node._view(self, child_id)
+                    new_node = self.get_node_at_position(pos=pos, legal_type=legal_type, node=child_node)
                     if new_node:
                         if legal_type is None or new_node.name == legal_type:
                             return new_node
@@ -156,43 +324,57 @@ class SyntaxTree:
         return self.get_node_at_position(character_index, legal_type)
 
     def get_parent(self, elem):
-        parent_id = self.elem_parent_map[elem.id]
-        parent = self.elem_ids[parent_id]
-        return parent
+        parent_id = self.parents[elem.id]
+        if parent_id < 0:
+            raise KeyError(elem.id)
+        return Node._view(self, parent_id)
+
+    def _get_last_token_id(self, elem_id):
+        while self.children[elem_id] is not None:
+            elem_id = self.children[elem_id][-1]
+        return elem_id
 
     def get_previous_token(self, elem):
-        if elem == self.tree:
-            return None
-        parent = self.get_parent(elem)
-        elem_idx = parent.elems.index(elem)
-        if elem_idx == 0:
-            return self.get_previous_token(parent)
-        prev_elem = parent.elems[elem_idx - 1]
-        while isinstance(prev_elem, Node):
-            prev_elem = prev_elem.elems[-1]
-        return prev_elem
+        elem_id = elem.id
+        while elem_id != self.root_id:
+            parent_id = self.parents[elem_id]
+            sibling_ids = self.children[parent_id]
+            elem_idx = sibling_ids.index(elem_id)
+            if elem_idx > 0:
+                return Token._view(self, self._get_last_token_id(sibling_ids[elem_idx - 1]))
+            elem_id = parent_id
+        return None
 
     def get_token_at_end_of_line(self, inline_node):
         # get token containing first instance of a newline after inline_node
-        parent_node = self.get_parent(inline_node)
-        inline_node_idx = parent_node.elems.index(inline_node)
-        for elem in parent_node.elems[inline_node_idx+1:]:
-            if '\n' in elem.to_string():
+        parent_id = self.parents[inline_node.id]
+        sibling_ids = self.children[parent_id]
+        inline_node_idx = sibling_ids.index(inline_node.id)
+        for elem_id in sibling_ids[inline_node_idx+1:]:
+            if '\n' in self._elem_to_string(elem_id):
                 break
         else:
-            return self.get_token_at_end_of_line(parent_node)
-        while isinstance(elem, Node):
-            for child_elem in elem.elems:
-                if '\n' in child_elem.to_string():
-                    elem = child_elem
+            return self.get_token_at_end_of_line(Node._view(self, parent_id))
+        while self.children[elem_id] is not None:
+            for child_id in self.children[elem_id]:
+                if '\n' in self._elem_to_string(child_id):
+                    elem_id = child_id
                     break
-        return elem
+        return Token._view(self, elem_id)
+
+    def _elem_to_string(self, elem_id):
+        if self.children[elem_id] is None:
+            return self.texts[elem_id]
+        return ''.join(self.texts[token_id] for token_id in self._iter_token_ids(elem_id))
 
     def replace(self, to_replace, replace_with):
-        parent = self.get_parent(to_replace)
-        index = [i for i, elem in enumerate(parent.elems) if elem.id == to_replace.id][0]
-        parent.elems[index] = replace_with
-        self._load_structures()
+        parent_id = self.parents[to_replace.id]
+        if parent_id < 0:
+            raise KeyError(to_replace.id)
+        sibling_ids = self.children[parent_id]
+        index = sibling_ids.index(to_replace.id)
+        sibling_ids[index] = self._add_elem(replace_with, parent_id)
+        self.parents[to_replace.id] = -1
         return replace_with
 
     def remove(self, to_remove):
@@ -205,9 +387,164 @@ class SyntaxTree:
 
     def insert(self, parent, new_value, index=None, after=None):
         if index is None:
-            index = len(parent.elems)
-        parent.elems.insert(
+            index = len(self.children[parent.id])
+        self.children[parent.id].insert(
             index,
-            new_value
+            self._add_elem(new_value, parent.id)
         )
-        self._load_structures()
+
+
+def _read_source(module_path):
+    with open(module_path, newline='') as f:
+        return f.read()
+
+
+def _remove_temp_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _dump_syntax_tree_dicts(module_paths):
+    """
+    Parse every module with a single nix_dump_syntax_tree_json process
+    Returns a list of (module path, parse errors, syntax tree dict or None if the module couldn't be read)
+    Raises ValueError if the process failed, its output may be truncated
+    """
+    with subprocess.Popen(["nix_dump_syntax_tree_json", "--ndjson", *module_paths], stdout=subprocess.PIPE) as p:
+        lines = p.stdout.readlines()
+    if p.returncode != 0:
+        num_parsed = sum(line.endswith(b'\n') for line in lines)  # the last line may be incomplete
+        raise ValueError(
+            f'nix_dump_syntax_tree_json exited with status {p.returncode} after parsing {num_parsed} of '
+            f'{len(module_paths)} modules'
+        )
+    results = [json.loads(line) for line in lines]
+    return [(result['path'], result['errors'], result['tree']) for result in results]
+
+
+# source -> syntax tree dict parsed by preload_syntax_trees, consumed by get_flat_syntax_tree
+_preloaded_syntax_tree_dicts = {}
+
+
+# modules are parsed concurrently, the server is guarded by _parse_server_lock
+_parse_server_lock = threading.Lock()
+_parse_server = None
+_parse_server_failed = False  # the server couldn't be created or failed, a process per parse is used instead
+
+
+def _get_parse_server():
+    """
+    The warm parse server, created on first use, or None if it's unavailable
+    """
+    global _parse_server, _parse_server_failed
+    with _parse_server_lock:
+        if _parse_server is None and not _parse_server_failed:
+            _parse_server = parse_server.create_server()
+            _parse_server_failed = _parse_server is None
+        return _parse_server
+
+
+def _server_parse(source):
+    """
+    Parse source with the warm parse server
+    Raises parse_server.ParseServerUnavailable if the server couldn't parse it
+    """
+    global _parse_server, _parse_server_failed
+    server = _get_parse_server()
+    if server is None:
+        raise parse_server.ParseServerUnavailable('nix syntax tree parse server is disabled')
+    try:
+        return server.parse(source)
+    except parse_server.ParseServerUnavailable as e:
+        with _parse_server_lock:
+            if _parse_server is not server:
+                raise  # already shut down by another thread
+            logger.warning(f'nix syntax tree parse server failed, falling back to a process per parse:\n{e}')
+            _parse_server, _parse_server_failed = None, True
+        server.shutdown()
+        raise
+
+
+def _dump_syntax_tree_dict(source):
+    syntax_tree_dict = _preloaded_syntax_tree_dicts.pop(source, None)
+    if syntax_tree_dict is not None:
+        return syntax_tree_dict
+    try:
+        errors, syntax_tree_dict = _server_parse(source)
+    except parse_server.ParseServerUnavailable:
+        with tempfile.NamedTemporaryFile(mode='w', newline='') as temp:
+            temp.write(source)
+            temp.flush()
+            (_, errors, syntax_tree_dict), = _dump_syntax_tree_dicts([temp.name])
+    if errors:
+        raise ValueError(f'Failed to parse nix expression: {"; ".join(errors)}')
+    return syntax_tree_dict
+
+
+def preload_syntax_trees(module_paths):
+    """
+    Parse every module whose source isn't cached with a single nix_dump_syntax_tree_json process and cache it.
+    Modules which can't be read or don't parse are skipped, loading them raises the error as usual.
+    """
+    uncached_sources = {}
+    for module_path in module_paths:
+        try:
+            source = _read_source(module_path)
+        except OSError:
+            continue
+        if not get_module_flat_syntax_tree.is_cached(module_path):
+            uncached_sources[module_path] = source
+    if not uncached_sources:
+        return
+
+    try:
+        results = _dump_syntax_tree_dicts(list(uncached_sources))
+    except ValueError as e:
+        logger.warning(f'Failed to preload syntax trees: {e}')
+        return
+    for module_path, errors, syntax_tree_dict in results:
+        if errors:
+            logger.warning(f'Failed to parse {module_path}: {"; ".join(errors)}')
+            continue
+        source = uncached_sources[module_path]
+        _preloaded_syntax_tree_dicts[source] = syntax_tree_dict
+        try:
+            get_module_flat_syntax_tree(module_path)
+        finally:
+            # not consumed if another module with the same source was cached first
+            _preloaded_syntax_tree_dicts.pop(source, None)
+
+
+def flatten_syntax_tree_dict(syntax_tree_dict):
+    """
+    Convert the nested dict output by nix_dump_syntax_tree_json to a FlatSyntaxTree
+    """
+    kind_indexes = {}
+    records = array.array('q')
+    texts = []
+    stack = [syntax_tree_dict]
+    while stack:
+        d = stack.pop()
+        kind = kind_indexes.setdefault(d['kind'], len(kind_indexes))
+        start, end = d['text_range']
+        if d['kind'].startswith('NODE_'):
+            records.extend((kind, start, end, len(d['children'])))
+            stack.extend(reversed(d['children']))
+        else:
+            records.extend((kind, start, end, len(texts)))
+            texts.append(d['text'])
+    return FlatSyntaxTree(tuple(kind_indexes), records, tuple(texts))
+
+
+# parses of sources, e.g. of expression strings, are only cached in memory and shared by content with modules
+@functools.lru_cache(maxsize=256)
+def get_flat_syntax_tree(source):
+    return flatten_syntax_tree_dict(_dump_syntax_tree_dict(source))
+
+
+# parses of module files are persisted, and only re-parsed once the module's content changed
+@cache.cache(return_copy=False, retain_hash_fn=cache.first_arg_path_hash_fn)
+def get_module_flat_syntax_tree(module_path):
+    return get_flat_syntax_tree(_read_source(module_path))
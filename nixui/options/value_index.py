@@ -0,0 +1,62 @@
+from nixui.options.option_definition import Undefined, Unevaluated, Unresolvable, get_expression
+
+
+def get_definition_search_text(definition):
+    """
+    Lowercased text of a definition's expression string and object, or None if it's undefined.
+    Only uses the forms of the definition which are already known, definitions aren't evaluated or formatted.
+    """
+    if definition is None:
+        return None
+    expression_string, obj = definition.get_known_forms()
+    texts = [expression_string] if expression_string else []
+    if not any(obj is singleton for singleton in (Undefined, Unevaluated, Unresolvable)):
+        try:
+            obj_text = get_expression(obj)
+        except TypeError:
+            obj_text = str(obj)
+        if obj_text not in texts:
+            texts.append(obj_text)
+    return '\n'.join(texts).lower() or None
+
+
+class ValueIndex:
+    """
+    Searchable text of the in memory and configured definitions of an OptionTree.
+    Updated by the OptionTree as definitions change, so searching values doesn't evaluate any definitions.
+    """
+    def __init__(self):
+        self.in_memory_texts = {}  # attribute -> text
+        self.configured_texts = {}  # attribute -> text
+
+    def copy(self):
+        """
+        Snapshot which can be searched off the GUI thread while this index is updated
+        """
+        value_index = ValueIndex()
+        value_index.in_memory_texts = dict(self.in_memory_texts)
+        value_index.configured_texts = dict(self.configured_texts)
+        return value_index
+
+    @staticmethod
+    def _set_text(texts, attribute, definition):
+        text = get_definition_search_text(definition)
+        if text is None:
+            texts.pop(attribute, None)
+        else:
+            texts[attribute] = text
+
+    def set_in_memory_definition(self, attribute, definition):
+        self._set_text(self.in_memory_texts, attribute, definition)
+
+    def set_configured_definition(self, attribute, definition):
+        self._set_text(self.configured_texts, attribute, definition)
+
+    def get_token_matches(self, token):
+        """
+        Sets of attributes whose in memory and configured definition text contains token
+        """
+        return (
+            set(attribute for attribute, text in self.in_memory_texts.items() if token in text),
+            set(attribute for attribute, text in self.configured_texts.items() if token in text),
+        )
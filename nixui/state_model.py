@@ -1,5 +1,6 @@
 import collections
 import uuid
+import weakref
 
 from nixui.options import api, types, state_update
 from nixui.options.attribute import Attribute
@@ -10,12 +11,21 @@ class SlotMapper:
     def __init__(self):
         self.slot_fns = collections.defaultdict(list)
 
-    def add_slot(self, key, slot):
-        self.slot_fns[key].append(slot)
+    def add_slot(self, key, slot, weak=False):
+        """
+        weak: only keep a weak reference to the bound method slot, e.g. of a widget which is replaced while the
+              StateModel lives on, it is removed once its object is garbage collected
+        """
+        self.slot_fns[key].append(weakref.WeakMethod(slot) if weak else slot)
 
     def __call__(self, key):
         def fn(*args, **kwargs):
-            for slot in self.slot_fns[key]:
+            for slot in list(self.slot_fns[key]):
+                if isinstance(slot, weakref.WeakMethod):
+                    weak_slot, slot = slot, slot()
+                    if slot is None:
+                        self.slot_fns[key].remove(weak_slot)
+                        continue
                 slot(*args, **kwargs)
         return fn
 
@@ -45,7 +55,7 @@ class StateModel:
         self._record_update(update)
 
     def swap_options(self, option0, option1):
-        placeholder = str(uuid.uuid4())
+        placeholder = Attribute.from_insertion(option0.get_set(), str(uuid.uuid4()))
         self.option_tree.rename_attribute(option0, placeholder)
         self.option_tree.rename_attribute(option1, option0)
         self.option_tree.rename_attribute(placeholder, option1)
@@ -1,11 +1,14 @@
 import os
 from distutils.dir_util import copy_tree
+import subprocess
+import sys
 import time
 
 import pytest
 
 from nixui.graphics import main_window
 from nixui import state_model
+from nixui.options import parse_server
 from nixui.options.option_tree import OptionTree
 from nixui.options.attribute import Attribute
 
@@ -89,3 +92,32 @@ def minimal_option_tree():
 def minimal_state_model(mocker, minimal_option_tree):
     mocker.patch('nixui.state_model.api.get_option_tree', return_value=minimal_option_tree)
     return state_model.StateModel()
+
+
+# implements the protocol of `nix_dump_syntax_tree_json --server`, the tree is a single token of the source
+FAKE_PARSE_SERVER = '''
+import json, sys
+while True:
+    header = sys.stdin.buffer.readline()
+    if not header:
+        break
+    source = sys.stdin.buffer.read(int(header)).decode()
+    tree = {'kind': 'NODE_ROOT', 'text_range': [0, len(source.encode())], 'children': [
+        {'kind': 'TOKEN_STRING', 'text_range': [0, len(source.encode())], 'text': source}
+    ]}
+    errors = ['unexpected end of input'] if source.count('{') != source.count('}') else []
+    sys.stdout.write(json.dumps({'errors': errors, 'tree': tree}) + '\\n')
+    sys.stdout.flush()
+'''
+
+
+@pytest.fixture
+def fake_parse_server(mocker):
+    def start(server):
+        server.process = subprocess.Popen(
+            [sys.executable, '-c', FAKE_PARSE_SERVER], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+    mocker.patch.object(parse_server.ParseServer, '_start', start)
+    server = parse_server.ParseServer()
+    yield server
+    server.shutdown()
@@ -1,6 +1,8 @@
 import os
 import pytest
-from nixui.options import api
+from nixui.options import api, nix_eval
+from nixui.options.attribute import Attribute
+from nixui.options.option_definition import OptionDefinition
 
 
 SAMPLES_PATH = 'tests/sample'
@@ -10,3 +12,54 @@ SAMPLES_PATH = 'tests/sample'
 def test_get_option_tree():
     os.environ['CONFIGURATION_PATH'] = os.path.abspath(os.path.join(SAMPLES_PATH, 'configuration.nix'))
     assert api.get_option_tree()
+
+
+def test_get_option_tree_keeps_in_memory_definitions_on_reload(mocker, tmpdir, minimal_option_tree):
+    configuration_path = str(tmpdir.join('configuration.nix'))
+    mocker.patch('nixui.options.api.get_system_option_tree', return_value=minimal_option_tree)
+    get_all_option_values = mocker.patch('nixui.options.api.parser.get_all_option_values')
+
+    def reload(configured_expression_string):
+        with open(configuration_path, 'w') as f:
+            f.write(f'{{ myList = {configured_expression_string}; }}')
+        get_all_option_values.return_value = {
+            Attribute('myList'): OptionDefinition.from_expression_string(configured_expression_string)
+        }
+        return api.get_option_tree(configuration_path)
+
+    tree = reload('[ "a" ]')
+    edited_definition = OptionDefinition.from_expression_string('[ "b" ]')
+    tree.set_definition(Attribute('myList'), edited_definition)
+
+    # the same tree is updated, the unsaved edit is kept
+    assert reload('[ "c" ]') is tree
+    assert tree.get_configured_definition(Attribute('myList')).expression_string == '[ "c" ]'
+    assert tree.get_definition(Attribute('myList')) == edited_definition
+    assert Attribute('myList') in tree.get_changes()
+
+    # once the configuration defines the edit, it's no longer a change
+    assert reload('[ "b" ]') is tree
+    assert tree.get_definition(Attribute('myList')) == edited_definition
+    assert Attribute('myList') not in tree.get_changes()
+
+
+def test_get_option_tree_reloads_modified_import(samples_path):
+    configuration_path = os.path.abspath(os.path.join(samples_path, 'configuration.nix'))
+    hardware_configuration_path = os.path.join(samples_path, 'hardware-configuration.nix')
+    assert nix_eval._get_repl_pool() is not None  # modules are evaluated by warm workers
+
+    tree = api.get_option_tree(configuration_path)
+    assert tree.get_definition(Attribute('boot.kernelModules')).obj == ['kvm-amd', 'ipvs']
+
+    # change a definition and move it to another line of the imported module
+    with open(hardware_configuration_path) as f:
+        module_string = f.read()
+    with open(hardware_configuration_path, 'w') as f:
+        f.write(module_string.replace(
+            '  boot.kernelModules = [ "kvm-amd" "ipvs" ];\n',
+            '  boot.kernelParams = [ "quiet" ];\n  boot.kernelModules = [ "kvm-intel" ];\n',
+        ))
+
+    tree = api.get_option_tree(configuration_path)
+    assert tree.get_definition(Attribute('boot.kernelModules')).obj == ['kvm-intel']
+    assert tree.get_definition(Attribute('boot.kernelParams')).obj == ['quiet']
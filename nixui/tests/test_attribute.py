@@ -0,0 +1,45 @@
+import pickle
+
+from nixui.options.attribute import Attribute
+
+import pytest
+
+
+@pytest.mark.parametrize('path,loc', [
+    ('', ()),
+    ('services.foo.enable', ('services', 'foo', 'enable')),
+    ('users.users."alice.smith".isNormalUser', ('users', 'users', 'alice.smith', 'isNormalUser')),
+    ('networking.firewall.allowedTCPPorts."[0]"', ('networking', 'firewall', 'allowedTCPPorts', '[0]')),
+])
+def test_parse(path, loc):
+    attribute = Attribute(path)
+    assert attribute.loc == loc
+    assert attribute == Attribute(list(loc))
+    assert hash(attribute) == hash(Attribute(list(loc)))
+    assert Attribute(str(attribute)) == attribute
+
+
+def test_segments_interned():
+    attribute = Attribute(['services', ''.join(['fo', 'o'])])
+    assert attribute.get_end() is Attribute('services.foo').get_end()
+    assert Attribute.from_insertion(attribute.get_set(), 'foo') == attribute
+
+
+def test_slicing_and_startswith():
+    attribute = Attribute('services.foo.enable')
+    assert attribute[:2] == Attribute('services.foo')
+    assert attribute[-1] == 'enable'
+    assert attribute.startswith(Attribute('services.foo'))
+    assert attribute.startswith(Attribute(''))
+    assert not attribute.startswith(Attribute('services.bar'))
+    assert not Attribute('services').startswith(attribute)
+    assert 'foo' in attribute
+    assert sorted([attribute, Attribute('services')]) == [attribute, Attribute('services')]
+
+
+def test_immutable_and_picklable():
+    attribute = Attribute('services."foo bar".enable')
+    with pytest.raises(AttributeError):
+        attribute.loc = ('foo',)
+    assert pickle.loads(pickle.dumps(attribute)) == attribute
+    assert str(pickle.loads(pickle.dumps(attribute))) == 'services."foo bar".enable'
@@ -1,4 +1,9 @@
-from nixui.utils import cache
+import concurrent.futures
+import itertools
+import os
+import time
+
+from nixui.utils import cache, file_fingerprint
 
 
 @cache.cache()
@@ -7,18 +12,18 @@ def fake_fn(intarg):
 
 
 def test_cache_path_called_with_call_sig(mocker):
+    mocker.patch.dict(os.environ, {'NIXGUI_CACHE_BACKEND': 'file'})
     mocker.patch('nixui.utils.cache._use_diskcache', return_value=True)
     mocker.patch('nixui.utils.cache._get_cache_path', side_effect=cache._get_cache_path)
     fake_fn(10)
     expected_call = mocker.call(
         ('nixui.tests.test_cache', 'fake_fn', (10,), ()),
-        'hash_result'
     )
     assert expected_call in cache._get_cache_path.mock_calls
 
 
 def test_unique_cache_for_version(mocker):
-    call_args = ('foo', 'foo', 'foo', 'foo'), 'foo'
+    call_args = ('foo', 'foo', 'foo', 'foo'),
 
     mocker.patch('nixui.utils.cache._get_version', return_value='9.9.9')
 
@@ -35,3 +40,221 @@ def test_unique_cache_for_version(mocker):
 
     assert path_0 == path_1
     assert path_0 != path_2
+
+
+def test_record_replaced_when_hash_changes(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'file'})
+    mocker.patch('nixui.utils.cache._use_diskcache', return_value=True)
+    cache._get_cache_path.cache_clear()
+
+    hash_value = {'value': 0}
+    calls = []
+
+    @cache.cache(retain_hash_fn=lambda x: hash_value['value'])
+    def fn(x):
+        calls.append(x)
+        return x + hash_value['value']
+
+    assert fn(1) == 1
+    hash_value['value'] = 1
+    assert fn(1) == 2
+    assert calls == [1, 1]
+
+    call_signature = (__name__, 'fn', (1,), ())
+    assert cache._get_from_disk_cache(call_signature) == (1, 2)
+    # one record per call signature, no leftover temporary files
+    assert [path for path, _, _ in cache._iter_cache_files()] == [cache._get_cache_path(call_signature)]
+    cache._get_cache_path.cache_clear()
+
+
+def test_prune_removes_stale_and_least_recently_used(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'file'})
+    cache._get_cache_path.cache_clear()
+
+    signatures = [('module', 'fn', (i,), ()) for i in range(3)]
+    for i, call_signature in enumerate(signatures):
+        cache._save_to_disk_cache(call_signature, 0, 'x' * 1000)
+        os.utime(cache._get_cache_path(call_signature), (time.time() - 100 + i, time.time() - 100 + i))
+    cache._get_from_disk_cache(signatures[0])  # mark as recently used
+
+    stale_path = os.path.join(cache._get_cache_root(), '0.0.0', 'module', 'fn', 'abc.result')
+    os.makedirs(os.path.dirname(stale_path))
+    open(stale_path, 'w').write('stale')
+
+    record_size = os.path.getsize(cache._get_cache_path(signatures[0]))
+    removed_count, _ = cache.prune(max_size=record_size * 2)
+
+    assert removed_count == 2
+    assert not os.path.exists(os.path.join(cache._get_cache_root(), '0.0.0'))
+    assert cache._get_from_disk_cache(signatures[0]) is not None
+    assert cache._get_from_disk_cache(signatures[1]) is None
+    assert cache._get_from_disk_cache(signatures[2]) is not None
+    assert list(cache.get_stats().values()) == [{'count': 2, 'size': record_size * 2}]
+    cache._get_cache_path.cache_clear()
+
+
+def test_disk_cache_size_tracked_by_concurrent_writes(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'file'})
+    mocker.patch.object(cache, '_disk_cache_size', None)
+    cache._get_cache_path.cache_clear()
+
+    # each record is written twice, replacing the first
+    signatures = [('module', 'fn', (i % 100,), ()) for i in range(200)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda call_signature: cache._save_to_disk_cache(call_signature, 0, 'x' * 1000), signatures))
+    assert cache._disk_cache_size == sum(size for _, size, _ in cache._iter_cache_files())
+    cache._get_cache_path.cache_clear()
+
+
+def test_sqlite_backend(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'sqlite'})
+    mocker.patch('nixui.utils.cache._use_diskcache', return_value=True)
+    backend = cache.SqliteBackend()
+    mocker.patch.dict(cache._backends, {'sqlite': backend})
+
+    calls = []
+
+    @cache.cache(retain_hash_fn=lambda x: 'hash')
+    def fn(x):
+        calls.append(x)
+        return {'value': x}
+
+    assert fn(1) == {'value': 1}
+    assert fn(2) == {'value': 2}
+    assert calls == [1, 2]
+
+    # a new process preloads all records of the function in one query
+    backend = cache.SqliteBackend()
+    mocker.patch.dict(cache._backends, {'sqlite': backend})
+
+    @cache.cache(retain_hash_fn=lambda x: 'hash')
+    def fn(x):
+        calls.append(x)
+        return {'value': x}
+
+    assert fn(1) == {'value': 1}
+    assert calls == [1, 2]
+    assert (__name__, 'fn', cache._get_args_hash((__name__, 'fn', (2,), ()))) in backend._preloaded
+
+    stats = cache.get_stats()
+    assert list(stats) == [(cache._get_version(), __name__, 'fn')]
+    assert stats[(cache._get_version(), __name__, 'fn')]['count'] == 2
+
+    removed_count, _ = cache.prune(max_size=0)
+    assert removed_count == 2
+    assert cache.get_stats() == {}
+
+
+def test_sqlite_backend_reads_dont_write(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'sqlite'})
+    mocker.patch('nixui.utils.cache.time.time', side_effect=itertools.count())
+    backend = cache.SqliteBackend()
+    mocker.patch.dict(cache._backends, {'sqlite': backend})
+
+    signatures = [(__name__, 'fn', (i,), ()) for i in range(2)]
+    for call_signature in signatures:
+        backend.put(call_signature, 0, 'x' * 1000)
+    get_last_used = lambda: [
+        last_used for last_used, in backend._get_connection().execute('SELECT last_used FROM records ORDER BY rowid')
+    ]
+    assert get_last_used() == [0, 1]
+
+    assert backend.get(signatures[0]) == (0, 'x' * 1000)
+    assert get_last_used() == [0, 1]
+
+    # the read is written before least recently used records are evicted
+    removed_count, _ = cache.prune(max_size=1500, remove_stale=False)
+    assert removed_count == 1
+    assert backend.get(signatures[0]) is not None
+    assert backend.get(signatures[1]) is None
+
+
+def test_memory_hits_skip_disk(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'file'})
+    mocker.patch('nixui.utils.cache._use_diskcache', return_value=True)
+    mocker.patch('nixui.utils.cache._get_from_disk_cache', side_effect=cache._get_from_disk_cache)
+    cache._get_cache_path.cache_clear()
+
+    hash_value = {'value': 0}
+
+    @cache.cache(retain_hash_fn=lambda x: hash_value['value'])
+    def fn(x):
+        return x + hash_value['value']
+
+    for _ in range(10):
+        fn(1)
+    hash_value['value'] = 1
+    fn(1)
+    fn(1)
+
+    assert fn.cache_info() == cache.CacheInfo(memory_hits=10, disk_hits=0, misses=2)
+    assert cache.get_cache_infos()[(__name__, 'fn')] == fn.cache_info()
+    assert cache._get_from_disk_cache.call_count == 1
+    cache._get_cache_path.cache_clear()
+
+
+def test_file_hash_only_rehashed_when_stat_changes(mocker, tmpdir):
+    path = str(tmpdir.join('module.nix'))
+    open(path, 'w').write('{ }')
+    mocker.patch('nixui.utils.file_fingerprint._hash_file_contents', side_effect=file_fingerprint._hash_file_contents)
+
+    first_hash = file_fingerprint.get_file_hash(path)
+    assert file_fingerprint.get_file_hash(path) == first_hash
+    assert file_fingerprint._hash_file_contents.call_count == 1
+
+    open(path, 'w').write('{ foo = 1; }')
+    assert file_fingerprint.get_file_hash(path) != first_hash
+    assert file_fingerprint._hash_file_contents.call_count == 2
+    assert file_fingerprint.get_file_hash(str(tmpdir.join('missing.nix'))) is None
+
+
+def test_import_closure_invalidation(tmpdir):
+    root_path, import_path = str(tmpdir.join('configuration.nix')), str(tmpdir.join('imported.nix'))
+    open(root_path, 'w').write('{ imports = [ ./imported.nix ]; }')
+    open(import_path, 'w').write('{ }')
+    calls = []
+
+    @cache.cache(retain_hash_fn=cache.first_arg_import_closure_hash_fn, diskcache=False)
+    def fn(path):
+        calls.append(path)
+        file_fingerprint.set_dependencies(path, [path, import_path])
+        return len(calls)
+
+    assert fn(root_path) == 1
+    assert fn(root_path) == 1
+    open(import_path, 'w').write('{ foo = 1; }')
+    assert fn(root_path) == 2
+    file_fingerprint._dependencies.clear()
+    assert fn(root_path) == 2
+    assert file_fingerprint.get_dependencies(root_path) == {import_path}
+
+    # a fingerprint taken before the dependencies are known matches unless a dependency changed
+    stored_fingerprint = cache.first_arg_import_closure_hash_fn(root_path)
+    file_fingerprint._dependencies.clear()
+    fingerprint = cache.first_arg_import_closure_hash_fn(root_path)
+    assert fingerprint == stored_fingerprint
+    # comparing has no side effects, a cache hit records the dependencies
+    assert file_fingerprint.get_dependencies(root_path) == set()
+    fingerprint.record_dependencies(stored_fingerprint)
+    assert file_fingerprint.get_dependencies(root_path) == {import_path}
+    file_fingerprint._dependencies.clear()
+    open(import_path, 'w').write('{ foo = 2; }')
+    assert cache.first_arg_import_closure_hash_fn(root_path) != stored_fingerprint
+
+
+def test_is_cached(mocker, tmpdir):
+    mocker.patch.dict(os.environ, {'XDG_CONFIG_HOME': str(tmpdir), 'NIXGUI_CACHE_BACKEND': 'file'})
+    mocker.patch('nixui.utils.cache._use_diskcache', return_value=True)
+    cache._get_cache_path.cache_clear()
+
+    def fn(x):
+        return x + 1
+
+    cached_fn = cache.cache()(fn)
+    assert not cached_fn.is_cached(1)
+    cached_fn(1)
+    assert cached_fn.is_cached(1)
+    assert not cached_fn.is_cached(2)
+    # cached on disk by another instance
+    assert cache.cache()(fn).is_cached(1)
+    assert cached_fn.cache_info().misses == 1
@@ -1,4 +1,4 @@
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets
 
 from nixui.graphics import option_display
 from nixui.options import types
@@ -42,3 +42,34 @@ def test_integration_load_all_field_widgets(nix_gui_main_window):
                 display = nav_interface.fields_view.current_widget.elements[0]
                 if not display.is_defined_toggle.isChecked():
                     display.is_defined_toggle.setChecked(True)
+
+
+def test_option_display_doesnt_repaint_while_idle(qtbot, mocker):
+    from nixui.options.attribute import Attribute
+    from nixui.options.option_definition import OptionDefinition
+    from nixui.options.option_tree import OptionTree
+
+    tree = OptionTree({Attribute('foo.enable'): {'_type': types.BoolType()}}, {})
+    mocker.patch('nixui.graphics.option_display.api.get_option_tree', return_value=tree)
+    statemodel = mocker.Mock()
+    statemodel.get_definition.return_value = OptionDefinition.undefined()
+    paint_hook = mocker.Mock()
+    mocker.patch.object(option_display, 'paint_hook', paint_hook)
+
+    display = option_display.GenericOptionDisplay(statemodel, None, Attribute('foo.enable'))
+    qtbot.addWidget(display)
+    display.show()
+    qtbot.waitExposed(display)
+    qtbot.waitUntil(lambda: display.paint_count > 0)
+    qtbot.wait(200)
+    idle_paint_count = display.paint_count
+    qtbot.wait(200)
+    assert display.paint_count == idle_paint_count
+    assert paint_hook.call_count == idle_paint_count
+    assert paint_hook.call_args.args[0] is display
+
+    # focus changes of the display and its fields repaint the highlight
+    for widget in (display, display.field_selector.btn_group.buttons()[0]):
+        paint_count = display.paint_count
+        QtWidgets.QApplication.sendEvent(widget, QtGui.QFocusEvent(QtCore.QEvent.FocusIn))
+        qtbot.waitUntil(lambda: display.paint_count > paint_count)
@@ -37,4 +37,28 @@ def test_navbar_search(qapp, qtbot, mocker):
     navbar = NavBar(temp.set_lookup_key, "", "")
     qtbot.keyClicks(navbar.findChildren(QtWidgets.QLineEdit)[1], "programs")
     qtbot.keyPress(navbar.findChildren(QtWidgets.QLineEdit)[1], PyQt5.QtCore.Qt.Key_Enter)
-    temp.set_lookup_key.assert_called_once_with("search:programs")
\ No newline at end of file
+    temp.set_lookup_key.assert_called_once_with("search:programs")
+
+
+def test_navbar_search_as_you_type(qapp, qtbot, mocker):
+    temp = Temp()
+    mocker.patch.object(temp, 'set_lookup_key')
+    search_fn = mocker.Mock()
+    navbar = NavBar(temp.set_lookup_key, "", "", search_fn=search_fn)
+    qtbot.keyClicks(navbar.findChildren(QtWidgets.QLineEdit)[1], "programs")
+    # debounced, only searched once typing pauses
+    qtbot.waitUntil(lambda: search_fn.called)
+    search_fn.assert_called_once_with("programs")
+    temp.set_lookup_key.assert_not_called()
+
+
+def test_navbar_search_enter_cancels_search_as_you_type(qapp, qtbot, mocker):
+    temp = Temp()
+    mocker.patch.object(temp, 'set_lookup_key')
+    search_fn = mocker.Mock()
+    navbar = NavBar(temp.set_lookup_key, "", "", search_fn=search_fn)
+    qtbot.keyClicks(navbar.findChildren(QtWidgets.QLineEdit)[1], "programs")
+    qtbot.keyPress(navbar.findChildren(QtWidgets.QLineEdit)[1], PyQt5.QtCore.Qt.Key_Enter)
+    qtbot.wait(500)
+    temp.set_lookup_key.assert_called_once_with("search:programs")
+    search_fn.assert_not_called()
@@ -0,0 +1,113 @@
+from nixui import state_model
+from nixui.graphics import navlist
+from nixui.options import types
+from nixui.options.attribute import Attribute
+from nixui.options.option_definition import OptionDefinition
+from nixui.options.option_tree import OptionTree
+
+import pytest
+from PyQt5 import QtCore, QtGui
+
+
+@pytest.fixture
+def services_option_tree(mocker):
+    tree = OptionTree(
+        {
+            **{
+                Attribute(['services', f'service{i}', 'enable']): {'_type': types.BoolType()}
+                for i in range(1000)
+            },
+            Attribute('services.users'): {'_type': types.AttrsOfType(types.StrType())},
+        },
+        {},
+    )
+    mocker.patch('nixui.graphics.navlist.api.get_option_tree', return_value=tree)
+    return tree
+
+
+def test_static_attrs_of_loads_row_data_lazily(qapp, qtbot, mocker, services_option_tree):
+    get_row_data = mocker.spy(navlist.OptionListModel, 'get_row_data')
+    navlist_display = navlist.StaticAttrsOf(Attribute('services'), set_option_path_fn=None)
+    qtbot.addWidget(navlist_display)
+    assert navlist_display.model().rowCount() == 1001
+    # only the first row, for the size of rows, and the widest row, for the width of the list
+    assert len(set(call.args[1] for call in get_row_data.call_args_list)) <= 2
+
+    navlist_display.resize(300, 400)
+    navlist_display.show()
+    qtbot.waitExposed(navlist_display)
+    # only rows within the viewport are displayed
+    assert 0 < len(set(call.args[1] for call in get_row_data.call_args_list)) < 50
+
+
+def test_option_list_model_row_data(services_option_tree):
+    services_option_tree.set_definition(
+        Attribute('services.service1.enable'), OptionDefinition.from_expression_string('true')
+    )
+    model = navlist.OptionListModel(services_option_tree.children(Attribute('services')))
+    row_data = model.data(model.index(1))
+    assert row_data['text'] == 'service1'
+    assert row_data['child_count'] == '1/1'
+    assert row_data['status_circle_color'] is not None
+    assert model.data(model.index(0))['status_circle_color'] is None
+    assert model.data(model.index(1), navlist.OptionListModel.OptionRole) == Attribute('services.service1')
+
+
+def test_option_list_model_reloads_row_data_on_edit(qapp, mocker, services_option_tree):
+    mocker.patch('nixui.state_model.api.get_option_tree', return_value=services_option_tree)
+    statemodel = state_model.StateModel()
+    model = navlist.OptionListModel(services_option_tree.children(Attribute('services')), statemodel=statemodel)
+    users_index = model.index(model.row_of('users'))
+    child_count = model.data(users_index)['child_count']
+    data_changed = mocker.Mock()
+    model.dataChanged.connect(data_changed)
+
+    statemodel.add_new_option(Attribute('services.users'))
+    assert data_changed.called
+    assert model.data(users_index)['child_count'] != child_count
+
+    statemodel.undo()
+    assert model.data(users_index)['child_count'] == child_count
+
+
+def test_option_list_model_widest_row(qapp, services_option_tree):
+    services_option_tree.insert_attribute(Attribute('services.aServiceWithALongName'))
+    model = navlist.OptionListModel(services_option_tree.children(Attribute('services')))
+    font_metrics = QtGui.QFontMetrics(QtGui.QFont())
+    assert model.options[model.get_widest_row(font_metrics)] == Attribute('services.aServiceWithALongName')
+
+
+def test_option_list_model_cache_is_bounded(services_option_tree, mocker):
+    mocker.patch.object(navlist.OptionListModel, 'row_data_cache_size', 10)
+    model = navlist.OptionListModel(services_option_tree.children(Attribute('services')))
+    for row in range(100):
+        model.data(model.index(row))
+    assert len(model._row_data_cache) == 10
+    assert list(model._row_data_cache) == model.options[90:100]
+
+
+def test_dynamic_attrs_of_rename(qapp, qtbot, mocker, services_option_tree):
+    services_option_tree.insert_attribute(Attribute('services.users.alice'))
+    statemodel = mocker.Mock()
+    navlist_display = navlist.DynamicAttrsOf(statemodel, Attribute('services.users'), set_option_path_fn=None)
+    qtbot.addWidget(navlist_display)
+    model = navlist_display.list_widget.model()
+    assert model.flags(model.index(0)) & QtCore.Qt.ItemIsEditable
+
+    model.setData(model.index(0), 'bob')
+    statemodel.rename_option.assert_called_once_with(
+        Attribute('services.users.alice'), Attribute('services.users.bob')
+    )
+    assert model.data(model.index(0))['text'] == 'bob'
+
+
+def test_dynamic_list_of_move(qapp, qtbot, mocker, services_option_tree):
+    navlist_display = navlist.DynamicListOf(mocker.Mock(), Attribute('services'), set_option_path_fn=None)
+    qtbot.addWidget(navlist_display)
+    model = navlist_display.list_widget.model()
+    option0, option1, option2 = model.options[:3]
+    navlist_display.list_widget.set_current_option(option0.get_end())
+    navlist_display.down_clicked()
+    assert model.options[:3] == [option1, option0, option2]
+    navlist_display.up_clicked()
+    assert model.options[:3] == [option0, option1, option2]
@@ -1,7 +1,10 @@
+import concurrent.futures
 import os
+import time
+
 import pytest
 
-from nixui.options import nix_eval, attribute
+from nixui.options import nix_eval, nix_repl, attribute
 
 
 SAMPLES_PATH = 'tests/sample'
@@ -11,6 +14,73 @@ def test_nix_instantiate_eval():
     assert nix_eval.nix_instantiate_eval("true")
 
 
+def test_nix_instantiate_eval_error():
+    with pytest.raises(nix_eval.NixEvalError):
+        nix_eval.nix_instantiate_eval('throw "expected failure"')
+
+
+def test_nix_instantiate_eval_incomplete_expression():
+    with pytest.raises(nix_eval.NixEvalError):
+        nix_eval.nix_instantiate_eval('{ foo = "bar')
+
+
+def test_nix_instantiate_eval_many():
+    results = nix_eval.nix_instantiate_eval_many([
+        '1 + 1',
+        'throw "caught by tryEval"',
+        '{ foo = undefinedVariable; }',  # caught by tryEval, undefined variables are bound to a throw
+        '[ "a" "b" ] # trailing comment',
+    ])
+    assert results[0] == 2
+    assert isinstance(results[1], nix_eval.NixEvalError)
+    assert isinstance(results[2], nix_eval.NixEvalError)
+    assert results[3] == ['a', 'b']
+
+
+def test_nix_instantiate_eval_many_free_variables_dont_fail_batch(mocker):
+    nix_instantiate_eval = mocker.spy(nix_eval, 'nix_instantiate_eval')
+    results = nix_eval.nix_instantiate_eval_many([
+        '1 + 1',
+        'pkgs.foo',  # a module's argument, undefined outside of the module
+        'let pkgs = { foo = "bar"; }; in pkgs.foo',
+        'with lib; mkForce true',
+        'map (x: x * 2) [ 1 2 ]',
+    ])
+    assert results[0] == 2
+    assert isinstance(results[1], nix_eval.NixEvalError)
+    assert results[2] == 'bar'
+    assert isinstance(results[3], nix_eval.NixEvalError)
+    assert results[4] == [2, 4]
+    assert nix_instantiate_eval.call_count == 1
+
+
+def test_repl_pool_matches_nix_instantiate():
+    expr = 'builtins.mapAttrs (n: v: v + 1) { a = 1; "b.c" = 2; }'
+    assert nix_eval.nix_instantiate_eval(expr) == nix_eval.nix_instantiate_eval(expr, show_trace=True)
+
+
+def test_repl_pool_created_once_by_concurrent_calls(mocker):
+    mocker.patch.object(nix_eval, '_repl_pool', None)
+    mocker.patch.object(nix_eval, '_repl_pool_failed', False)
+    create_pool = mocker.patch(
+        'nixui.options.nix_eval.nix_repl.create_pool', side_effect=lambda env: time.sleep(0.05) or object()
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        pools = list(executor.map(lambda _: nix_eval._get_repl_pool(), range(8)))
+    assert create_pool.call_count == 1
+    assert all(pool is pools[0] for pool in pools)
+
+
+@pytest.mark.parametrize('literal,expected', [
+    ('"foo"', 'foo'),
+    (r'"{\"foo\":\"bar\"}"', '{"foo":"bar"}'),
+    (r'"\${foo} \\n"', '${foo} \\n'),
+    (r'"line\nline"', 'line\nline'),
+])
+def test_parse_nix_string_literal(literal, expected):
+    assert nix_repl.parse_nix_string_literal(literal) == expected
+
+
 def test_nixpkgs_nixos_instantiate_eval():
     assert nix_eval.nix_instantiate_eval("<nixpkgs/nixos>")
 
@@ -29,3 +99,40 @@ def test_get_modules_evaluated_imports():
     result = nix_eval.get_modules_evaluated_import_paths(module_path)
     base_modules_path = nix_eval.resolve_nix_search_path('<nixpkgs/nixos/modules>')
     assert result == [base_modules_path.strip() + "/installer/scan/not-detected.nix"]
+
+
+@pytest.mark.datafiles(SAMPLES_PATH)
+def test_get_module_graph():
+    module_path = os.path.abspath(os.path.join(SAMPLES_PATH, 'configuration.nix'))
+    graph = nix_eval.get_module_graph(module_path)
+    assert next(iter(graph)) == module_path
+    hardware_module_path = os.path.abspath(os.path.join(SAMPLES_PATH, 'hardware-configuration.nix'))
+    assert hardware_module_path in graph[module_path]['imports']
+    assert graph[hardware_module_path]['imports'] == nix_eval.get_modules_evaluated_import_paths(hardware_module_path)
+    assert graph[hardware_module_path]['defined_attrs'] == nix_eval.get_modules_defined_attrs(hardware_module_path)
+    assert graph[module_path]['imports_position'] == nix_eval.get_modules_import_position(module_path)
+
+
+def test_get_module_graph_invalidates_repl_pool_if_import_modified(mocker, tmpdir):
+    module_path = str(tmpdir.join('configuration.nix'))
+    import_path = str(tmpdir.join('hardware-configuration.nix'))
+    with open(module_path, 'w') as f:
+        f.write('{ imports = [ ./hardware-configuration.nix ]; }')
+    with open(import_path, 'w') as f:
+        f.write('{ }')
+    pool = mocker.Mock()
+    mocker.patch.object(nix_eval, '_repl_pool', pool)
+    mocker.patch.object(nix_eval, '_repl_pool_failed', False)
+    mocker.patch('nixui.options.nix_eval.nix_instantiate_eval', return_value=[
+        {'path': module_path, 'imports': [import_path], 'defined_attrs': [], 'imports_position': None},
+        {'path': import_path, 'imports': [], 'defined_attrs': [], 'imports_position': None},
+    ])
+
+    nix_eval.get_module_graph(module_path)
+    assert pool.invalidate.call_count == 0
+
+    # only the import changed, the workers must not serve its previous contents
+    with open(import_path, 'w') as f:
+        f.write('{ boot.kernelModules = [ ]; }')
+    nix_eval.get_module_graph(module_path)
+    assert pool.invalidate.call_count == 1
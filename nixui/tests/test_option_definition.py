@@ -1,5 +1,7 @@
-from nixui.options.option_definition import OptionDefinition, Undefined
-from nixui.options import nix_eval
+import pickle
+
+from nixui.options.option_definition import OptionDefinition, Undefined, Unresolvable, PendingEvaluation
+from nixui.options import nix_eval, option_definition
 
 
 def test_expr_string_from_obj():
@@ -37,3 +39,45 @@ def test_import_path_nixpkgs():
     )
     assert len(d.obj) == 1
     assert d.obj[0].eval_full_path() == f'{nixpkgs_path}/nixos/modules/installer/cd-dvd/installation-cd-minimal.nix'
+
+
+def test_resolve_pending_evaluations_single_round_trip(mocker):
+    mocker.patch(
+        'nixui.options.nix_eval.nix_instantiate_eval_many',
+        return_value=[3, nix_eval.NixEvalError('failed')]
+    )
+    objs = option_definition.resolve_pending_evaluations([
+        [1, PendingEvaluation('1 + 2')],
+        PendingEvaluation('1 + 2'),
+        PendingEvaluation('throw "x"'),
+        'literal',
+    ])
+    assert objs == [[1, 3], 3, Unresolvable, 'literal']
+    nix_eval.nix_instantiate_eval_many.assert_called_once_with(['1 + 2', 'throw "x"'])
+
+
+def test_from_expression_nodes():
+    expressions = ['[ 1 (1 + 1) ]', 'if true then "bla" else "foo"', './foo.nix']
+    nodes = [OptionDefinition.from_expression_string(e)._get_ast_node() for e in expressions]
+    definitions = OptionDefinition.from_expression_nodes(nodes, context={'module_dir': '/foo'})
+    assert [d.expression_string for d in definitions] == expressions
+    assert definitions[0].obj == [1, 2]
+    assert definitions[1].obj == 'bla'
+    assert definitions[2].obj.eval_full_path() == '/foo/foo.nix'
+
+
+def test_from_expression_nodes_reuses_nodes(mocker, fake_parse_server):
+    mocker.patch('nixui.options.syntax_tree._get_parse_server', return_value=fake_parse_server)
+    mocker.patch('nixui.options.option_definition.resolve_pending_evaluations', return_value=['reused'])
+    node = OptionDefinition.from_expression_string('"reused"')._get_ast_node()
+    definition, = OptionDefinition.from_expression_nodes([node])
+    from_string = mocker.spy(option_definition.syntax_tree.SyntaxTree, 'from_string')
+    assert definition._get_ast_node() is node
+    assert not from_string.called
+    # the node isn't pickled, it's re-parsed
+    assert pickle.loads(pickle.dumps(definition))._get_ast_node().to_string() == '"reused"'
+
+
+def test_get_known_forms():
+    assert OptionDefinition.from_object([1]).get_known_forms() == (None, [1])
+    assert OptionDefinition.from_expression_string('1 + 2').get_known_forms() == ('1 + 2', option_definition.Unevaluated)
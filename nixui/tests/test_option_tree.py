@@ -1,4 +1,5 @@
 import os
+import tracemalloc
 
 from nixui.options import api, types
 from nixui.options.option_tree import OptionTree
@@ -33,6 +34,190 @@ def test_option_tree_simple_attr_set():
     assert t.get_definition(child_attr).obj == 'val'
 
 
+def test_update_configured_definitions():
+    declared_attr = Attribute(['foo', 'bar'])
+    removed_attr = Attribute(['foo', 'baz', 'qux'])
+    t = OptionTree(
+        {declared_attr: {'_type': 'mytype'}},
+        {
+            declared_attr: OptionDefinition.from_expression_string('"old"'),
+            removed_attr: OptionDefinition.from_expression_string('"removed"'),
+        },
+    )
+    t.set_definition(declared_attr, OptionDefinition.from_expression_string('"new"'))
+
+    t.update_configured_definitions({declared_attr: OptionDefinition.from_expression_string('"new"')})
+
+    assert t.get_configured_definition(declared_attr) == OptionDefinition.from_expression_string('"new"')
+    assert t.get_changes() == {}
+    assert t.get_changes(get_configured_changes=True) == {declared_attr: OptionDefinition.from_expression_string('"new"')}
+    # branches only existing for removed configured definitions are removed
+    assert list(t.children(Attribute(['foo']))) == [declared_attr]
+
+
+def test_with_configured_shares_system_options():
+    declared_attr = Attribute(['foo', 'bar'])
+    attrs_of_attr = Attribute(['foo', 'baz'])
+    configured_attr = Attribute(['foo', 'baz', 'qux'])
+    system_option_data = {
+        declared_attr: {'_type': types.StrType()},
+        attrs_of_attr: {'_type': types.AttrsOfType(types.StrType())},
+    }
+    config_options = {
+        declared_attr: OptionDefinition.from_expression_string('"configured"'),
+        configured_attr: OptionDefinition.from_expression_string('"value"'),
+    }
+    system_tree = OptionTree(system_option_data, {})
+    t = system_tree.with_configured(config_options)
+    expected = OptionTree(system_option_data, config_options)
+
+    assert list(t.iter_attributes()) == list(expected.iter_attributes())
+    assert t.get_changes(get_configured_changes=True) == expected.get_changes(get_configured_changes=True)
+    assert t.get_type(configured_attr) == types.StrType()
+
+    t.set_definition(declared_attr, OptionDefinition.from_expression_string('"in memory"'))
+    assert system_tree.get_definition(declared_attr) == OptionDefinition.undefined()
+    assert system_tree.with_configured({}).get_definition(declared_attr) == OptionDefinition.undefined()
+    assert configured_attr not in system_tree.tree
+
+
+def test_with_configured_copies_shared_data_of_moved_nodes():
+    declared_attr = Attribute(['foo', 'bar'])
+    renamed_attr = Attribute(['foo', 'qux'])
+    system_tree = OptionTree({declared_attr: {'_type': types.StrType()}}, {})
+    t = system_tree.with_configured({})
+
+    t.rename_attribute(declared_attr, renamed_attr)
+    t.set_definition(renamed_attr, OptionDefinition.from_expression_string('"in memory"'))
+    assert t.get_definition(renamed_attr) == OptionDefinition.from_expression_string('"in memory"')
+    assert system_tree.get_definition(declared_attr) == OptionDefinition.undefined()
+    assert system_tree.with_configured({}).get_definition(declared_attr) == OptionDefinition.undefined()
+
+
+def test_value_index_updated_on_edit():
+    attrs_of_attr = Attribute(['foo', 'bar'])
+    attr = Attribute(['foo', 'bar', 'baz'])
+    renamed_attr = Attribute(['foo', 'bar', 'qux'])
+    t = OptionTree(
+        {attrs_of_attr: {'_type': types.AttrsOfType(types.StrType())}},
+        {attr: OptionDefinition.from_expression_string('"Configured"')},
+    )
+    assert t.value_index.configured_texts == {attr: '"configured"'}
+
+    t.set_definition(attr, OptionDefinition.from_expression_string('"in memory"'))
+    assert t.value_index.in_memory_texts == {attr: '"in memory"'}
+    t.set_definition(attr, OptionDefinition.from_expression_string('"Configured"'))
+    assert t.value_index.in_memory_texts == {}
+
+    t.set_definition(attr, OptionDefinition.from_expression_string('"in memory"'))
+    t.rename_attribute(attr, renamed_attr)
+    assert t.value_index.in_memory_texts == {renamed_attr: '"in memory"'}
+
+    old_in_memory_definitions, deleted_subtree = t.remove_attribute(renamed_attr)
+    assert t.value_index.in_memory_texts == {}
+    t.restore_attribute(renamed_attr, deleted_subtree, old_in_memory_definitions)
+    assert t.value_index.in_memory_texts == {renamed_attr: '"in memory"'}
+
+    t.update_configured_definitions({})
+    assert t.value_index.configured_texts == {}
+
+
+def assert_leaf_counts_correct(option_tree):
+    def count_leaves(node):
+        return sum(count_leaves(child) for child in node.children.values()) if node.children else 1
+    for attribute, node in option_tree.tree.iter_nodes():
+        assert option_tree.count_leaves(attribute) == count_leaves(node), attribute
+        assert option_tree.count_children(attribute) == len(option_tree.children(attribute))
+
+
+def test_leaf_counts_maintained_on_edit():
+    attrs_of_attr = Attribute(['foo', 'bar'])
+    system_tree = OptionTree(
+        {
+            Attribute(['foo', 'enable']): {'_type': types.BoolType()},
+            attrs_of_attr: {'_type': types.AttrsOfType(types.AttrsType())},
+            Attribute(['foo', 'bar', '<name>', 'baz']): {'_type': types.StrType()},
+            Attribute(['foo', 'bar', '<name>', 'qux']): {'_type': types.StrType()},
+        },
+        {},
+    )
+    assert_leaf_counts_correct(system_tree)
+    t = system_tree.with_configured({
+        Attribute(['foo', 'bar', 'alice', 'baz']): OptionDefinition.from_expression_string('"alice"'),
+    })
+    assert_leaf_counts_correct(t)
+    assert_leaf_counts_correct(system_tree)
+    leaf_count = t.count_leaves(Attribute([]))
+
+    t.insert_attribute(Attribute(['foo', 'bar', 'bob']))
+    assert t.count_leaves(Attribute([])) == leaf_count + 1
+    assert_leaf_counts_correct(t)
+
+    t.rename_attribute(Attribute(['foo', 'bar', 'bob']), Attribute(['foo', 'bar', 'carol']))
+    assert_leaf_counts_correct(t)
+
+    old_in_memory_definitions, deleted_subtree = t.remove_attribute(Attribute(['foo', 'bar', 'carol']))
+    assert t.count_leaves(Attribute([])) == leaf_count
+    assert_leaf_counts_correct(t)
+    t.restore_attribute(Attribute(['foo', 'bar', 'carol']), deleted_subtree, old_in_memory_definitions)
+    assert t.count_leaves(Attribute([])) == leaf_count + 1
+    assert_leaf_counts_correct(t)
+
+    t.update_configured_definitions({})
+    assert_leaf_counts_correct(t)
+
+
+def assert_change_sets_correct(option_tree):
+    for get_configured_changes in (False, True):
+        expected = set()
+        for attr in option_tree.get_changes(get_configured_changes):
+            expected.update(attr[:i] for i in range(len(attr)))
+        assert set(option_tree.get_change_set_with_ancestors(get_configured_changes)) == expected
+
+
+def test_change_set_with_ancestors_maintained_on_edit():
+    system_tree = OptionTree(
+        {
+            Attribute('foo.enable'): {'_type': types.BoolType()},
+            Attribute('foo.bar'): {'_type': types.AttrsOfType(types.StrType())},
+            Attribute('baz.qux'): {'_type': types.StrType()},
+        },
+        {},
+    )
+    t = system_tree.with_configured({
+        Attribute('foo.bar.alice'): OptionDefinition.from_expression_string('"alice"'),
+    })
+    assert_change_sets_correct(t)
+    assert Attribute('foo.bar') in t.get_change_set_with_ancestors(get_configured_changes=True)
+    assert Attribute('foo.bar') not in t.get_change_set_with_ancestors()
+
+    t.set_definition(Attribute('baz.qux'), OptionDefinition.from_expression_string('"qux"'))
+    t.insert_attribute(Attribute('foo.bar.bob'))
+    t.set_definition(Attribute('foo.bar.bob'), OptionDefinition.from_expression_string('"bob"'))
+    assert_change_sets_correct(t)
+    assert Attribute('baz') in t.get_change_set_with_ancestors()
+
+    t.rename_attribute(Attribute('foo.bar.bob'), Attribute('foo.bar.carol'))
+    assert_change_sets_correct(t)
+    old_in_memory_definitions, deleted_subtree = t.remove_attribute(Attribute('foo.bar.carol'))
+    assert_change_sets_correct(t)
+    t.restore_attribute(Attribute('foo.bar.carol'), deleted_subtree, old_in_memory_definitions)
+    assert_change_sets_correct(t)
+
+    # reverting to the configured definition is no longer a change
+    t.set_definition(Attribute('baz.qux'), OptionDefinition.undefined())
+    assert_change_sets_correct(t)
+    assert Attribute('baz') not in t.get_change_set_with_ancestors()
+
+    t.set_definition(Attribute('foo.bar.alice'), OptionDefinition.from_expression_string('"alicia"'))
+    t.update_configured_definitions({
+        Attribute('foo.bar.alice'): OptionDefinition.from_expression_string('"alicia"'),
+        Attribute('baz.qux'): OptionDefinition.from_expression_string('"qux"'),
+    })
+    assert_change_sets_correct(t)
+    assert Attribute('baz') in t.get_change_set_with_ancestors(get_configured_changes=True)
+
+
 @pytest.mark.datafiles(SAMPLES_PATH)
 def test_set_configuration_loads():
     option_tree = api.get_option_tree(
@@ -79,3 +264,24 @@ def test_benchmark__hash__(helpers):
             option_tree.count_leaves(root_attr)
             if t.timed_out:
                 raise Exception(f'{i} runs before timeout. Calculating OptionTree.__hash__')
+
+
+def test_benchmark_build(helpers):
+    """
+    Assert an OptionTree of 20,000 options can be built within 2 seconds and uses less than 16 MiB
+    """
+    system_option_data = {
+        Attribute([f'set{i % 60}', f'group{i % 900}', f'option{i}']): {'_type': types.StrType()}
+        for i in range(20000)
+    }
+    with helpers.timeout(seconds=2) as t:
+        option_tree = OptionTree(system_option_data, {})
+        if t.timed_out:
+            raise Exception('Building OptionTree timed out')
+    assert option_tree.count_leaves(Attribute([])) == 20000
+
+    tracemalloc.start()
+    option_tree = OptionTree(system_option_data, {})
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert size < 16 * 1024 * 1024
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+from nixui.options import parse_server
+
+import pytest
+
+
+def test_parse_server_reuses_process(fake_parse_server):
+    server = fake_parse_server
+    sources = ['{ a = 1; }', '"multi\nline ☃"', '', '{ a = {']
+    results = [server.parse(source) for source in sources]
+    process = server.process
+    assert [tree['children'][0]['text'] for _, tree in results] == sources
+    assert [errors for errors, _ in results] == [[], [], [], ['unexpected end of input']]
+    server.parse('1')
+    assert server.process is process
+
+
+def test_parse_server_unavailable(mocker):
+    mocker.patch.object(
+        parse_server.ParseServer, '_start',
+        lambda server: setattr(server, 'process', subprocess.Popen(
+            [sys.executable, '-c', 'import sys; sys.exit(1)'], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        ))
+    )
+    server = parse_server.ParseServer()
+    with pytest.raises(parse_server.ParseServerUnavailable):
+        server.parse('1')
+    assert not server.is_alive()
@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import os
 import tempfile
 import pytest
@@ -16,6 +18,72 @@ def test_get_all_option_values():
     )
 
 
+@pytest.mark.datafiles(SAMPLES_PATH)
+def test_get_all_option_values_module_graph_matches_by_module():
+    module_path = os.path.abspath(os.path.join(SAMPLES_PATH, 'configuration.nix'))
+    from_graph = parser.get_all_option_values(module_path)
+    by_module = parser.get_all_option_values_by_module(module_path)
+    assert list(from_graph) == list(by_module)
+    assert list(from_graph.values()) == list(by_module.values())
+
+
+def test_get_all_option_values_by_module_merge_order(mocker):
+    imports = {'root': ['a', 'b'], 'a': ['c'], 'b': ['c', 'root'], 'c': []}
+    values = {
+        'root': {Attribute('x'): 'root', Attribute('y'): 'root'},
+        'a': {Attribute('x'): 'a'},
+        'b': {Attribute('y'): 'b'},
+        'c': {Attribute('x'): 'c', Attribute('z'): 'c'},
+    }
+    mocker.patch('nixui.options.nix_eval.get_modules_evaluated_import_paths', side_effect=imports.get)
+    mocker.patch('nixui.options.parser.get_module_option_values', side_effect=lambda path, _: dict(values[path]))
+    result = parser.get_all_option_values_by_module('root')
+    # depth first: root, a, c, b, c
+    assert result == {Attribute('x'): 'c', Attribute('y'): 'b', Attribute('z'): 'c'}
+    assert list(result) == [Attribute('x'), Attribute('y'), Attribute('z')]
+
+
+def test_module_option_values_cached_until_import_closure_changes(mocker, tmpdir):
+    module_paths = {}
+    for name in ('root', 'a', 'b'):
+        module_paths[name] = str(tmpdir.join(f'{name}.nix'))
+        with open(module_paths[name], 'w') as f:
+            f.write('{ }')
+    module_graph = {
+        module_paths['root']: {'imports': [module_paths['a']], 'defined_attrs': {}},
+        module_paths['a']: {'imports': [], 'defined_attrs': {}},
+        module_paths['b']: {'imports': [module_paths['a']], 'defined_attrs': {}},
+    }
+    mocker.patch.object(parser, '_module_option_values_cache', collections.OrderedDict())
+    mocker.patch('nixui.options.parser.syntax_tree.preload_syntax_trees')
+    parse = mocker.patch('nixui.options.parser.syntax_tree.SyntaxTree')
+    mocker.patch('nixui.options.parser.get_key_value_nodes', return_value={})
+
+    def parsed_modules():
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            parser.get_merged_option_values(module_graph, executor)
+        parsed = set(call.args[0] for call in parse.call_args_list)
+        parse.reset_mock()
+        return parsed
+
+    assert parsed_modules() == set(module_paths.values())
+    assert parsed_modules() == set()
+    # a module is re-parsed if it or a module it imports changes
+    with open(module_paths['a'], 'w') as f:
+        f.write('{ imports = [ ]; }')
+    assert parsed_modules() == set(module_paths.values())
+    with open(module_paths['root'], 'w') as f:
+        f.write('{ imports = [ ./a.nix ]; }')
+    assert parsed_modules() == {module_paths['root']}
+
+    # the least recently used modules are evicted
+    mocker.patch.object(parser, 'MODULE_OPTION_VALUES_CACHE_SIZE', 2)
+    with open(module_paths['b'], 'w') as f:
+        f.write('{ imports = [ ./a.nix ]; }')
+    assert parsed_modules() == {module_paths['b']}
+    assert len(parser._module_option_values_cache) == 2
+
+
 @pytest.mark.datafiles(SAMPLES_PATH)
 def test_get_all_option_values_correct_attributes():
     module_path = os.path.abspath(os.path.join(SAMPLES_PATH, 'configuration.nix'))
@@ -0,0 +1,219 @@
+from nixui.graphics import navlist
+from nixui.options import search, types
+from nixui.options.attribute import Attribute
+from nixui.options.option_definition import OptionDefinition, Undefined
+from nixui.options.option_tree import OptionData, OptionTree
+from nixui.options.value_index import get_definition_search_text
+
+import pytest
+
+
+def linear_search(tree, search_str):
+    """
+    Search by scanning every option, as SearchResultListDisplay did before the index
+    """
+    tokens = search.tokenize_search_str(search_str)
+    scores = {}
+    for attribute, data in tree.iter_attribute_data():
+        matched_tokens = set()
+        score = [0, 0, 0, 0, 0]
+        for token in tokens:
+            fields = (
+                str(attribute),
+                data._type_string if data._type_string != Undefined else '',
+                data.description if data.description != Undefined else '',
+                get_definition_search_text(tree.in_memory_diff.get(attribute)) or '',
+                get_definition_search_text(tree.configured_change_cache.get(attribute)) or '',
+            )
+            for i, field in enumerate(fields):
+                if token in field.lower():
+                    matched_tokens.add(token)
+                    score[i] += 1
+        if matched_tokens == tokens:
+            scores[attribute] = tuple(score) + (0,)
+    return [
+        (attribute, tuple(operation for operation, count in zip(search.MATCH_OPERATIONS, score) if count > 0))
+        for attribute, score in sorted(scores.items(), key=lambda item: (tuple(-c for c in item[1]), str(item[0])))
+    ]
+
+
+@pytest.fixture
+def search_option_tree(mocker):
+    system_tree = OptionTree(
+        {
+            Attribute('networking.firewall.enable'): {
+                '_type_string': 'boolean', 'description': 'Whether to enable the firewall.'
+            },
+            Attribute('networking.firewall.allowedTCPPorts'): {
+                '_type_string': 'list of 16 bit unsigned integer; between 0 and 65535 (both inclusive)',
+                'description': 'List of TCP ports on which incoming connections are accepted.',
+            },
+            Attribute('networking.hostName'): {
+                '_type_string': 'string', 'description': 'The name of the machine.'
+            },
+            Attribute('users.users'): {
+                '_type': types.AttrsOfType(types.StrType()),
+                '_type_string': 'attribute set of submodules',
+                'description': 'Additional user accounts to be created automatically by the system.',
+            },
+        },
+        {},
+    )
+    mocker.patch(
+        'nixui.options.search.get_system_search_index',
+        return_value=search.SearchIndex(system_tree.iter_attribute_data()),
+    )
+    return system_tree.with_configured({
+        Attribute('users.users.alice'): OptionDefinition.from_expression_string('"alice"'),
+    })
+
+
+@pytest.mark.parametrize('search_str', [
+    'firewall',
+    'FireWall enable',
+    'wall.allow',
+    '"tcp ports"',
+    'string',
+    'alice',
+    'user',
+    '16 bit',
+    '.',
+    'nomatch',
+    '',
+])
+def test_search_matches_linear_search(search_option_tree, search_str):
+    assert search.search_options(search_option_tree, search_str) == linear_search(search_option_tree, search_str)
+
+
+def test_search_matched_operations(search_option_tree):
+    results = search.search_options(search_option_tree, 'firewall')
+    assert results[0] == (Attribute('networking.firewall.enable'), ('Attribute Path', 'Description'))
+    assert (Attribute('networking.firewall.allowedTCPPorts'), ('Attribute Path',)) in results[1:]
+
+
+def test_search_in_memory_attributes(search_option_tree):
+    search_option_tree.insert_attribute(Attribute('users.users.bob'))
+    assert [attribute for attribute, _ in search.search_options(search_option_tree, 'bob')] == [
+        Attribute('users.users.bob')
+    ]
+
+
+def test_search_values(search_option_tree):
+    search_option_tree.set_definition(
+        Attribute('networking.firewall.allowedTCPPorts'), OptionDefinition.from_expression_string('[ 22 80 ]')
+    )
+    search_option_tree.set_definition(
+        Attribute('networking.hostName'), OptionDefinition.from_expression_string('"nvidia-box"')
+    )
+    assert search.search_options(search_option_tree, '22') == [
+        (Attribute('networking.firewall.allowedTCPPorts'), ('In Memory Value',))
+    ]
+    assert search.search_options(search_option_tree, 'nvidia name') == [
+        (Attribute('networking.hostName'), ('Attribute Path', 'Description', 'In Memory Value'))
+    ]
+    assert search.search_options(search_option_tree, '"alice"') == [
+        (Attribute('users.users.alice'), ('Attribute Path', 'Configured Value'))
+    ]
+    assert search.search_options(search_option_tree, 'nvidia') == linear_search(search_option_tree, 'nvidia')
+
+    search_option_tree.rename_attribute(Attribute('users.users.alice'), Attribute('users.users.bob'))
+    search_option_tree.set_definition(Attribute('users.users.bob'), OptionDefinition.from_expression_string('"bob"'))
+    assert search.search_options(search_option_tree, 'bob') == linear_search(search_option_tree, 'bob')
+
+
+def test_incremental_search_refines_previous_results(search_option_tree, mocker):
+    incremental_search = search.IncrementalSearch(search_option_tree)
+    assert incremental_search.search('fire') == linear_search(search_option_tree, 'fire')
+
+    system_index = incremental_search.indexes[0]
+    fire_matches = incremental_search.previous_matches[0]
+    index_search = mocker.spy(system_index, 'search')
+    assert incremental_search.search('firewall en') == linear_search(search_option_tree, 'firewall en')
+    # only the results of 'fire' were searched
+    assert index_search.call_args.args[1] == fire_matches
+
+    # not a refinement, searches the whole index
+    assert incremental_search.search('host') == linear_search(search_option_tree, 'host')
+    assert index_search.call_args.args[1] is None
+
+
+def test_search_worker_searches_value_index_snapshot(search_option_tree):
+    incremental_search = search.IncrementalSearch(search_option_tree)
+    worker = navlist.SearchWorker(incremental_search, '22', generation=1)
+    # edits on the GUI thread while the search is queued don't change the searched values
+    search_option_tree.set_definition(
+        Attribute('networking.firewall.allowedTCPPorts'), OptionDefinition.from_expression_string('[ 22 80 ]')
+    )
+    results = []
+    worker.signals.results_ready.connect(lambda generation, worker_results: results.extend(worker_results))
+    worker.run()
+    assert results == []
+    assert search.search_options(search_option_tree, '22') == [
+        (Attribute('networking.firewall.allowedTCPPorts'), ('In Memory Value',))
+    ]
+
+
+def test_search_result_list_display_streams_batches(qapp, qtbot, mocker, search_option_tree):
+    mocker.patch('nixui.graphics.navlist.api.get_option_tree', return_value=search_option_tree)
+    mocker.patch.object(navlist.SearchResultListDisplay, 'result_batch_size', 2)
+    mocker.patch.object(navlist.SearchResultListDisplay, 'min_exact_results', 0)
+    add_result_batch = mocker.spy(navlist.SearchResultListDisplay, 'add_result_batch')
+
+    display = navlist.SearchResultListDisplay('networking')
+    expected = [str(attribute) for attribute, _ in linear_search(search_option_tree, 'networking')]
+    qtbot.waitUntil(lambda: display.count() == len(expected))
+    assert [display.item(i).option for i in range(display.count())] == [Attribute(a) for a in expected]
+    assert add_result_batch.call_count == len(expected) // 2 + 1
+
+    display.set_search_str('networking.firewall.e')
+    qtbot.waitUntil(lambda: display.count() == 1)
+    assert display.item(0).option == Attribute('networking.firewall.enable')
+
+
+@pytest.mark.parametrize('pattern,text,max_distance,expected', [
+    ('firewall', 'firewall', 1, 0),
+    ('firewal', 'allowedfirewall', 1, 0),
+    ('hardwre', 'hardware', 1, 1),
+    ('hadrware', 'hardware', 1, None),
+    ('hadrware', 'hardware', 2, 2),
+    ('networking', 'net', 2, None),
+])
+def test_substring_edit_distance(pattern, text, max_distance, expected):
+    assert search.substring_edit_distance(pattern, text, max_distance) == expected
+
+
+def test_fuzzy_search(search_option_tree):
+    incremental_search = search.IncrementalSearch(search_option_tree)
+    assert incremental_search.search('networking.firewal.allowedTCP') == []
+    results = incremental_search.fuzzy_search('networking.firewal.allowedTCP')
+    assert results[0] == (Attribute('networking.firewall.allowedTCPPorts'), ('Attribute Path (Fuzzy)',))
+
+    assert incremental_search.search('machne') == []
+    assert incremental_search.fuzzy_search('machne') == [(Attribute('networking.hostName'), ('Description (Fuzzy)',))]
+
+
+def test_search_result_list_display_fuzzy_fallback(qapp, qtbot, mocker, search_option_tree):
+    mocker.patch('nixui.graphics.navlist.api.get_option_tree', return_value=search_option_tree)
+    display = navlist.SearchResultListDisplay('firewll')
+    qtbot.waitUntil(lambda: display.count() > 0)
+    assert display.item(0).option == Attribute('networking.firewall.enable')
+
+
+def test_benchmark_search(helpers):
+    """
+    Assert an index of 20,000 options answers a query within 1/10th of a second
+    """
+    index = search.SearchIndex(
+        (
+            Attribute([f'set{i % 60}', f'group{i % 900}', f'option{i}']),
+            OptionData(
+                _type_string='string', description=f'Description of option number {i} in group {i % 900}.'
+            ),
+        )
+        for i in range(20000)
+    )
+    index.search({'group12'})  # warm up
+    with helpers.timeout(seconds=0.1) as t:
+        index.search({'option1234', 'group'})
+        if t.timed_out:
+            raise Exception('Searching SearchIndex timed out')
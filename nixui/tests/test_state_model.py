@@ -181,3 +181,22 @@ def test_swap_names_simple(minimal_state_model):
     assert minimal_state_model.get_definition(Attribute('myAttrs.newAttribute0')).obj == 'one'
 
     assert hash(minimal_state_model.option_tree) == start_hash
+
+
+def test_slot_mapper_removes_collected_weak_slots():
+    class Receiver:
+        def __init__(self):
+            self.calls = []
+
+        def slot(self, *args):
+            self.calls.append(args)
+
+    slotmapper = state_model.SlotMapper()
+    receiver = Receiver()
+    slotmapper.add_slot('update_recorded', receiver.slot, weak=True)
+    slotmapper('update_recorded')('details')
+    assert receiver.calls == [('details',)]
+
+    del receiver
+    slotmapper('update_recorded')('details')
+    assert slotmapper.slot_fns['update_recorded'] == []
@@ -0,0 +1,338 @@
+import concurrent.futures
+import gc
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+
+import pytest
+
+from nixui.options import syntax_tree
+
+
+def token_dict(kind, start, text):
+    return {'kind': kind, 'text_range': [start, start + len(text)], 'text': text}
+
+
+# { a = 1; }
+SYNTAX_TREE_DICT = {'kind': 'NODE_ROOT', 'text_range': [0, 10], 'children': [
+    {'kind': 'NODE_ATTR_SET', 'text_range': [0, 10], 'children': [
+        token_dict('TOKEN_CURLY_B_OPEN', 0, '{'),
+        token_dict('TOKEN_WHITESPACE', 1, ' '),
+        {'kind': 'NODE_KEY_VALUE', 'text_range': [2, 8], 'children': [
+            {'kind': 'NODE_KEY', 'text_range': [2, 3], 'children': [
+                {'kind': 'NODE_IDENT', 'text_range': [2, 3], 'children': [token_dict('TOKEN_IDENT', 2, 'a')]},
+            ]},
+            token_dict('TOKEN_WHITESPACE', 3, ' '),
+            token_dict('TOKEN_ASSIGN', 4, '='),
+            token_dict('TOKEN_WHITESPACE', 5, ' '),
+            {'kind': 'NODE_LITERAL', 'text_range': [6, 7], 'children': [token_dict('TOKEN_INTEGER', 6, '1')]},
+            token_dict('TOKEN_SEMICOLON', 7, ';'),
+        ]},
+        token_dict('TOKEN_WHITESPACE', 8, ' '),
+        token_dict('TOKEN_CURLY_B_CLOSE', 9, '}'),
+    ]},
+]}
+
+
+def dict_to_tuples(d):
+    if 'children' in d:
+        return (d['kind'], tuple(d['text_range']), tuple(dict_to_tuples(child) for child in d['children']))
+    return (d['kind'], tuple(d['text_range']), d['text'])
+
+
+def elem_to_tuples(elem):
+    if isinstance(elem, syntax_tree.Node):
+        return (elem.name, tuple(elem.position), tuple(elem_to_tuples(child) for child in elem.elems))
+    return (elem.name, tuple(elem.position), elem.quoted)
+
+
+def compute_parents(tree):
+    """
+    Parents of the elements reachable from the root, with a walk of the whole tree
+    """
+    parents = {}
+    stack = [tree.root_id]
+    while stack:
+        node_id = stack.pop()
+        for child_id in tree.children[node_id]:
+            parents[child_id] = node_id
+            if tree.children[child_id] is not None:
+                stack.append(child_id)
+    return parents
+
+
+def assert_parents_consistent(tree):
+    # compare the locally maintained parents with a walk from the root
+    for child_id, parent_id in compute_parents(tree).items():
+        assert tree.parents[child_id] == parent_id
+
+
+@pytest.fixture
+def attr_set_tree(mocker):
+    mocker.patch(
+        'nixui.options.syntax_tree.get_flat_syntax_tree',
+        return_value=syntax_tree.flatten_syntax_tree_dict(SYNTAX_TREE_DICT),
+    )
+    return syntax_tree.SyntaxTree(None, '{ a = 1; }')
+
+
+def test_flat_syntax_tree_round_trip(attr_set_tree):
+    flat_tree = syntax_tree.flatten_syntax_tree_dict(SYNTAX_TREE_DICT)
+    assert len(flat_tree.records) == 16 * syntax_tree.FLAT_RECORD_SIZE
+    assert elem_to_tuples(attr_set_tree.tree) == dict_to_tuples(SYNTAX_TREE_DICT)
+    assert attr_set_tree.to_string() == attr_set_tree.tree.to_string() == '{ a = 1; }'
+
+
+def test_syntax_tree_navigation(attr_set_tree):
+    key_value_node = attr_set_tree.get_node_at_position(2, legal_type='NODE_KEY_VALUE')
+    assert key_value_node.to_string() == 'a = 1;'
+    assert attr_set_tree.get_parent(key_value_node).name == 'NODE_ATTR_SET'
+    assert attr_set_tree.get_previous_token(key_value_node) == syntax_tree.Token._view(attr_set_tree, 3)
+    assert attr_set_tree.get_previous_token(key_value_node).quoted == ' '
+    assert attr_set_tree.get_previous_token(attr_set_tree.tree) is None
+    assert [token.quoted for token in attr_set_tree._iter_tokens(key_value_node)] == ['a', ' ', '=', ' ', '1', ';']
+
+
+def test_syntax_tree_modification(attr_set_tree):
+    key_value_node = attr_set_tree.get_node_at_position(2, legal_type='NODE_KEY_VALUE')
+    value_node = key_value_node.elems[-2]
+    assert value_node.name == 'NODE_LITERAL'
+
+    # detached elements are bound to the tree once inserted
+    new_value_token = syntax_tree.Token(quoted='[ 1 2 ]')
+    attr_set_tree.replace(value_node, new_value_token)
+    assert attr_set_tree.get_parent(new_value_token) == key_value_node
+    assert attr_set_tree.to_string() == '{ a = [ 1 2 ]; }'
+
+    attr_set_node = attr_set_tree.get_parent(key_value_node)
+    insertion_node = syntax_tree.Node()
+    attr_set_tree.insert(attr_set_node, syntax_tree.Token(quoted=' '), -2)
+    attr_set_tree.insert(attr_set_node, insertion_node, -2)
+    attr_set_tree.insert(insertion_node, syntax_tree.Node(elems=[
+        syntax_tree.Token(quoted='b = '), syntax_tree.Token(quoted='2'), syntax_tree.Token(quoted=';'),
+    ]))
+    assert attr_set_tree.to_string() == '{ a = [ 1 2 ]; b = 2; }'
+    assert attr_set_tree.get_previous_token(insertion_node).quoted == ' '
+
+    blank_token = attr_set_tree.remove(key_value_node)
+    assert blank_token.position == (2, 8)
+    assert attr_set_tree.to_string() == '{  b = 2; }'
+
+    eol_token = attr_set_tree.get_previous_token(insertion_node)
+    eol_token.quoted = '\n'
+    eol_token.name = 'MODIFIED_IN_NIX_GUI'
+    assert attr_set_tree.get_token_at_end_of_line(blank_token) == eol_token
+    assert attr_set_tree.to_string() == '{ \nb = 2; }'
+    assert_parents_consistent(attr_set_tree)
+    assert attr_set_tree.parents[key_value_node.id] == attr_set_tree.parents[value_node.id] == -1
+    # removed elements can't be modified
+    with pytest.raises(KeyError):
+        attr_set_tree.replace(key_value_node, syntax_tree.Token(quoted='c = 3;'))
+    with pytest.raises(KeyError):
+        attr_set_tree.remove(value_node)
+
+
+def flatten_definitions_tree(num_definitions):
+    """
+    Flat tree of an attribute set with num_definitions `aNNNNN = 1;` key value definitions
+    """
+    definitions = []
+    for i in range(num_definitions):
+        start = 2 + i * 12
+        definitions += [
+            {'kind': 'NODE_KEY_VALUE', 'text_range': [start, start + 11], 'children': [
+                {'kind': 'NODE_KEY', 'text_range': [start, start + 6], 'children': [
+                    {'kind': 'NODE_IDENT', 'text_range': [start, start + 6], 'children': [
+                        token_dict('TOKEN_IDENT', start, f'a{i:05}'),
+                    ]},
+                ]},
+                token_dict('TOKEN_ASSIGN', start + 6, ' = '),
+                {'kind': 'NODE_LITERAL', 'text_range': [start + 9, start + 10], 'children': [
+                    token_dict('TOKEN_INTEGER', start + 9, '1'),
+                ]},
+                token_dict('TOKEN_SEMICOLON', start + 10, ';'),
+            ]},
+            token_dict('TOKEN_WHITESPACE', start + 11, ' '),
+        ]
+    end = 2 + 12 * num_definitions
+    return syntax_tree.flatten_syntax_tree_dict(
+        {'kind': 'NODE_ROOT', 'text_range': [0, end], 'children': [
+            {'kind': 'NODE_ATTR_SET', 'text_range': [0, end], 'children': [
+                token_dict('TOKEN_CURLY_B_OPEN', 0, '{'), token_dict('TOKEN_WHITESPACE', 1, ' '), *definitions,
+                token_dict('TOKEN_CURLY_B_CLOSE', end - 1, '}'),
+            ]},
+        ]}
+    )
+
+
+def test_benchmark_syntax_tree_memory(mocker):
+    """
+    Assert a tree of 10,000 key value definitions uses less than 100 bytes per element
+    """
+    flat_tree = flatten_definitions_tree(10000)
+    num_elems = len(flat_tree.records) // syntax_tree.FLAT_RECORD_SIZE
+    mocker.patch('nixui.options.syntax_tree.get_flat_syntax_tree', return_value=flat_tree)
+
+    tracemalloc.start()
+    tree = syntax_tree.SyntaxTree(None, '')
+    memory_used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(tree.kinds) == num_elems
+    assert memory_used / num_elems < 100
+
+
+def test_benchmark_syntax_tree_modification(mocker):
+    """
+    Assert replacing 1,000 definitions in a tree of 10,000 definitions takes less time than recomputing the
+    parents of the whole tree 10 times, i.e. a modification doesn't walk the tree.
+    Relative to the machine's speed, replacing took 0.6 walks.
+    """
+    mocker.patch('nixui.options.syntax_tree.get_flat_syntax_tree', return_value=flatten_definitions_tree(10000))
+    tree = syntax_tree.SyntaxTree(None, '')
+    literal_nodes = [
+        syntax_tree.Node._view(tree, elem_id)
+        for elem_id, kind in enumerate(tree.kinds)
+        if tree.kind_names[kind] == 'NODE_LITERAL'
+    ][:1000]
+
+    start = time.perf_counter()
+    for _ in range(10):
+        compute_parents(tree)
+    walk_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for literal_node in literal_nodes:
+        tree.replace(literal_node, syntax_tree.Node('NODE_LITERAL', elems=[syntax_tree.Token(quoted='2')]))
+    assert time.perf_counter() - start < walk_time
+    assert tree.to_string().count(' = 2;') == 1000
+    assert_parents_consistent(tree)
+
+
+def test_syntax_tree_parses_are_shared_by_content(mocker, tmpdir):
+    # unique source, SyntaxTree.from_string and the parse cache live for the whole session
+    source = f'"{uuid.uuid4()}"'
+    dump_syntax_tree_dict = mocker.patch(
+        'nixui.options.syntax_tree._dump_syntax_tree_dict',
+        return_value={'kind': 'NODE_ROOT', 'text_range': [0, len(source)], 'children': [
+            token_dict('TOKEN_STRING', 0, source),
+        ]},
+    )
+    module_path = tmpdir.join('module.nix')
+    module_path.write(source)
+
+    module_tree = syntax_tree.SyntaxTree(str(module_path))
+    string_tree = syntax_tree.SyntaxTree.from_string(source)
+    assert dump_syntax_tree_dict.call_count == 1
+    assert module_tree.to_string() == string_tree.to_string() == source
+    # trees don't share elements, they can be mutated independently
+    assert module_tree.tree != string_tree.tree
+
+
+def test_only_module_parses_are_persisted(mocker, tmpdir):
+    mocker.patch(
+        'nixui.options.syntax_tree._dump_syntax_tree_dict',
+        side_effect=lambda source: {'kind': 'NODE_ROOT', 'text_range': [0, len(source)], 'children': [
+            token_dict('TOKEN_STRING', 0, source),
+        ]},
+    )
+    mocker.patch('nixui.utils.cache._use_diskcache', return_value=True)
+    backend = mocker.patch('nixui.utils.cache._get_backend').return_value
+    backend.get.return_value = None
+
+    syntax_tree.SyntaxTree.from_string(f'"{uuid.uuid4()}"')
+    assert not backend.put.called
+
+    module_path = tmpdir.join('module.nix')
+    module_path.write(f'"{uuid.uuid4()}"')
+    syntax_tree.SyntaxTree(str(module_path))
+    (call_signature, _, _), _ = backend.put.call_args
+    assert call_signature[2] == (str(module_path),)
+
+
+def fake_dump_syntax_tree_dicts(module_paths):
+    results = []
+    for module_path in module_paths:
+        with open(module_path) as f:
+            source = f.read()
+        results.append((module_path, [], {'kind': 'NODE_ROOT', 'text_range': [0, len(source)], 'children': [
+            token_dict('TOKEN_STRING', 0, source),
+        ]}))
+    return results
+
+
+def test_load_many_uses_one_process(mocker, tmpdir):
+    dump_syntax_tree_dicts = mocker.patch(
+        'nixui.options.syntax_tree._dump_syntax_tree_dicts', side_effect=fake_dump_syntax_tree_dicts
+    )
+    sources = {}
+    for i in range(3):
+        module_path = str(tmpdir.join(f'module{i}.nix'))
+        sources[module_path] = f'"{uuid.uuid4()}"'
+        with open(module_path, 'w') as f:
+            f.write(sources[module_path])
+
+    trees = syntax_tree.SyntaxTree.load_many(list(sources))
+    dump_syntax_tree_dicts.assert_called_once_with(list(sources))
+    assert {module_path: tree.to_string() for module_path, tree in trees.items()} == sources
+
+    # already cached
+    syntax_tree.SyntaxTree.load_many(list(sources))
+    assert dump_syntax_tree_dicts.call_count == 1
+
+
+def test_parse_errors_raise(mocker):
+    mocker.patch(
+        'nixui.options.syntax_tree._dump_syntax_tree_dicts',
+        side_effect=lambda module_paths: [(module_paths[0], ['unexpected TOKEN_R_BRACE'], None)],
+    )
+    with pytest.raises(ValueError):
+        syntax_tree.SyntaxTree.from_string(f'{{ {uuid.uuid4()} }}')
+
+
+def test_dump_syntax_tree_dicts_raises_if_process_fails(mocker):
+    # a helper which panics after the first module
+    script = 'print(\'{"path": "a.nix", "errors": [], "tree": null}\'); print(\'{"path": "b\', end=""); exit(101)'
+    popen = subprocess.Popen
+    mocker.patch(
+        'nixui.options.syntax_tree.subprocess.Popen',
+        side_effect=lambda args, **kwargs: popen([sys.executable, '-c', script], **kwargs),
+    )
+    with pytest.raises(ValueError, match='status 101 after parsing 1 of 3 modules'):
+        syntax_tree._dump_syntax_tree_dicts(['a.nix', 'b.nix', 'c.nix'])
+
+
+def test_parse_server_created_once_by_concurrent_calls(mocker):
+    mocker.patch.object(syntax_tree, '_parse_server', None)
+    mocker.patch.object(syntax_tree, '_parse_server_failed', False)
+    create_server = mocker.patch(
+        'nixui.options.syntax_tree.parse_server.create_server', side_effect=lambda: time.sleep(0.05) or object()
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        servers = list(executor.map(lambda _: syntax_tree._get_parse_server(), range(8)))
+    assert create_server.call_count == 1
+    assert all(server is servers[0] for server in servers)
+
+
+def test_from_string_uses_parse_server_without_files(mocker, fake_parse_server):
+    mocker.patch('nixui.options.syntax_tree._get_parse_server', return_value=fake_parse_server)
+    dump_syntax_tree_dicts = mocker.patch('nixui.options.syntax_tree._dump_syntax_tree_dicts')
+    named_temporary_file = mocker.spy(syntax_tree.tempfile, 'NamedTemporaryFile')
+
+    source = f'"{uuid.uuid4()}"'
+    tree = syntax_tree.SyntaxTree.from_string(source)
+    assert tree.to_string() == source
+    syntax_tree.SyntaxTree.from_string(f'"{uuid.uuid4()}"')
+    assert not dump_syntax_tree_dicts.called
+    assert not named_temporary_file.called
+
+    # a file is only written once a path is needed, and removed with the tree
+    module_path = tree.module_path
+    with open(module_path) as f:
+        assert f.read() == source
+    syntax_tree.SyntaxTree.from_string.cache_clear()
+    del tree
+    gc.collect()
+    assert not os.path.exists(module_path)
@@ -1,52 +1,428 @@
+import atexit
+import collections
 import copy
 import functools
 import json
 import os
 import hashlib
 import pickle
+import sqlite3
+import tempfile
+import threading
+import time
 
 import nixui
-from nixui.utils import store
+from nixui.utils import file_fingerprint, store
+from nixui.utils.logger import logger
+
+
+RECORD_SUFFIX = '.pickle'
+TEMP_SUFFIX = '.tmp'
+DEFAULT_MAX_SIZE_MB = 512
+
+
+def _get_args_hash(call_signature):
+    _, _, args, kwargs = call_signature
+    return hashlib.sha256(json.dumps([args, kwargs], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _get_version():
+    return nixui.__version__
 
 
 @functools.lru_cache()
-def _get_cache_path(call_signature, key):
-    module, function, args, kwargs = call_signature
-    hashval = hashlib.md5(json.dumps([args, kwargs], sort_keys=True).encode('utf-8')).hexdigest()
-    filename = f'{_get_version()}/{module}/{function}/{hashval}.{key}'
+def _use_diskcache():
+    return json.loads(os.environ.get('USE_DISKCACHE', 'true'))
+
+
+def _get_max_size():
+    return int(float(os.environ.get('NIXGUI_CACHE_MAX_SIZE_MB', DEFAULT_MAX_SIZE_MB)) * 1024 * 1024)
+
+
+##############
+# File backend
+##############
+def _get_cache_root():
+    return os.path.join(store.get_store_path(), 'func_cache')
+
+
+@functools.lru_cache()
+def _get_cache_path(call_signature):
+    """
+    Path of the record storing the hash_result and result of call_signature
+    """
+    module, function, _, _ = call_signature
+    filename = f'{_get_version()}/{module}/{function}/{_get_args_hash(call_signature)}{RECORD_SUFFIX}'
     path = os.path.join(
-        store.get_store_path(),
-        'func_cache',
+        _get_cache_root(),
         filename
     )
-    if not os.path.exists(os.path.dirname(path)):
-        os.makedirs(os.path.dirname(path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)  # may be created concurrently
     return path
 
 
-def _save_to_disk_cache(call_signature, key, return_value):
-    filepath = _get_cache_path(call_signature, key)
-    with open(filepath, 'wb') as f:
-        pickle.dump(return_value, f)
+def _save_to_disk_cache(call_signature, hash_result, return_value):
+    """
+    Atomically write the record, readers either see the previous record or the complete new one
+    """
+    filepath = _get_cache_path(call_signature)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(filepath), suffix=TEMP_SUFFIX, delete=False) as f:
+        pickle.dump((hash_result, return_value), f)
+    with _disk_cache_size_lock:
+        try:
+            replaced_size = os.path.getsize(filepath)
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(f.name, filepath)
+        _record_written(filepath, replaced_size)
 
 
-def _get_from_disk_cache(call_signature, key):
-    filepath = _get_cache_path(call_signature, key)
-    with open(filepath, 'rb') as f:
-        return pickle.load(f)
+def _get_from_disk_cache(call_signature):
+    """
+    Return the (hash_result, result) record of call_signature, or None if it isn't cached
+    """
+    filepath = _get_cache_path(call_signature)
+    try:
+        with open(filepath, 'rb') as f:
+            record = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+        logger.warning(f'Removing unreadable cache record {filepath}: {e}')
+        os.remove(filepath)
+        return None
+    os.utime(filepath)  # mark as recently used for LRU eviction
+    return record
 
 
-def _get_version():
-    return nixui.__version__
+_disk_cache_size = None  # total size of records, calculated on first write
+# records are written concurrently, e.g. by modules loaded in parallel, the size and pruning are guarded
+_disk_cache_size_lock = threading.RLock()
 
 
-def _is_in_disk_cache(call_signature, key):
-    return os.path.exists(_get_cache_path(call_signature, key))
+def _record_written(filepath, replaced_size=0):
+    """
+    replaced_size: size of the previous record of the same call signature
+    """
+    global _disk_cache_size
+    with _disk_cache_size_lock:
+        if _disk_cache_size is None:
+            _disk_cache_size = sum(size for _, size, _ in _iter_cache_files())
+        else:
+            _disk_cache_size += os.path.getsize(filepath) - replaced_size
+        if _disk_cache_size > _get_max_size():
+            _prune_files(_get_max_size(), remove_stale=False)
 
 
-@functools.lru_cache()
-def _use_diskcache():
-    return json.loads(os.environ.get('USE_DISKCACHE', 'true'))
+def _iter_cache_files():
+    """
+    Yield (path, size, mtime) of every file in the cache directory
+    """
+    for dirpath, _, filenames in os.walk(_get_cache_root()):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed concurrently
+            yield path, st.st_size, st.st_mtime
+
+
+def _is_stale(path, mtime):
+    """
+    Records of other nix-gui versions, records of the previous two-file layout and abandoned temporary files
+    """
+    relpath = os.path.relpath(path, _get_cache_root())
+    if path.endswith(TEMP_SUFFIX):
+        return time.time() - mtime > 60 * 60  # may still be written to by another process
+    return (
+        relpath.split(os.sep)[0] != _get_version() or
+        not path.endswith(RECORD_SUFFIX)
+    )
+
+
+def _remove_empty_stale_directories():
+    for version in os.listdir(_get_cache_root()):
+        if version == _get_version():
+            continue
+        for dirpath, _, _ in os.walk(os.path.join(_get_cache_root(), version), topdown=False):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass  # not empty or not a directory
+
+
+def _get_file_stats():
+    stats = collections.defaultdict(lambda: {'count': 0, 'size': 0})
+    for path, size, _ in _iter_cache_files():
+        relpath = os.path.relpath(path, _get_cache_root())
+        key = tuple(relpath.split(os.sep)[:3])
+        stats[key]['count'] += 1
+        stats[key]['size'] += size
+    return dict(stats)
+
+
+def _prune_files(max_size, remove_stale=True):
+    with _disk_cache_size_lock:
+        return _prune_files_locked(max_size, remove_stale)
+
+
+def _prune_files_locked(max_size, remove_stale):
+    global _disk_cache_size
+    if not os.path.exists(_get_cache_root()):
+        return 0, 0
+
+    removed_count, removed_size = 0, 0
+    records = []
+    for path, size, mtime in _iter_cache_files():
+        if remove_stale and _is_stale(path, mtime):
+            os.remove(path)
+            removed_count += 1
+            removed_size += size
+        else:
+            records.append((mtime, path, size))
+
+    total_size = sum(size for _, _, size in records)
+    for _, path, size in sorted(records):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed_count += 1
+        removed_size += size
+
+    if remove_stale:
+        _remove_empty_stale_directories()
+
+    _disk_cache_size = total_size
+    return removed_count, removed_size
+
+
+class FileBackend:
+    """
+    Stores each record in its own file under func_cache/<version>/<module>/<function>/
+    """
+    def get(self, call_signature):
+        return _get_from_disk_cache(call_signature)
+
+    def put(self, call_signature, hash_result, return_value):
+        _save_to_disk_cache(call_signature, hash_result, return_value)
+
+    def preload(self, module, function):
+        pass
+
+    def get_stats(self):
+        return _get_file_stats()
+
+    def prune(self, max_size, remove_stale=True):
+        return _prune_files(max_size, remove_stale)
+
+
+################
+# SQLite backend
+################
+class SqliteBackend:
+    """
+    Stores all records in a single SQLite database, func_cache.sqlite3, in the store path
+    Each connection is used only by the thread which opened it.
+    Reads don't write to the database, the last use of each record read is kept in memory and written with
+    the next `put`, `prune` or at exit.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._preloaded = {}  # (module, function, args_hash) -> pickled (hash_result, result)
+        self._preloaded_functions = set()
+        self._last_used = {}  # (module, function, args_hash) -> time of the last read not yet written
+        self._lock = threading.Lock()
+        atexit.register(self.flush_last_used)
+
+    @staticmethod
+    def get_db_path():
+        return os.path.join(store.get_store_path(), 'func_cache.sqlite3')
+
+    def _get_connection(self):
+        db_path = self.get_db_path()
+        connections = self._local.__dict__.setdefault('connections', {})
+        if db_path not in connections:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            connection = sqlite3.connect(db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS records (
+                    version TEXT NOT NULL,
+                    module TEXT NOT NULL,
+                    function TEXT NOT NULL,
+                    args_hash TEXT NOT NULL,
+                    record BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (version, module, function, args_hash)
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS records_last_used ON records (last_used)')
+            connection.commit()
+            connections[db_path] = connection
+        return connections[db_path]
+
+    def preload(self, module, function):
+        """
+        Load every record of a function with a single query, later `get` calls don't touch the database
+        """
+        with self._lock:
+            if (module, function) in self._preloaded_functions:
+                return
+            self._preloaded_functions.add((module, function))
+        rows = self._get_connection().execute(
+            'SELECT args_hash, record FROM records WHERE version = ? AND module = ? AND function = ?',
+            (_get_version(), module, function)
+        ).fetchall()
+        for args_hash, record in rows:
+            self._preloaded[(module, function, args_hash)] = record
+
+    def _write_last_used(self, connection):
+        """
+        Write the pending last use times of read records, within the caller's transaction
+        """
+        with self._lock:
+            last_used, self._last_used = self._last_used, {}
+        connection.executemany(
+            'UPDATE records SET last_used = ? WHERE version = ? AND module = ? AND function = ? AND args_hash = ?',
+            [(used, _get_version(), *key) for key, used in last_used.items()]
+        )
+
+    def flush_last_used(self):
+        if not self._last_used or not os.path.exists(self.get_db_path()):
+            return
+        connection = self._get_connection()
+        with connection:
+            self._write_last_used(connection)
+
+    def get(self, call_signature):
+        module, function, _, _ = call_signature
+        args_hash = _get_args_hash(call_signature)
+        record = self._preloaded.pop((module, function, args_hash), None)
+        if record is None:
+            row = self._get_connection().execute(
+                'SELECT record FROM records WHERE version = ? AND module = ? AND function = ? AND args_hash = ?',
+                (_get_version(), module, function, args_hash)
+            ).fetchone()
+            if row is None:
+                return None
+            record = row[0]
+        with self._lock:
+            self._last_used[(module, function, args_hash)] = time.time()
+        try:
+            return pickle.loads(record)
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            logger.warning(f'Removing unreadable cache record {call_signature}: {e}')
+            with self._lock:
+                self._last_used.pop((module, function, args_hash), None)
+            connection = self._get_connection()
+            with connection:
+                connection.execute(
+                    'DELETE FROM records WHERE version = ? AND module = ? AND function = ? AND args_hash = ?',
+                    (_get_version(), module, function, args_hash)
+                )
+            return None
+
+    def put(self, call_signature, hash_result, return_value):
+        module, function, _, _ = call_signature
+        record = pickle.dumps((hash_result, return_value))
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (_get_version(), module, function, _get_args_hash(call_signature), record, len(record), time.time())
+            )
+            self._write_last_used(connection)
+            total_size, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM records').fetchone()
+        if total_size > _get_max_size():
+            self.prune(_get_max_size(), remove_stale=False)
+
+    def get_stats(self):
+        if not os.path.exists(self.get_db_path()):
+            return {}
+        rows = self._get_connection().execute(
+            'SELECT version, module, function, COUNT(*), SUM(size) FROM records GROUP BY version, module, function'
+        ).fetchall()
+        return {
+            (version, module, function): {'count': count, 'size': size}
+            for version, module, function, count, size in rows
+        }
+
+    def prune(self, max_size, remove_stale=True):
+        if not os.path.exists(self.get_db_path()):
+            return 0, 0
+        connection = self._get_connection()
+        removed_count, removed_size = 0, 0
+        with connection:
+            self._write_last_used(connection)
+            if remove_stale:
+                count, size = connection.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM records WHERE version != ?', (_get_version(),)
+                ).fetchone()
+                connection.execute('DELETE FROM records WHERE version != ?', (_get_version(),))
+                removed_count, removed_size = count, size
+
+            total_size, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM records').fetchone()
+            evicted_rowids = []
+            for rowid, size in connection.execute('SELECT rowid, size FROM records ORDER BY last_used'):
+                if total_size <= max_size:
+                    break
+                evicted_rowids.append((rowid,))
+                total_size -= size
+                removed_count += 1
+                removed_size += size
+            connection.executemany('DELETE FROM records WHERE rowid = ?', evicted_rowids)
+        if remove_stale:
+            connection.execute('VACUUM')
+        return removed_count, removed_size
+
+
+_backends = {
+    'file': FileBackend(),
+    'sqlite': SqliteBackend(),
+}
+
+
+def _get_backend():
+    return _backends[os.environ.get('NIXGUI_CACHE_BACKEND', 'sqlite')]
+
+
+def get_stats():
+    """
+    Get the number of records and their total size in bytes for each cached function
+    Returns mapping of (version, module, function) -> {'count': int, 'size': int}
+    """
+    return _get_backend().get_stats()
+
+
+def prune(max_size=None, remove_stale=True):
+    """
+    Remove stale records (records from other versions of nix-gui and leftovers of old cache layouts), then
+    remove least recently used records until the cache is no larger than max_size bytes.
+    Returns the number of removed records and the number of bytes freed
+    """
+    max_size = _get_max_size() if max_size is None else max_size
+    removed_count, removed_size = _get_backend().prune(max_size, remove_stale)
+    logger.info(f'Pruned {removed_count} cache records ({removed_size} bytes)')
+    return removed_count, removed_size
+
+
+CacheInfo = collections.namedtuple('CacheInfo', ['memory_hits', 'disk_hits', 'misses'])
+
+_cache_infos = {}  # (module, function) -> function returning its CacheInfo
+
+
+def get_cache_infos():
+    """
+    Get the CacheInfo (memory hits, disk hits and misses) of each function decorated with `cache`
+    """
+    return {key: cache_info() for key, cache_info in _cache_infos.items()}
 
 
 def cache(retain_hash_fn=(lambda *args, **kwargs: 0), return_copy=True, diskcache=True):
@@ -59,41 +435,75 @@ def cache(retain_hash_fn=(lambda *args, **kwargs: 0), return_copy=True, diskcach
     def cache(function):
         args_hash_result_map = {}
         args_return_value_map = {}
+        # call signatures whose disk record is mirrored in memory, the disk needn't be checked again
+        disk_synced_call_signatures = set()
+        counter = collections.Counter()
+
+        def lookup(call_signature, hash_result):
+            """
+            Where the result of call_signature is cached with a consistent hash-check: 'memory', 'disk' or None
+            """
+            # fast path: cached in memory and the hash-check is consistent
+            if call_signature in args_return_value_map and hash_result == args_hash_result_map[call_signature]:
+                return 'memory'
+
+            # if fn-arg results cached in disk but not in memory, load disk to memory
+            if diskcache and _use_diskcache() and call_signature not in disk_synced_call_signatures:
+                backend = _get_backend()
+                backend.preload(function.__module__, function.__name__)
+                record = backend.get(call_signature)
+                disk_synced_call_signatures.add(call_signature)
+                if record is not None:
+                    args_hash_result_map[call_signature], args_return_value_map[call_signature] = record
+                    if hash_result == args_hash_result_map[call_signature]:
+                        return 'disk'
+            return None
+
+        def get_call_signature(args, kwargs):
+            return (function.__module__, function.__name__, args, tuple(kwargs.items()))
+
+        @functools.wraps(function)
         def wrapper(*args, **kwargs):
             hash_result = retain_hash_fn(*args, **kwargs)
-            call_signature = (function.__module__, function.__name__, args, tuple(kwargs.items()))
-
-            if diskcache and _use_diskcache():
-                # if fn-arg results cached in disk but not in memory, load disk to memory
-                if call_signature not in args_return_value_map:
-                    if _is_in_disk_cache(call_signature, 'result'):
-                        try:
-                            hash_result = _get_from_disk_cache(call_signature, 'hash_result')
-                            result = _get_from_disk_cache(call_signature, 'result')
-                        except EOFError:
-                            pass  # indicates that the cached result didn't save properly
-                        else:
-                            args_hash_result_map[call_signature] = hash_result
-                            args_return_value_map[call_signature] = result
-
-            # if cached in memory and the hash-check is consistent, return the memcached result, otherwise calculate the result
-            if call_signature in args_return_value_map and hash_result == args_hash_result_map[call_signature]:
+            call_signature = get_call_signature(args, kwargs)
+
+            cached_in = lookup(call_signature, hash_result)
+            if cached_in is not None:
+                counter[f'{cached_in}_hits'] += 1
+                if isinstance(hash_result, file_fingerprint.FileSetFingerprint):
+                    # later fingerprints include the dependencies of the cached result, e.g. from a previous run
+                    hash_result.record_dependencies(args_hash_result_map[call_signature])
                 res = args_return_value_map[call_signature]
-                if return_copy:
-                    res = copy.copy(res)
-            else:
-                res = function(*args, **kwargs)
-                args_hash_result_map[call_signature] = hash_result
-                args_return_value_map[call_signature] = res
+                return copy.copy(res) if return_copy else res
+
+            use_diskcache = diskcache and _use_diskcache()
 
-            if diskcache and _use_diskcache() and not _is_in_disk_cache(call_signature, 'result'):
-                _save_to_disk_cache(call_signature, 'result', res)
-                _save_to_disk_cache(call_signature, 'hash_result', hash_result)
+            # calculate the result
+            counter['misses'] += 1
+            res = function(*args, **kwargs)
+            if isinstance(hash_result, file_fingerprint.FileSetFingerprint):
+                # the call may have recorded the files the result depends on, include them in the fingerprint
+                hash_result = retain_hash_fn(*args, **kwargs)
+            args_hash_result_map[call_signature] = hash_result
+            args_return_value_map[call_signature] = res
+            # replace the record, if it exists it was calculated with a different hash_result
+            if use_diskcache:
+                _get_backend().put(call_signature, hash_result, res)
+                disk_synced_call_signatures.add(call_signature)
 
             return res
+
+        wrapper.cache_info = lambda: CacheInfo(counter['memory_hits'], counter['disk_hits'], counter['misses'])
+        # whether calling with the arguments would return a cached result rather than calling the function
+        wrapper.is_cached = lambda *args, **kwargs: lookup(
+            get_call_signature(args, kwargs), retain_hash_fn(*args, **kwargs)
+        ) is not None
+        _cache_infos[(function.__module__, function.__name__)] = wrapper.cache_info
         return wrapper
     return cache
 
 
-configuration_path_hash_fn = lambda: hashlib.sha256(open(os.environ['CONFIGURATION_PATH'], 'rb').read()).hexdigest()
-first_arg_path_hash_fn = lambda path=None: hashlib.sha256(open(path or os.environ['CONFIGURATION_PATH'], 'rb').read()).hexdigest()
+configuration_path_hash_fn = lambda: file_fingerprint.get_file_hash(os.environ['CONFIGURATION_PATH'])
+first_arg_path_hash_fn = lambda path=None: file_fingerprint.get_file_hash(path or os.environ['CONFIGURATION_PATH'])
+# also invalidated when any file recorded with file_fingerprint.set_dependencies(path, ...), e.g. an import, changes
+first_arg_import_closure_hash_fn = lambda path=None: file_fingerprint.FileSetFingerprint(path or os.environ['CONFIGURATION_PATH'])
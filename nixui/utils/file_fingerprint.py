@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+
+
+_file_hashes = {}  # path -> (stat tuple, sha256 hexdigest)
+_dependencies = {}  # root path -> set of paths which results derived from the root path depend on
+_lock = threading.Lock()
+
+
+def _get_stat_tuple(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _hash_file_contents(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_file_hash(path):
+    """
+    sha256 of the file at path, only re-read if its modification time, size or inode changed.
+    Returns None if the file doesn't exist.
+    """
+    try:
+        stat_tuple = _get_stat_tuple(path)
+    except FileNotFoundError:
+        return None
+    cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == stat_tuple:
+        return cached[1]
+    file_hash = _hash_file_contents(path)
+    _file_hashes[path] = (stat_tuple, file_hash)
+    return file_hash
+
+
+def set_dependencies(root_path, paths):
+    """
+    Record that results derived from root_path (e.g. a configuration) also depend on paths (e.g. its imports)
+    """
+    with _lock:
+        _dependencies[root_path] = set(paths) - {root_path}
+
+
+def get_dependencies(root_path):
+    return set(_dependencies.get(root_path, ()))
+
+
+class FileSetFingerprint:
+    """
+    Content hashes of a root file and the files it is known to depend on.
+
+    Two fingerprints of the same root are equal if they agree on the hashes of the files recorded in both, and
+    every file recorded in only one still has its recorded hash. A fingerprint taken before the dependencies are
+    known, e.g. on the first call after startup, is therefore equal to a persisted fingerprint which includes them,
+    unless one of the dependencies changed.
+    """
+    def __init__(self, root_path):
+        self.root_path = root_path
+        self.file_hashes = {
+            path: get_file_hash(path)
+            for path in {root_path} | get_dependencies(root_path)
+        }
+
+    def is_current(self):
+        return all(get_file_hash(path) == file_hash for path, file_hash in self.file_hashes.items())
+
+    def record_dependencies(self, other):
+        """
+        Record the dependencies of other, e.g. a persisted fingerprint equal to this one, so later fingerprints of
+        the root include them
+        """
+        with _lock:
+            _dependencies.setdefault(self.root_path, set()).update(
+                set(other.file_hashes) - {self.root_path}
+            )
+
+    def __eq__(self, other):
+        if not isinstance(other, FileSetFingerprint) or self.root_path != other.root_path:
+            return False
+        # files recorded by both are compared without reading them, only the others are checked
+        for path in self.file_hashes.keys() & other.file_hashes.keys():
+            if self.file_hashes[path] != other.file_hashes[path]:
+                return False
+        return all(
+            get_file_hash(path) == file_hashes[path]
+            for file_hashes, other_file_hashes in ((self.file_hashes, other.file_hashes),
+                                                   (other.file_hashes, self.file_hashes))
+            for path in file_hashes.keys() - other_file_hashes.keys()
+        )
+
+    # equality depends on the files recorded in only one of the fingerprints, no hash is consistent with it
+    __hash__ = None
+
+    def __repr__(self):
+        return f'FileSetFingerprint({self.root_path}, {len(self.file_hashes)} files)'